@@ -29,11 +29,12 @@ import sys
 
 sys.path.append(os.path.dirname(__file__))
 
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, render_template, request
 from flask_session import Session
 from flask_cors import CORS
 from werkzeug.debug import *
 from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 from idpyoidc.configure import Configuration
 from idpyoidc.configure import create_from_config_file
 from idpyoidc.server.configure import OPConfiguration
@@ -44,6 +45,9 @@ from pycose.keys import EC2Key
 from cryptography.hazmat.backends import default_backend
 from cryptography import x509
 from app_config.config_service import ConfService as cfgserv
+from .form_store import FormStoreFull
+from .kv_store import get_store
+from .session_store import StoreSessionInterface
 
 
 # Log
@@ -212,6 +216,15 @@ def handle_exception(e):
     )
 
 
+def form_store_full(e):
+    cfgserv.app_logger.warning("Form data budget reached, form data refused")
+    return (
+        "Error 503: " + cfgserv.error_list["503"] + "\n",
+        503,
+        {"Retry-After": str(cfgserv.form_retry_after)},
+    )
+
+
 def page_not_found(e):
     cfgserv.app_logger.exception("- WARN - Error 404")
     return (
@@ -227,23 +240,33 @@ def page_not_found(e):
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
+    if cfgserv.proxy_trusted_hops > 0:
+        # client IP address (request.remote_addr) from the trusted reverse proxies
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=cfgserv.proxy_trusted_hops)
 
     app.register_error_handler(Exception, handle_exception)
     app.register_error_handler(404, page_not_found)
+    app.register_error_handler(FormStoreFull, form_store_full)
 
     @app.route("/", methods=["GET"])
     def initial_page():
-        return render_template(
+        from . import page_cache
+
+        return page_cache.render_page(
             "misc/initial_page.html", oidc=cfgserv.oidc, service_url=cfgserv.service_url
         )
 
+    from . import static_assets
+
+    static_assets.init_app(app)
+
     @app.route("/favicon.ico")
     def favicon():
-        return send_from_directory("static/images", "favicon.ico")
+        return static_assets.send_asset("images/favicon.ico")
 
     @app.route("/ic-logo.png")
     def logo():
-        return send_from_directory("static/images", "ic-logo.png")
+        return static_assets.send_asset("images/ic-logo.png")
 
     app.config.from_mapping(SECRET_KEY="dev")
 
@@ -273,7 +296,9 @@ def create_app(test_config=None):
         route_dynamic,
         route_oid4vp,
         preauthorization,
-        revocation
+        revocation,
+        qr_code,
+        route_admin
     )
 
     app.register_blueprint(route_eidasnode.eidasnode)
@@ -283,13 +308,27 @@ def create_app(test_config=None):
     app.register_blueprint(route_oid4vp.oid4vp)
     app.register_blueprint(route_dynamic.dynamic)
     app.register_blueprint(preauthorization.preauth)
+    app.register_blueprint(qr_code.qr)
+    app.register_blueprint(route_admin.admin)
+    app.register_blueprint(static_assets.assets)
 
     # config session
-    app.config["SESSION_FILE_THRESHOLD"] = 50
     app.config["SESSION_PERMANENT"] = False
-    app.config["SESSION_TYPE"] = "filesystem"
     app.config.update(SESSION_COOKIE_SAMESITE="None", SESSION_COOKIE_SECURE=True)
-    Session(app)
+
+    if cfgserv.session_backend == "filesystem":
+        app.config["SESSION_FILE_THRESHOLD"] = 50
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+    else:
+        if cfgserv.session_backend == "memory" and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            cfgserv.app_logger.warning(
+                "Memory sessions are not shared between worker processes, set SESSION_BACKEND=redis"
+            )
+        app.session_interface = StoreSessionInterface(
+            get_store(cfgserv.session_backend, cfgserv.redis_url),
+            lifetime=cfgserv.session_expiry * 60,
+        )
 
     # CORS is a mechanism implemented by browsers to block requests from domains other than the server's one.
     CORS(app, supports_credentials=True)
@@ -321,6 +360,11 @@ def create_app(test_config=None):
 
     app.server = server
 
+    if cfgserv.deferred_worker:
+        from . import deferred_worker
+
+        deferred_worker.start(app)
+
     return app
 
 
@@ -28,3 +28,10 @@ flask_secret_key = "secret_here"
 eidasnode_lightToken_secret = "secret_here"
 
 revocation_api_key = "secret_here"
+
+# X-Api-Key of the /admin endpoints
+admin_api_key = "secret_here"
+
+# Secret of the HS256 and A256GCM c_nonces (nonce_service.py), shared by all the service nodes.
+# Use a long random value, e.g. python -c "import secrets; print(secrets.token_urlsafe(32))"
+nonce_secret_key = "secret_here"
@@ -42,6 +42,31 @@ class ConfService:
 
     revocation_service_url = "https://marmot-civil-gratefully.ngrok-free.app/token_status_list/take"
 
+    # Status list entries of the credentials: "local" (status_list.py, served at
+    # revocation/status_list/<list id>) or "remote" (revocation_service_url, with revocation_api_key)
+    status_list_mode = os.getenv("STATUS_LIST_MODE", "local")
+
+    # Status lists and credential statuses (SQLite database)
+    status_list_db = os.getenv("STATUS_LIST_DB", "/tmp/eudiw/status_list.sqlite")
+
+    # Entries per status list (power of 2) and bits per entry (1: valid/invalid, 2: also suspended)
+    status_list_size = 2**17
+    status_list_bits = 2
+
+    # Indexes reserved per database write
+    status_list_block = 1024
+
+    # Status list token: ttl claim / Cache-Control max-age (seconds) and expiry (seconds)
+    status_list_ttl = 300
+    status_list_token_expiry = 24 * 3600
+
+    # Presented credentials: status list check, timeout (seconds) of the status list fetches, ttl
+    # (seconds) of the lists without ttl or max-age, and number of cached lists
+    status_list_check = True
+    status_list_fetch_timeout = 5
+    status_list_default_ttl = 300
+    status_list_cache_size = 256
+
     # ---------------------------------------------------------------------------
     trusted_CAs_path = "/etc/eudiw/pid-issuer/cert/"
 
@@ -62,9 +87,28 @@ class ConfService:
         service_url + "EidasNode/SpecificConnectorRequest"
     )
 
-    #Nonce endpoint
+    #Nonce endpoint (RSA-OAEP nonces)
     nonce_key = "api_docs/test_tokens/nonce_rsa4096.pem"
 
+    # Nonce algorithm: "HS256" or "A256GCM" (nonce_service.py, secret nonce_secret_key of
+    # config_secrets.py), or "RSA-OAEP" (openid4v encrypted nonce, nonce_key read for every nonce)
+    nonce_algorithm = os.getenv("NONCE_ALGORITHM", "HS256")
+
+    # Nonce expiry time (minutes), for the HS256 and A256GCM nonces
+    nonce_expiry = 10
+
+    # Proof replay detection window (minutes), should not be shorter than the nonce lifetime
+    proof_replay_window = 10
+
+    # Proof replay detection: number of time buckets in the window
+    proof_replay_buckets = 10
+
+    # Proof replay detection: maximum number of proofs kept per bucket
+    proof_replay_max_entries = 100000
+
+    # Proof replay detection: Bloom filter size (bits) per bucket, 0 disables the filter
+    proof_replay_bloom_bits = 2**21
+
     # eIDAS node PID attributes
     eidasnode_pid_attributes = ["CurrentFamilyName", "CurrentGivenName", "DateOfBirth"]
 
@@ -78,12 +122,194 @@ class ConfService:
     # Deferred endpoint expiry time (minutes)
     deffered_expiry = 60
 
+    # Deferred issuance worker (deferred credentials are built in the background)
+    deferred_worker = True
+
+    # Deferred issuance queue (SQLite database)
+    deferred_db = os.getenv("DEFERRED_DB", "/tmp/eudiw/deferred.sqlite")
+
+    # Maximum number of deferred credentials built at the same time
+    deferred_workers = 2
+
+    # Deferred queue polling interval (seconds), also returned to the wallet as interval
+    deferred_poll_interval = 5
+
+    # Deferred issuance retry backoff (seconds), doubled after each failed attempt
+    deferred_retry_backoff = 5
+    deferred_retry_max_backoff = 300
+
+    # Signing worker processes (0: the credentials are signed on the request threads)
+    signing_workers = int(os.getenv("SIGNING_WORKERS", "0"))
+
+    # Maximum number of queued or running signing jobs, and maximum wait (seconds) for a free slot
+    signing_max_pending = 256
+    signing_queue_timeout = 5
+
+    # DS key rotation overlap (seconds): a DS key (ds_keys in config_countries.py) takes traffic
+    # progressively during the first overlap of its validity, and drains during the last one
+    ds_key_overlap = 24 * 3600
+
+    # A DS key whose signature failed is left out for ds_key_retry seconds (doubled after each
+    # consecutive failure, up to ds_key_retry_max)
+    ds_key_retry = 10
+    ds_key_retry_max = 600
+
+    # Maximum number of open sessions per PKCS#11 document signer (countries with pkcs11_module)
+    pkcs11_sessions = 8
+
+    # Credential response encryption (app/response_encryption.py, False: encrypted by openid4v)
+    response_encryption = True
+
+    # Content encryption algorithms (enc) accepted for the encrypted credential responses
+    response_encryption_enc = [
+        "A128GCM",
+        "A192GCM",
+        "A256GCM",
+        "A128CBC-HS256",
+        "A192CBC-HS384",
+        "A256CBC-HS512",
+    ]
+
+    # Key agreement threads (0: on the request thread) and cache size of the parsed wallet keys
+    response_encryption_workers = 4
+    response_encryption_cache_size = 1024
+
+    # Notification events are queued and written in batches (False: handled by the notification endpoint)
+    notification_async = True
+
+    # Notification events log and counters (SQLite database)
+    notification_db = os.getenv("NOTIFICATION_DB", "/tmp/eudiw/notification.sqlite")
+
+    # Maximum number of queued notification events (503 when full)
+    notification_queue_size = 10000
+
+    # Maximum number of notification events per write, and maximum wait (seconds) before a write
+    notification_batch_size = 500
+    notification_flush_interval = 1
+
+    # Portrait images: maximum file size (bytes) and number of pixels
+    image_max_bytes = 2 * 1024 * 1024
+    image_max_pixels = 4096 * 4096
+
+    # Portrait conversion processes (0 converts on the request thread) and converted images cache size
+    image_workers = 2
+    image_cache_size = 128
+
+    # Maximum number of queued or running portrait conversions, and maximum wait (seconds) for a free slot
+    image_max_pending = 32
+    image_queue_timeout = 2
+
+    # JPEG quality of the converted portraits
+    portrait_jpeg_quality = 75
+
+    # Binary claims (portraits) of at least blob_min_size characters are kept once in the blob store,
+    # per-user form data only holds a reference
+    blob_min_size = 1024
+
+    # Form data (form_dynamic_data) budget: new form submissions are refused (503) when it is reached
+    form_max_entries = 50000
+    form_max_bytes = 256 * 1024 * 1024
+    form_retry_after = 60  # Retry-After (seconds) of the refused submissions
+
     # transaction code expiry time (minutes)
     tx_code_expiry = 60
 
     # Form data expiry time (minutes)
     form_expiry = 60
 
+    # Maximum number of prepared claim templates (claim_templates.py)
+    claim_template_cache_size = 256
+
+    # Credential offer mode: "value" (credential_offer) or "reference" (credential_offer_uri)
+    credential_offer_mode = os.getenv("CREDENTIAL_OFFER_MODE", "value")
+
+    # ------------------------------------------------------------------------------------------------
+    # Session and shared state store
+
+    # Redis protocol server (Redis, Valkey, ...) used by the "redis" backends
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+    # Store for short lived service state shared between nodes ("memory" or "redis")
+    state_backend = os.getenv("STATE_BACKEND", "memory")
+
+    # Session backend ("memory", "redis" or "filesystem"). "memory" sessions only exist in one
+    # process: use "redis" when the service runs more than one worker process or node
+    session_backend = os.getenv("SESSION_BACKEND", state_backend)
+
+    # Session expiry time (minutes) of an inactive session, reset by each request of the session
+    session_expiry = 60
+
+    # ------------------------------------------------------------------------------------------------
+    # Rate limiting
+
+    # Rate limiting of the issuance endpoints, and store of the token buckets ("memory" or "redis")
+    rate_limit_enabled = True
+    rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", state_backend)
+
+    # Reverse proxies in front of the service whose X-Forwarded-For is trusted for the client IP
+    # address (rate limiting per IP); 0: the address of the connection is used
+    proxy_trusted_hops = int(os.getenv("PROXY_TRUSTED_HOPS", "0"))
+
+    # Token buckets per route: (requests per second, burst) per client ("client", client_id or
+    # access token), per client IP address ("ip") and for all the requests ("global")
+    rate_limits = {
+        "pushed_authorization": {"client": (2, 10), "ip": (5, 20), "global": (200, 400)},
+        "token": {"client": (2, 10), "ip": (5, 20), "global": (200, 400)},
+        "credential": {"client": (2, 10), "ip": (5, 20), "global": (100, 200)},
+        "credential_offer": {"ip": (1, 10), "global": (50, 100)},
+        "preauth_form": {"ip": (2, 20), "global": (100, 200)},
+    }
+
+    # ------------------------------------------------------------------------------------------------
+    # QR codes
+
+    # QR code image format ("png" or "svg")
+    qr_format = os.getenv("QR_FORMAT", "png")
+
+    # Number of rendered QR code images kept in memory
+    qr_cache_size = 512
+
+    # Number of QR code rendering threads
+    qr_workers = 2
+
+    # QR code image URL expiry time (minutes)
+    qr_expiry = 60
+
+    # OpenID4VP verifier backend (dynamic_presentation_url): pooled connections, request threads
+    # and timeout (seconds)
+    verifier_pool_size = 20
+    verifier_workers = 16
+    verifier_timeout = 10
+
+    # Create the cross device OpenID4VP transaction of the login page only when the user asks for
+    # the QR code (False: created with the same device transaction)
+    oid4vp_lazy_cross_device = False
+
+    # Cross device presentations are polled once per presentation_id for all the waiting pages:
+    # first and maximum interval (seconds) between two polls, interval growth factor, poll threads
+    presentation_poll_min_interval = 0.5
+    presentation_poll_max_interval = 4
+    presentation_poll_backoff = 1.5
+    presentation_poll_workers = 8
+
+    # Presentation polling stops after presentation_poll_timeout seconds, or when no page waited for
+    # it during presentation_poll_idle seconds; at most presentation_poll_max presentations are polled
+    presentation_poll_timeout = 300
+    presentation_poll_idle = 30
+    presentation_poll_max = 10000
+
+    # Interval (seconds) of the keep-alive comments of the presentation events (SSE), and maximum
+    # long-poll wait
+    presentation_sse_heartbeat = 15
+
+    # Number of rendered pages (landing, credential offer, authentication method and country
+    # selection pages) kept in memory
+    page_cache_size = 256
+
+    # Static assets (app/static) of at least static_gzip_min_size bytes are served gzip compressed
+    # (text files)
+    static_gzip_min_size = 1024
+
     # ------------------------------------------------------------------------------------------------
     # PID namespace
     pid_namespace = "eu.europa.ec.eudi.pid.1"
@@ -543,6 +769,7 @@ class ConfService:
         "306": "Date is not in the correct format. Should be YYYY-MM-DD.",
         "401": "Missing mandatory formatter fields.",
         "501": "Missing mandatory IdP fields",
+        "503": "Service busy. Please try again later.",
     }
 
     # ------------------------------------------------------------------------------------------------
@@ -0,0 +1,229 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This blob_store.py contains the content-addressed store of large binary claims (portraits).
+
+Per-user state (form_dynamic_data) keeps a BlobRef (SHA-256 digest) instead of the base64
+value; the raw bytes are stored once, whatever the number of users referencing them, and
+are base64 encoded again only when the credential is built (resolve_blobs).
+Blobs are dropped when their last reference is released. Blobs without any reference (stored
+but never retained) are dropped cfgservice.form_expiry minutes after their last use.
+"""
+
+import base64
+import binascii
+import hashlib
+import threading
+import time
+
+from .app_config.config_service import ConfService as cfgservice
+
+BINARY_CLAIMS = ("portrait", "signature_usual_mark")
+
+
+class BlobRef(str):
+    """Reference (hex SHA-256 digest) to a blob of the blob store."""
+
+    __slots__ = ()
+
+
+class _Blob:
+    __slots__ = ("data", "refcount", "expires", "pinned")
+
+    def __init__(self, data):
+        self.data = data
+        self.refcount = 0
+        self.expires = 0
+        self.pinned = False
+
+
+class BlobStore:
+    """In-memory content-addressed blob store with reference counting and expiry."""
+
+    def __init__(self, ttl):
+        """
+        Keyword arguments:
+        + ttl -- time (seconds) a blob is kept after its last use
+        """
+        self.ttl = ttl
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, data, pin=False):
+        """Store data (without taking a reference to it, see retain)
+
+        Keyword arguments:
+        + data -- blob (bytes)
+        + pin -- keep the blob for the process lifetime
+
+        Return: BlobRef
+        """
+        ref = BlobRef(hashlib.sha256(data).hexdigest())
+        with self._lock:
+            blob = self._blobs.get(ref)
+            if blob is None:
+                blob = self._blobs[ref] = _Blob(data)
+            blob.expires = time.time() + self.ttl
+            blob.pinned = blob.pinned or pin
+        return ref
+
+    def retain(self, ref):
+        """Take a reference to a blob (released with release)."""
+        with self._lock:
+            blob = self._blobs.get(ref)
+            if blob is not None:
+                blob.refcount += 1
+                blob.expires = time.time() + self.ttl
+
+    def release(self, ref):
+        with self._lock:
+            blob = self._blobs.get(ref)
+            if blob is None:
+                return
+            blob.refcount -= 1
+            if blob.refcount <= 0 and not blob.pinned:
+                del self._blobs[ref]
+
+    def get(self, ref):
+        """Return the blob bytes (KeyError if the blob is unknown or expired)."""
+        with self._lock:
+            blob = self._blobs[ref]
+            blob.expires = time.time() + self.ttl
+            return blob.data
+
+    def sweep(self):
+        """Drop the expired blobs that are not referenced. Return the number of blobs dropped."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                ref
+                for ref, blob in self._blobs.items()
+                if not blob.pinned and blob.refcount <= 0 and blob.expires < now
+            ]
+            for ref in expired:
+                del self._blobs[ref]
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "blobs": len(self._blobs),
+                "bytes": sum(len(blob.data) for blob in self._blobs.values()),
+            }
+
+
+blob_store = BlobStore(ttl=cfgservice.form_expiry * 60)
+
+_pinned = {}
+
+
+def blob_from_b64(value):
+    """Store a urlsafe base64 value
+
+    Keyword arguments:
+    + value -- urlsafe base64 string. Configuration values (sample portraits) are stored once
+    and never dropped.
+
+    Return: BlobRef
+    """
+    if any(
+        value is portrait
+        for portrait in (
+            cfgservice.portrait1,
+            cfgservice.portrait2,
+            cfgservice.sample_data.get("portrait"),
+        )
+    ):
+        ref = _pinned.get(id(value))
+        if ref is None:
+            ref = _pinned[id(value)] = blob_store.put(_b64decode(value), pin=True)
+        return ref
+
+    return blob_store.put(_b64decode(value))
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def store_blobs(data):
+    """Copy of data, to be kept in the per-user state, with the binary claims (BINARY_CLAIMS)
+    replaced by blob references
+
+    Keyword arguments:
+    + data -- claims (dict), binary claims in urlsafe base64 or BlobRef
+
+    Return: dict
+    """
+    stored = dict(data)
+    for claim in BINARY_CLAIMS:
+        value = stored.get(claim)
+        if (
+            isinstance(value, str)
+            and not isinstance(value, BlobRef)
+            and len(value) >= cfgservice.blob_min_size
+        ):
+            try:
+                stored[claim] = blob_from_b64(value)
+            except (binascii.Error, ValueError):
+                continue
+
+    for value in stored.values():
+        if isinstance(value, BlobRef):
+            blob_store.retain(value)
+
+    return stored
+
+
+def release_blobs(data):
+    """Release the blob references of data (entry removed from the per-user state)."""
+    for value in data.values():
+        if isinstance(value, BlobRef):
+            blob_store.release(value)
+
+
+def blob_b64(ref, urlsafe=True):
+    """Base64 encoding of a blob (urlsafe by default)."""
+    data = blob_store.get(ref)
+    if urlsafe:
+        return base64.urlsafe_b64encode(data).decode("utf-8")
+    return base64.b64encode(data).decode("utf-8")
+
+
+def display_b64(value):
+    """Standard base64 encoding (data: URI) of a BlobRef or urlsafe base64 value."""
+    if isinstance(value, BlobRef):
+        return blob_b64(value, urlsafe=False)
+    return base64.b64encode(_b64decode(value)).decode("utf-8")
+
+
+def resolve_blobs(data):
+    """Copy of data with the blob references replaced by the urlsafe base64 value
+
+    Keyword arguments:
+    + data -- claims (dict)
+
+    Return: dict
+    """
+    return {
+        key: blob_b64(value) if isinstance(value, BlobRef) else value
+        for key, value in data.items()
+    }
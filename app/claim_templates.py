@@ -0,0 +1,246 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This claim_templates.py contains the claim templates used by dynamic_func.formatter.
+
+A ClaimTemplate is prepared once per (format, doctype, issuing country, distinguishing sign, day):
+it holds the credential configuration, the issuer-filled values (issuance/expiry dates, issuing
+authority, credential type, ...), the pdata skeleton and the ordered attribute plan. Formatting a
+credential is then a single pass over the plan. The templates of the previous day are dropped
+at day rollover, and at most cfgservice.claim_template_cache_size templates are kept (least
+recently used first out, the issuing country and distinguishing sign come from the user data).
+"""
+
+import copy
+import datetime
+import json
+import threading
+from collections import OrderedDict
+
+from .app_config.config_service import ConfService as cfgservice
+from .misc import (
+    calculate_age,
+    doctype2credential,
+    doctype2credentialSDJWT,
+    getIssuerFilledAttributes,
+    getIssuerFilledAttributesSDJWT,
+    getMandatoryAttributes,
+    getMandatoryAttributesSDJWT,
+    getNamespaces,
+    getOptionalAttributes,
+    getOptionalAttributesSDJWT,
+)
+
+# attributes sent as JSON strings by the forms
+JSON_ATTRIBUTES = (
+    "driving_privileges",
+    "places_of_work",
+    "legislation",
+    "employment_details",
+    "competent_institution",
+    "credential_holder",
+    "subject",
+)
+
+# attributes kept as lists (the other JSON attributes keep their first element)
+LIST_ATTRIBUTES = ("places_of_work", "employment_details")
+
+INT_ATTRIBUTES = ("age_in_years", "age_birth_year")
+
+
+def _plan(*sections):
+    """Ordered (attribute, mandatory) plan of the attribute sections (mandatory first)."""
+    plan = {}
+    for attributes, mandatory in sections:
+        for attribute in attributes:
+            plan[attribute] = plan.get(attribute, False) or mandatory
+    return tuple(plan.items())
+
+
+class ClaimTemplate:
+    """Prepared claims of one credential configuration, issuing country and day."""
+
+    def __init__(self, format, doctype, issuing_country, un_distinguishing_sign, today):
+        """
+        Keyword arguments:
+        + format -- credential format (mso_mdoc or dc+sd-jwt)
+        + doctype -- credential doctype
+        + issuing_country -- issuing country (evidence of the SD-JWT credentials)
+        + un_distinguishing_sign -- UN distinguishing sign (mDL)
+        + today -- issuance date (datetime.date)
+        """
+        self.format = format
+
+        if format == "mso_mdoc":
+            self.requested_credential = doctype2credential(doctype, format)
+            claims = self.requested_credential["claims"]
+            namespaces = getNamespaces(claims)
+
+            mandatory = {}
+            optional = {}
+            issuer_claims = {}
+            for ns in namespaces:
+                mandatory.update(getMandatoryAttributes(claims, ns))
+                optional.update(getOptionalAttributes(claims, ns))
+                issuer_claims.update(getIssuerFilledAttributes(claims, ns))
+
+            self.skeleton = {ns: {} for ns in namespaces}
+            self.plan = tuple(
+                (
+                    ns,
+                    _plan(
+                        (getMandatoryAttributes(claims, ns), True),
+                        (getOptionalAttributes(claims, ns), False),
+                        (getIssuerFilledAttributes(claims, ns), False),
+                    ),
+                )
+                for ns in namespaces
+            )
+
+        elif format == "dc+sd-jwt":
+            self.requested_credential = doctype2credentialSDJWT(doctype, format)
+            claims = self.requested_credential["claims"]
+            config = self.requested_credential["issuer_config"]
+
+            mandatory = getMandatoryAttributesSDJWT(claims)
+            optional = getOptionalAttributesSDJWT(claims)
+            issuer_claims = getIssuerFilledAttributesSDJWT(claims)
+
+            self.skeleton = {
+                "evidence": [{
+                    "type": doctype,
+                    "source": {
+                        "organization_name": config["organization_name"],
+                        "organization_id": config["organization_id"],
+                        "country_code": issuing_country,
+                    },
+                }],
+                "claims": {}
+            }
+
+        else:
+            raise ValueError("Unsupported format: " + str(format))
+
+        config = self.requested_credential["issuer_config"]
+        expiry = today + datetime.timedelta(days=config["validity"])
+
+        issuer_values = {
+            "un_distinguishing_sign": lambda: un_distinguishing_sign,
+            "issuance_date": lambda: today.strftime("%Y-%m-%d"),
+            "issue_date": lambda: today.strftime("%Y-%m-%d"),
+            "expiry_date": lambda: expiry.strftime("%Y-%m-%d"),
+            "issuing_authority": lambda: config["issuing_authority"],
+            "issuing_authority_unicode": lambda: config["issuing_authority"],
+            "credential_type": lambda: config["credential_type"],
+        }
+        self.issuer_values = {
+            name: value() for name, value in issuer_values.items() if name in issuer_claims
+        }
+        self.computes_age = "age_over_18" in issuer_claims
+
+        if "credential_type" in issuer_claims:
+            mandatory["credential_type"] = ""
+
+        mandatory.pop("at_least_one_of", None)
+        optional.pop("at_least_one_of", None)
+
+        self.json_attributes = tuple(
+            attr for attr in JSON_ATTRIBUTES if attr in mandatory or attr in optional
+        )
+
+        if format == "dc+sd-jwt":
+            # age_over_18 is added to the optional attributes when present in the data
+            self.plan = _plan((mandatory, True), (optional, False))
+            self.issuer_plan = _plan((issuer_claims, False))
+            self.age_optional = "age_over_18" not in mandatory and "age_over_18" not in optional
+
+    def format_data(self, data):
+        """Merge the user data into the template
+
+        Keyword arguments:
+        + data -- user data (updated with the issuer-filled attributes)
+
+        Return: pdata
+        """
+        if self.computes_age and "birth_date" in data:
+            data["age_over_18"] = calculate_age(data["birth_date"]) >= 18
+
+        data.update(self.issuer_values)
+
+        for attr in self.json_attributes:
+            if isinstance(data.get(attr), str):
+                data[attr] = json.loads(data[attr])
+            elif isinstance(data.get(attr), list) and attr not in LIST_ATTRIBUTES:
+                data[attr] = data[attr][0]
+
+        for attr in INT_ATTRIBUTES:
+            if isinstance(data.get(attr), str):
+                data[attr] = int(data[attr])
+
+        pdata = copy.deepcopy(self.skeleton)
+
+        if self.format == "mso_mdoc":
+            for ns, plan in self.plan:
+                _merge(pdata[ns], plan, data)
+        else:
+            claims = pdata["claims"]
+            _merge(claims, self.plan, data)
+            if self.age_optional and "age_over_18" in data:
+                claims["age_over_18"] = data["age_over_18"]
+            _merge(claims, self.issuer_plan, data)
+
+        return pdata
+
+
+def _merge(target, plan, data):
+    for attribute, mandatory in plan:
+        if mandatory or attribute in data:
+            target[attribute] = data[attribute]
+
+
+_templates = OrderedDict()
+_templates_day = None
+_templates_lock = threading.Lock()
+
+
+def get_claim_template(format, doctype, issuing_country, un_distinguishing_sign):
+    """Claim template of today, prepared on first use."""
+    global _templates_day
+
+    today = datetime.date.today()
+    key = (format, doctype, issuing_country, un_distinguishing_sign)
+
+    with _templates_lock:
+        if _templates_day != today:
+            _templates.clear()
+            _templates_day = today
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            return template
+
+    template = ClaimTemplate(format, doctype, issuing_country, un_distinguishing_sign, today)
+    with _templates_lock:
+        if _templates_day == today:
+            _templates[key] = template
+            while len(_templates) > cfgservice.claim_template_cache_size:
+                _templates.popitem(last=False)
+    return template
@@ -0,0 +1,123 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This credential_index.py contains the indexes from credential configuration ids to the countries
+(cfgcountries.supported_countries supported_credentials) and authentication methods
+(cfgservice.auth_method_supported_credencials) that can issue them.
+
+The indexes are built once from the configuration; the country selection of a set of
+requested credentials is then an intersection of frozensets. rebuild() builds new indexes after
+a configuration change and swaps them in one assignment, requests in progress keep the
+indexes they started with.
+"""
+
+from .app_config.config_countries import ConfCountries as cfgcountries
+from .app_config.config_service import ConfService as cfgservice
+
+_EMPTY = frozenset()
+
+
+class CredentialIndex:
+    """Countries and authentication methods per credential configuration id."""
+
+    def __init__(self, supported_countries, auth_methods):
+        """
+        Keyword arguments:
+        + supported_countries -- {country: country configuration} (cfgcountries.supported_countries)
+        + auth_methods -- {authentication method: credential configuration ids}
+          (cfgservice.auth_method_supported_credencials)
+        """
+        countries = {}
+        for country, config in supported_countries.items():
+            for credential in config.get("supported_credentials", ()):
+                countries.setdefault(credential, set()).add(country)
+
+        self.countries = {
+            credential: frozenset(country_set) for credential, country_set in countries.items()
+        }
+        self.all_countries = frozenset(supported_countries)
+        # country selection page order
+        self.country_names = tuple(
+            (country, str(config["name"])) for country, config in supported_countries.items()
+        )
+
+        self.auth_methods = {
+            method: frozenset(credentials) for method, credentials in auth_methods.items()
+        }
+        self.pid_login = self.auth_methods.get("PID_login", _EMPTY)
+        self.country_selection = self.auth_methods.get("country_selection", _EMPTY)
+        self.offered = self.pid_login | self.country_selection
+
+    def countries_for(self, credentials):
+        """Countries that support all the credentials
+
+        Keyword arguments:
+        + credentials -- credential configuration ids
+
+        Return: frozenset of countries
+        """
+        result = self.all_countries
+        for credential in credentials:
+            result = result & self.countries.get(credential, _EMPTY)
+            if not result:
+                break
+        return result
+
+    def display_countries(self, credentials):
+        """{country: name} of the countries that support all the credentials, in configuration order."""
+        countries = self.countries_for(credentials)
+        return {country: name for country, name in self.country_names if country in countries}
+
+    def auth_choice(self, credentials):
+        """Authentication methods that can issue all the credentials
+
+        Keyword arguments:
+        + credentials -- credential configuration ids
+
+        Return: (pid_auth, country_selection)
+        """
+        credentials = frozenset(credentials)
+        return credentials <= self.pid_login, credentials <= self.country_selection
+
+
+_index = None
+
+
+def rebuild():
+    """Build the indexes from the current configuration and make them the current ones."""
+    global _index
+
+    _index = CredentialIndex(
+        cfgcountries.supported_countries, cfgservice.auth_method_supported_credencials
+    )
+    # country selection and offer pages
+    from . import page_cache
+
+    page_cache.invalidate()
+    return _index
+
+
+def get_index():
+    """Current indexes."""
+    return _index
+
+
+rebuild()
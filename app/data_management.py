@@ -25,16 +25,46 @@ import threading
 from datetime import datetime
 
 from .app_config.config_service import ConfService as cfgservice
+from .blob_store import blob_store, release_blobs
+from .form_store import FormDataStore
+from . import metrics
 import requests
 
 
 parRequests = {}
 transaction_codes={}
-deferredRequests = {}
 oid4vp_requests = {}
-form_dynamic_data = {}
+form_dynamic_data = FormDataStore(
+    max_entries=cfgservice.form_max_entries,
+    max_bytes=cfgservice.form_max_bytes,
+    on_evict=release_blobs,
+)
 session_ids = {}
-credential_offer_references = {}
+
+metrics.register_gauge(
+    "form_data_entries", "Number of form data entries", lambda: len(form_dynamic_data)
+)
+metrics.register_gauge(
+    "form_data_bytes", "Memory used by the form data entries (bytes)", lambda: form_dynamic_data.bytes
+)
+metrics.register_gauge(
+    "blob_store_bytes", "Memory used by the blob store (bytes)", lambda: blob_store.stats()["bytes"]
+)
+
+def admit_form():
+    """Check the form data budget before storing a new form submission
+
+    Return: True if the form can be stored, False if the form data budget is reached
+    """
+    if form_dynamic_data.admit():
+        return True
+
+    metrics.inc(
+        "form_admission_rejected_total",
+        "Form submissions refused because the form data budget was reached",
+    )
+    cfgservice.app_logger.warning("Form data budget reached, form submission refused")
+    return False
 
 def getSessionId_requestUri(target_request_uri):
     matching_session_id = None
@@ -98,28 +128,6 @@ def clear_par():
                 + str(expire_time)
             ) """
 
-    """ for req in deferredRequests.copy():
-            
-            if datetime.now() > deferredRequests[req]["expires"]:
-                deferredRequests.pop(req)
-            else:
-                request_data = json.loads(deferredRequests[req]["data"])
-                print("\ndata: ", request_data)
-                request_data.update({"transaction_id": req})
-                print("\ntransaction_id: ", req)
-                request_data = json.dumps(request_data)
-                print("\ndata2: ", request_data)
-                request_headers = deferredRequests[req]["headers"]
-                print("\nheaders: ", request_headers)
-
-                response = requests.post(cfgservice.service_url+"credential", data=request_data, headers=request_headers)
-                print("\nresponse", response.text)
-                response_data = response.json()
-
-                if response.status_code == 200:
-                    if "credentials" in response_data or "encrypted_response" in response_data and not "decrypted_transaction_id" in response_data:
-                        deferredRequests.pop(req) """
-    
     for code in transaction_codes.copy():
         if datetime.now() > transaction_codes[code]["expires"]:
             #cfgservice.logger_info.info("Current transaction_codes:\n" + str(transaction_codes))
@@ -137,15 +145,13 @@ def clear_par():
             cfgservice.app_logger.info("Removing session id: " + str(id))
             session_ids.pop(id)
 
-    for id in form_dynamic_data.copy():
-        if datetime.now() > form_dynamic_data[id]["expires"]:
+    for id in list(form_dynamic_data):
+        entry = form_dynamic_data.get(id)
+        if entry is not None and datetime.now() > entry["expires"]:
             cfgservice.app_logger.info("Removing form id: " + str(id))
-            form_dynamic_data.pop(id)
-    
-    for id in credential_offer_references.copy():
-        if datetime.now() > credential_offer_references[id]["expires"]:
-            cfgservice.app_logger.info("Removing credential reference id: " + str(id))
-            credential_offer_references.pop(id)
+            release_blobs(form_dynamic_data.pop(id, {}))
+
+    blob_store.sweep()
 
 def run_scheduler():
     #print("Run scheduler.")
@@ -0,0 +1,304 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This deferred_worker.py contains the deferred issuance worker.
+
+Deferred transactions (transaction_id returned by the credential endpoint) are kept in a
+SQLite (WAL) table. A dispatcher thread builds the pending credentials in the background,
+with at most cfgservice.deferred_workers jobs running at once, and stores the finished
+deferred credential response, so that a /deferred_credential poll is a primary key lookup.
+Failed attempts are retried with exponential backoff until the transaction expires
+(cfgservice.deffered_expiry).
+
+The table only holds a hash of the access token. The access token itself, needed to build the
+credential, is kept in the memory of the process that received the credential request (or a
+later poll of the transaction, e.g. after a restart), and only that process runs the job.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .app_config.config_service import ConfService as cfgservice
+from .app_config.config_oidc_endpoints import ConfService as cfgoidc
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+EXPIRED = "expired"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deferred_jobs (
+    transaction_id TEXT PRIMARY KEY,
+    token_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    expires REAL NOT NULL,
+    response TEXT,
+    content_type TEXT,
+    status_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS deferred_jobs_due ON deferred_jobs (status, next_attempt);
+"""
+
+_local = threading.local()
+_running = threading.BoundedSemaphore(cfgservice.deferred_workers)
+_executor = None
+
+# transaction_id -> access token, for the transactions this process can build
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def _connection():
+    """Return the SQLite connection of the current thread."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(cfgservice.deferred_db), exist_ok=True)
+        conn = sqlite3.connect(cfgservice.deferred_db, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _token_hash(access_token):
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+
+def enqueue(transaction_id, access_token):
+    """Add a deferred transaction to the queue
+
+    Keyword arguments:
+    + transaction_id -- transaction id returned by the credential endpoint
+    + access_token -- access token of the credential request
+    """
+    now = time.time()
+    _connection().execute(
+        "INSERT OR IGNORE INTO deferred_jobs "
+        "(transaction_id, token_hash, status, next_attempt, expires) VALUES (?, ?, ?, ?, ?)",
+        (
+            transaction_id,
+            _token_hash(access_token),
+            PENDING,
+            now,
+            now + cfgservice.deffered_expiry * 60,
+        ),
+    )
+    resume(transaction_id, access_token)
+
+
+def resume(transaction_id, access_token):
+    """Let this process build a pending transaction (e.g. polled after a restart)
+
+    Keyword arguments:
+    + transaction_id -- transaction id
+    + access_token -- access token of the transaction (see token_matches)
+    """
+    with _tokens_lock:
+        _tokens[transaction_id] = access_token
+
+
+def token_matches(job, access_token):
+    """True if access_token is the access token of the job (see get_job)."""
+    return hmac.compare_digest(job["token_hash"], _token_hash(access_token))
+
+
+def get_job(transaction_id):
+    """Get a deferred transaction
+
+    Keyword arguments:
+    + transaction_id -- transaction id
+
+    Return: dict with the job columns (status is one of pending, running, done or expired),
+    or None if the transaction is unknown.
+    """
+    row = _connection().execute(
+        "SELECT * FROM deferred_jobs WHERE transaction_id = ?", (transaction_id,)
+    ).fetchone()
+    if row is None:
+        return None
+
+    job = dict(row)
+    if job["status"] != DONE and job["expires"] <= time.time():
+        job["status"] = EXPIRED
+    return job
+
+
+def _deferred_response(args):
+    """Convert the deferred_credential endpoint result into (body, content type, status code).
+
+    Return: None while the credential is not issued yet.
+    """
+    if "encrypted_response" in args:
+        return args["encrypted_response"], "application/jwt", 200
+
+    if "response_args" in args:
+        response_args = args["response_args"]
+        if hasattr(response_args, "to_dict"):
+            response_args = response_args.to_dict()
+        if response_args.get("error") == "issuance_pending":
+            return None
+        status_code = 400 if "error" in response_args else 200
+        return json.dumps(response_args), "application/json", status_code
+
+    if "error" in args:
+        return args.to_json(), "application/json", 400
+
+    return None
+
+
+def _run_job(app, transaction_id, access_token, attempts):
+    try:
+        with app.app_context():
+            app.server.get_endpoint("credential").process_deferred()
+            args = app.server.get_endpoint("deferred_credential").process_request(
+                {
+                    "transaction_id": transaction_id,
+                    "access_token": access_token,
+                    "oidc_config": cfgoidc,
+                }
+            )
+        result = _deferred_response(args)
+
+    except Exception as e:
+        cfgservice.app_logger.exception(
+            "Deferred issuance failed for transaction " + transaction_id + ": " + str(e)
+        )
+        result = None
+
+    finally:
+        _running.release()
+
+    conn = _connection()
+    if result is None:
+        backoff = min(
+            cfgservice.deferred_retry_backoff * 2**attempts,
+            cfgservice.deferred_retry_max_backoff,
+        )
+        conn.execute(
+            "UPDATE deferred_jobs SET status = ?, attempts = ?, next_attempt = ? "
+            "WHERE transaction_id = ?",
+            (PENDING, attempts + 1, time.time() + backoff, transaction_id),
+        )
+    else:
+        response, content_type, status_code = result
+        conn.execute(
+            "UPDATE deferred_jobs SET status = ?, attempts = ?, response = ?, "
+            "content_type = ?, status_code = ? WHERE transaction_id = ?",
+            (DONE, attempts + 1, response, content_type, status_code, transaction_id),
+        )
+
+
+def _dispatch(app):
+    conn = _connection()
+    now = time.time()
+
+    # finished and expired transactions are kept for one more expiry period
+    conn.execute(
+        "DELETE FROM deferred_jobs WHERE expires < ?",
+        (now - cfgservice.deffered_expiry * 60,),
+    )
+
+    with _tokens_lock:
+        tokens = dict(_tokens)
+    if not tokens:
+        return
+
+    transaction_ids = list(tokens)
+    jobs = conn.execute(
+        "SELECT transaction_id, status, attempts, next_attempt, expires FROM deferred_jobs "
+        "WHERE transaction_id IN (" + ",".join("?" * len(transaction_ids)) + ") "
+        "ORDER BY next_attempt",
+        transaction_ids,
+    ).fetchall()
+
+    # tokens of the finished, expired or deleted transactions are dropped
+    active = {
+        job["transaction_id"] for job in jobs if job["status"] != DONE and job["expires"] > now
+    }
+    with _tokens_lock:
+        for transaction_id in transaction_ids:
+            if transaction_id not in active:
+                _tokens.pop(transaction_id, None)
+
+    due = [
+        job
+        for job in jobs
+        if job["status"] == PENDING and job["next_attempt"] <= now and job["expires"] > now
+    ]
+
+    for job in due:
+        if not _running.acquire(blocking=False):
+            break
+
+        claimed = conn.execute(
+            "UPDATE deferred_jobs SET status = ? WHERE transaction_id = ? AND status = ?",
+            (RUNNING, job["transaction_id"], PENDING),
+        ).rowcount
+        if not claimed:
+            _running.release()
+            continue
+
+        _executor.submit(
+            _run_job, app, job["transaction_id"], tokens[job["transaction_id"]], job["attempts"]
+        )
+
+
+def _dispatch_loop(app):
+    while True:
+        try:
+            _dispatch(app)
+        except Exception as e:
+            cfgservice.app_logger.exception("Deferred dispatcher error: " + str(e))
+        time.sleep(cfgservice.deferred_poll_interval)
+
+
+def start(app):
+    """Start the deferred issuance worker
+
+    Keyword arguments:
+    + app -- Flask application (with app.server)
+    """
+    global _executor
+
+    if _executor is not None:
+        return
+
+    # jobs interrupted by a restart are run again
+    _connection().execute(
+        "UPDATE deferred_jobs SET status = ? WHERE status = ?", (PENDING, RUNNING)
+    )
+
+    _executor = ThreadPoolExecutor(
+        max_workers=cfgservice.deferred_workers, thread_name_prefix="deferred"
+    )
+    threading.Thread(
+        target=_dispatch_loop, args=(app,), name="deferred-dispatcher", daemon=True
+    ).start()
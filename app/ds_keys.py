@@ -0,0 +1,370 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This ds_keys.py contains the selection of the document signer (DS) keys of a country.
+
+A country can have several active DS keys (ds_keys in cfgcountries, or the single
+pid_mdoc_privkey/pid_mdoc_cert pair). Each credential is signed with a key chosen by smooth
+weighted round-robin among the keys valid for the doctype:
++ a key starts taking traffic at not_before and stops at not_after; during the first and last
+  cfgservice.ds_key_overlap seconds of its validity its weight ramps up / drains linearly, so
+  that rotated keys overlap
++ a key whose signature fails is left out for cfgservice.ds_key_retry seconds (doubled after each
+  consecutive failure, up to cfgservice.ds_key_retry_max) and the credential is signed with
+  another key
++ signatures, failures and signature rate are tracked per key (stats, metrics); the signing
+  worker processes send the outcomes of their signatures back with the job results
+  (collect_outcomes, take_outcomes), and they are recorded by the service process
+  (record_outcomes)
+"""
+
+import datetime
+import threading
+import time
+
+from .app_config.config_countries import ConfCountries as cfgcountries
+from .app_config.config_service import ConfService as cfgservice
+from .mdoc_issuer import MdocIssuer
+from .sdjwt_engine import SDJWTEngine
+from .signers import load_signer
+from . import metrics
+
+RATE_WINDOW = 60
+
+# (country, key id, success) of the signatures made since the last take_outcomes, None when the
+# outcomes are not collected (see collect_outcomes)
+_outcomes = None
+
+
+class DSKeyError(RuntimeError):
+    """The signature with a DS key failed (key not loaded, HSM error, ...)."""
+
+
+class NoDSKey(RuntimeError):
+    """No DS key of the country can sign the doctype."""
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+class DSKey:
+    """One DS key of a country, with its health and signature counters."""
+
+    def __init__(self, country, key_id, config):
+        """
+        Keyword arguments:
+        + country -- issuing country
+        + key_id -- key identifier (metrics, stats)
+        + config -- signer settings (see signers.load_signer) and optional weight,
+          not_before, not_after (ISO 8601 or epoch seconds) and doctypes
+        """
+        self.country = country
+        self.id = key_id
+        self.weight = float(config.get("weight", 1))
+        self.not_before = _timestamp(config.get("not_before"))
+        self.not_after = _timestamp(config.get("not_after"))
+        self.doctypes = frozenset(config.get("doctypes") or ())
+
+        self._config = config
+        self._signer = None
+        self._engine = None
+        self._issuers = {}
+        self._lock = threading.RLock()
+
+        self.current = 0.0
+        self.signatures = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.retry_at = 0.0
+        self.rate = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def effective_weight(self, now, doctype=None):
+        """Weight of the key at now (epoch seconds), 0 if it can not take traffic."""
+        if doctype is not None and self.doctypes and doctype not in self.doctypes:
+            return 0.0
+        if self.not_before is not None and now < self.not_before:
+            return 0.0
+        if self.not_after is not None and now >= self.not_after:
+            return 0.0
+
+        weight = self.weight
+        overlap = cfgservice.ds_key_overlap
+        if overlap > 0:
+            if self.not_before is not None and now < self.not_before + overlap:
+                weight *= (now - self.not_before) / overlap
+            if self.not_after is not None and now > self.not_after - overlap:
+                weight *= (self.not_after - now) / overlap
+        return weight
+
+    def healthy(self, now):
+        return now >= self.retry_at
+
+    def signer(self):
+        """Signer of the key (loaded on first use)."""
+        if self._signer is None:
+            with self._lock:
+                if self._signer is None:
+                    try:
+                        self._signer = _TrackedSigner(self, load_signer(self._config))
+                    except Exception as e:
+                        self.record_failure()
+                        raise DSKeyError(f"DS key {self.id} can not be loaded: {e}") from e
+        return self._signer
+
+    def sdjwt_engine(self):
+        if self._engine is None:
+            self._engine = SDJWTEngine(self.signer())
+        return self._engine
+
+    def mdoc_issuer(self, doctype):
+        issuer = self._issuers.get(doctype)
+        if issuer is None:
+            issuer = self._issuers[doctype] = MdocIssuer(self.signer(), doctype)
+        return issuer
+
+    def record_success(self):
+        if _outcomes is not None:
+            _outcomes.append((self.country, self.id, True))
+        with self._lock:
+            self.signatures += 1
+            self.consecutive_failures = 0
+            self._window_count += 1
+            elapsed = time.monotonic() - self._window_start
+            if elapsed >= RATE_WINDOW:
+                self.rate = self._window_count / elapsed
+                self._window_start += elapsed
+                self._window_count = 0
+        metrics.inc(
+            "ds_key_signatures_total", "Signatures per DS key", country=self.country, key=self.id
+        )
+
+    def record_failure(self):
+        if _outcomes is not None:
+            _outcomes.append((self.country, self.id, False))
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.retry_at = time.time() + min(
+                cfgservice.ds_key_retry * 2 ** (self.consecutive_failures - 1),
+                cfgservice.ds_key_retry_max,
+            )
+        metrics.inc(
+            "ds_key_failures_total",
+            "Failed signatures per DS key",
+            country=self.country,
+            key=self.id,
+        )
+
+    def stats(self, now):
+        return {
+            "weight": self.weight,
+            "effective_weight": round(self.effective_weight(now), 3),
+            "healthy": self.healthy(now),
+            "signatures": self.signatures,
+            "failures": self.failures,
+            "rate": round(self.rate, 3),
+        }
+
+
+class _TrackedSigner:
+    """Signer of a DSKey: records the signatures and failures of the key."""
+
+    def __init__(self, key, signer):
+        self._key = key
+        self._signer = signer
+        self.certificate_der = signer.certificate_der
+        self.curve = signer.curve
+
+    def sign(self, data):
+        try:
+            signature = self._signer.sign(data)
+        except Exception as e:
+            self._key.record_failure()
+            raise DSKeyError(f"Signature with DS key {self._key.id} failed: {e}") from e
+        self._key.record_success()
+        return signature
+
+
+class DSKeySet:
+    """Active DS keys of a country."""
+
+    def __init__(self, country, keys):
+        """
+        Keyword arguments:
+        + country -- issuing country
+        + keys -- list of DSKey
+        """
+        self.country = country
+        self.keys = keys
+        self._by_id = {key.id: key for key in keys}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, country, config):
+        """DS keys of a country configuration (ds_keys list, or the pid_mdoc_* settings)."""
+        if config.get("ds_keys"):
+            keys = [
+                DSKey(country, key_config.get("id", f"{country}-{index}"), key_config)
+                for index, key_config in enumerate(config["ds_keys"])
+            ]
+        else:
+            keys = [DSKey(country, country, config)]
+        return cls(country, keys)
+
+    def choose(self, doctype=None, exclude=()):
+        """Next key (smooth weighted round-robin) for a doctype
+
+        Keyword arguments:
+        + doctype -- credential doctype (keys restricted to other doctypes are skipped)
+        + exclude -- keys already tried
+
+        Return: DSKey
+        Raises NoDSKey if no key can sign the doctype.
+        """
+        now = time.time()
+        with self._lock:
+            weights = [
+                (key, key.effective_weight(now, doctype))
+                for key in self.keys
+                if key not in exclude and key.healthy(now)
+            ]
+            weights = [(key, weight) for key, weight in weights if weight > 0]
+
+            if not weights:
+                # all the valid keys failed recently: retry the one that failed first
+                valid = [
+                    key
+                    for key in self.keys
+                    if key not in exclude and key.effective_weight(now, doctype) > 0
+                ]
+                if not valid:
+                    raise NoDSKey(f"No DS key of {self.country} for {doctype}")
+                return min(valid, key=lambda key: key.retry_at)
+
+            total = 0.0
+            best = None
+            for key, weight in weights:
+                key.current += weight
+                total += weight
+                if best is None or key.current > best.current:
+                    best = key
+            best.current -= total
+            return best
+
+    def run(self, function, doctype=None):
+        """Call function(key) with the next key, and with the other keys if the signature fails
+
+        Keyword arguments:
+        + function -- function of a DSKey
+        + doctype -- credential doctype
+
+        Return: function result
+        """
+        tried = set()
+        error = None
+        while True:
+            try:
+                key = self.choose(doctype, tried)
+            except NoDSKey:
+                if error is None:
+                    raise
+                raise error
+
+            try:
+                return function(key)
+            except DSKeyError as e:
+                cfgservice.app_logger.warning(str(e))
+                tried.add(key)
+                error = e
+
+    def key(self, key_id):
+        """DSKey of an identifier (None if unknown)."""
+        return self._by_id.get(key_id)
+
+    def stats(self):
+        now = time.time()
+        return {key.id: key.stats(now) for key in self.keys}
+
+
+_key_sets = {}
+_key_sets_lock = threading.Lock()
+
+
+def get_key_set(country):
+    """DS keys of a country (cfgcountries), built on first use."""
+    key_set = _key_sets.get(country)
+    if key_set is None:
+        with _key_sets_lock:
+            key_set = _key_sets.get(country)
+            if key_set is None:
+                key_set = _key_sets[country] = DSKeySet.from_config(
+                    country, cfgcountries.supported_countries[country]
+                )
+    return key_set
+
+
+def key_stats():
+    """Stats of the DS keys in use, per country."""
+    return {country: key_set.stats() for country, key_set in list(_key_sets.items())}
+
+
+def collect_outcomes():
+    """Collect the signature outcomes of this process (signing worker), see take_outcomes."""
+    global _outcomes
+    _outcomes = []
+
+
+def take_outcomes():
+    """Signature outcomes collected since the last call
+
+    Return: list of (country, key id, success)
+    """
+    global _outcomes
+    if _outcomes is None:
+        return []
+    outcomes, _outcomes = _outcomes, []
+    return outcomes
+
+
+def record_outcomes(outcomes):
+    """Record the signature outcomes of a signing worker in the DS keys of this process
+
+    Keyword arguments:
+    + outcomes -- list of (country, key id, success) (see take_outcomes)
+    """
+    for country, key_id, success in outcomes:
+        key = get_key_set(country).key(key_id)
+        if key is None:
+            continue
+        if success:
+            key.record_success()
+        else:
+            key.record_failure()
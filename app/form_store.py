@@ -0,0 +1,139 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This form_store.py contains the bounded store of the per-user form data (form_dynamic_data).
+
+The store keeps the entries in least recently used order and accounts the size of each entry
+(measured when it is stored). New form submissions are only admitted (admit) while the store is
+under its entries and bytes budget. Expired entries are evicted to make room; entries of forms
+still in progress are never evicted: a new entry that does not fit in the budget is refused
+(FormStoreFull), while an entry that is replaced is always stored.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+
+
+def entry_size(value):
+    """Approximate memory size (bytes) of a form data entry."""
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += entry_size(key) + entry_size(item)
+
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            size += entry_size(item)
+
+    return size
+
+
+class FormStoreFull(RuntimeError):
+    """The form data budget is reached."""
+
+
+class FormDataStore(MutableMapping):
+    """Dict-like store with entries and bytes budget, LRU and expiry ("expires" field) eviction."""
+
+    def __init__(self, max_entries, max_bytes, on_evict=None):
+        """
+        Keyword arguments:
+        + max_entries -- maximum number of entries
+        + max_bytes -- maximum size (bytes) of the entries
+        + on_evict -- function called with the entries evicted (or refused) by the store
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        size = entry_size(value)
+        with self._lock:
+            replaced = key in self._entries
+            if replaced:
+                self._remove(key)
+
+            self._evict_expired()
+            if not replaced and (
+                len(self._entries) >= self.max_entries or self.bytes + size > self.max_bytes
+            ):
+                if self.on_evict is not None:
+                    self.on_evict(value)
+                raise FormStoreFull("Form data budget reached")
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self._remove(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        self.bytes -= self._sizes.pop(key)
+        return self._entries.pop(key)
+
+    def _evict(self, key):
+        value = self._remove(key)
+        if self.on_evict is not None:
+            self.on_evict(value)
+
+    def _evict_expired(self):
+        # stops at the first entry in use (clear_par removes all the expired entries)
+        now = datetime.now()
+        while self._entries:
+            key, value = next(iter(self._entries.items()))
+            if not isinstance(value, dict) or value.get("expires", now) >= now:
+                break
+            self._evict(key)
+
+    def admit(self):
+        """Return True if a new form submission can be stored (store under its budget)."""
+        with self._lock:
+            self._evict_expired()
+            return len(self._entries) < self.max_entries and self.bytes < self.max_bytes
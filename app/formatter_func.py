@@ -24,30 +24,56 @@ This formatter_func.py file contains formatter related auxiliary functions.
 """
 import base64
 import cbor2
-from cryptography.hazmat.primitives import serialization
-from pymdoccbor.mdoc.issuer import MdocCborIssuer
 import datetime
-import hashlib
 import requests
 from sd_jwt.common import SDObj
 from jsonschema import ValidationError, validate
 from sd_jwt import __version__
 from sd_jwt.utils.demo_utils import (
-    get_jwk,
     load_yaml_settings,
 )
-from sd_jwt.issuer import SDJWTIssuer
 from sd_jwt.holder import SDJWTHolder
 from sd_jwt.verifier import SDJWTVerifier
 from sd_jwt.utils.yaml_specification import load_yaml_specification
 from uuid import uuid4
-import jwt
 
 
 from misc import doctype2vct, getSubClaims, urlsafe_b64encode_nopad, vct2doctype
 from app_config.config_countries import ConfCountries as cfgcountries
 from app_config.config_service import ConfService as cfgservice
 from app_config.config_secrets import revocation_api_key
+from app.sdjwt_engine import holder_jwk
+from app.signing_pool import issue_mdoc, issue_sdjwt
+from app import status_list
+
+
+def credential_status(doctype, country, expiry_date):
+    """Status list entry (status claim / MSO status) of a new credential
+
+    Keyword arguments:
+    + doctype -- credential doctype
+    + country -- Issuing country
+    + expiry_date -- credential expiry date (YYYY-MM-DD)
+
+    Return: {"status_list": {"idx": ..., "uri": ...}}, or None if the credential has no status
+    """
+    if cfgservice.status_list_mode == "local":
+        return status_list.allocate(doctype, country)
+
+    if not revocation_api_key:
+        return None
+
+    payload = "doctype=" + doctype + "&country=" + country + "&expiry_date=" + expiry_date
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-Api-Key': revocation_api_key
+    }
+
+    response = requests.post(cfgservice.revocation_service_url, headers=headers, data=payload)
+
+    if response.status_code == 200:
+        return response.json()
+    return None
 
 
 def mdocFormatter(data, credential_metadata, country, device_publickey):
@@ -61,20 +87,6 @@ def mdocFormatter(data, credential_metadata, country, device_publickey):
 
     Return: Returns the base64 urlsafe mdoc
     """
-    # Load the private key
-    with open(
-        cfgcountries.supported_countries[country]["pid_mdoc_privkey"], "rb"
-    ) as key_file:
-        private_key = serialization.load_pem_private_key(
-            key_file.read(),
-            password=cfgcountries.supported_countries[country][
-                "pid_mdoc_privkey_passwd"
-            ],
-        )
-
-    # Extract the key parameters
-    priv_d = private_key.private_numbers().private_value
-    
     issuance_date = datetime.datetime.today()
     expiry_date = issuance_date + datetime.timedelta(days=credential_metadata["issuer_config"]["validity"])
 
@@ -146,42 +158,16 @@ def mdocFormatter(data, credential_metadata, country, device_publickey):
     if "user_pseudonym" in data[namespace]:
         data[credential_metadata["doctype"]]["user_pseudonym"] = data[credential_metadata["doctype"]]["user_pseudonym"].encode('utf-8')
 
-    # Construct the COSE private key
-    cose_pkey = {
-        "KTY": "EC2",
-        "CURVE": "P_256",
-        "ALG": "ES256",
-        "D": priv_d.to_bytes((priv_d.bit_length() + 7) // 8, "big"),
-        "KID": b"mdocIssuer",
-    }
+    revocation_json = credential_status(
+        credential_metadata["doctype"], country, validity["expiry_date"]
+    )
 
     # Construct and sign the mdoc
-    mdoci = MdocCborIssuer(private_key=cose_pkey, alg="ES256")
-
-    revocation_json = None
-    if revocation_api_key:
-        payload = "doctype=" + credential_metadata["doctype"] + "&country=" + country + "&expiry_date=" + validity["expiry_date"]
-        headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'X-Api-Key': revocation_api_key
-        }
-
-        response = requests.post(cfgservice.revocation_service_url, headers=headers, data=payload)
-
-        if response.status_code == 200:
-            revocation_json = response.json()
-
-    mdoci.new(
-        doctype=credential_metadata["doctype"],
-        data=data,
-        validity=validity,
-        devicekeyinfo=device_publickey,
-        cert_path=cfgcountries.supported_countries[country]["pid_mdoc_cert"],
-        revocation = revocation_json
-                    
-          )
+    mdoc = issue_mdoc(
+        country, credential_metadata["doctype"], data, device_publickey, validity, revocation_json
+    )
 
-    return urlsafe_b64encode_nopad(mdoci.dump()) #base64.urlsafe_b64encode(mdoci.dump()).decode("utf-8")
+    return urlsafe_b64encode_nopad(mdoc) #base64.urlsafe_b64encode(mdoci.dump()).decode("utf-8")
 
 
 def cbor2elems(mdoc):
@@ -287,9 +273,6 @@ def sdjwtFormatter(PID, country):
     Return: Returns the sd-jwt
     """
 
-    hash_object = hashlib.sha256()
-
-    seed = int(hash_object.hexdigest(), 16)
     #doctype = PID["credential_metadata"]["issuer_config"]["doctype"]
 
     
@@ -312,20 +295,7 @@ def sdjwtFormatter(PID, country):
 
     doctype = vct2doctype(vct)
 
-    revocation_json = None
-
-    if revocation_api_key:
-        payload = "doctype=" + doctype + "&country=" + country + "&expiry_date=" + validity
-        headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'X-Api-Key': revocation_api_key
-        }
-
-        response = requests.post(cfgservice.revocation_service_url, headers=headers, data=payload)
-
-        if response.status_code == 200:
-            revocation_json = response.json()
-            
+    revocation_json = credential_status(doctype, country, validity)
 
     claims = {
         "iss": cfgservice.service_url[:-1],
@@ -364,82 +334,7 @@ def sdjwtFormatter(PID, country):
 
     claims.update(datafinal)
 
-    with open(
-        cfgcountries.supported_countries[country]["pid_mdoc_cert"], "rb"
-    ) as certificate:
-         certificate_data=certificate.read()
-    
-    certificate_base64=base64.b64encode(certificate_data).decode("utf-8")
-    x5c={
-        "x5c":[]
-    }
-    x5c["x5c"].append(certificate_base64)
-
-    with open(
-        cfgcountries.supported_countries[country]["pid_mdoc_privkey"], "rb"
-    ) as key_file:
-        private_key = serialization.load_pem_private_key(
-            key_file.read(),
-            password=cfgcountries.supported_countries[country][
-                "pid_mdoc_privkey_passwd"
-            ],
-        )
-
-    priv_d = private_key.private_numbers().private_value
-
-    (private_key_curve_identifier, private_key_x, private_key_y) = KeyData(
-        private_key, "private"
-    )
-
-    device_key_bytes = base64.urlsafe_b64decode(device_key.encode("utf-8"))
-    public_key = serialization.load_pem_public_key(device_key_bytes)
-
-    (public_key_curve_identifier, public_key_x, public_key_y) = KeyData(
-        public_key, "public"
-    )
-
-    jwk_kwargs = {
-        "issuer_key": {
-            "kty": "EC",
-            "d": jwt.utils.base64url_encode(
-                priv_d.to_bytes((priv_d.bit_length() + 7) // 8, "big")
-            ).decode("utf-8"),
-            "crv": private_key_curve_identifier,
-            "x": jwt.utils.base64url_encode(private_key_x).decode("utf-8"),
-            "y": jwt.utils.base64url_encode(private_key_y).decode("utf-8"),
-        },
-        "holder_key": {
-            "kty": "EC",
-            "crv": public_key_curve_identifier,
-            "x": jwt.utils.base64url_encode(public_key_x).decode("utf-8"),
-            "y": jwt.utils.base64url_encode(public_key_y).decode("utf-8"),
-        },
-        "key_size": 256,
-        "kty": "EC",
-    }
-
-    keys = get_jwk(jwk_kwargs, True, seed)
-
-    ### Produce SD-JWT and SVC for selected example
-    SDJWTIssuer.unsafe_randomness = False
-    SDJWTIssuer.SD_JWT_HEADER="dc+sd-jwt"
-    sdjwt_at_issuer = SDJWTIssuer(
-        claims,
-        keys["issuer_key"],
-        keys["holder_key"],
-        add_decoy_claims=False,
-        extra_header_parameters=x5c
-    )
-
-    # sdjwt_at_holder = SDJWTHolder(sdjwt_at_issuer.sd_jwt_issuance)
-    # sdjwt_at_holder.create_presentation(
-    # example["holder_disclosed_claims"],
-    # settings["key_binding_nonce"] if example.get("key_binding", False) else None,
-    # settings["identifiers"]["verifier"] if example.get("key_binding", False) else None,
-    # demo_keys["holder_key"] if example.get("key_binding", False) else None,
-    # )
-
-    return sdjwt_at_issuer.sd_jwt_issuance
+    return issue_sdjwt(country, claims, holder_jwk(device_key), doctype)
 
 
 def DATA_sd_jwt(PID):
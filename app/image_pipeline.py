@@ -0,0 +1,182 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This image_pipeline.py contains the portrait image processing.
+
+Images are checked (size, format and dimensions) from their header only, then converted to
+the mdoc portrait profile (RGB baseline JPEG, no metadata) with a single decode and encode.
+Conversions run on a process pool (cfgservice.image_workers processes, 0 to convert on the
+calling thread), with at most cfgservice.image_max_pending conversions queued or running, and
+their results are kept in an LRU cache keyed by the image SHA-256 hash.
+"""
+
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from .app_config.config_service import ConfService as cfgservice
+
+PORTRAIT_SIZE = (360, 433)
+
+PORTRAIT_FORMATS = ("JPEG", "PNG")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(cfgservice.image_max_pending)
+
+
+class ImageBusy(RuntimeError):
+    """All image conversion slots are taken."""
+
+
+def probe_image(data):
+    """Read the format and dimensions of an image from its header (the image is not decoded)
+
+    Keyword arguments:
+    + data -- image (bytes)
+
+    Return: (format, (width, height))
+    Raises ValueError if the image is too big or can not be identified.
+    """
+    if len(data) > cfgservice.image_max_bytes:
+        raise ValueError("Image file is too big.")
+
+    try:
+        with Image.open(BytesIO(data)) as img:
+            image_format, size = img.format, img.size
+    except Exception:
+        raise ValueError("Failed to open image.")
+
+    if image_format not in PORTRAIT_FORMATS:
+        raise ValueError("Unsupported image format.")
+
+    if size[0] * size[1] > cfgservice.image_max_pixels:
+        raise ValueError("Image dimensions are invalid.")
+
+    return image_format, size
+
+
+def validate_portrait(data):
+    """Check an uploaded portrait (header only)
+
+    Keyword arguments:
+    + data -- image (bytes)
+
+    Return: (True, None) or (False, error message)
+    """
+    try:
+        _, size = probe_image(data)
+    except ValueError as e:
+        return False, str(e)
+
+    if size != PORTRAIT_SIZE:
+        return False, "Image dimensions are invalid."
+
+    return True, None
+
+
+def _encode_portrait(data, quality):
+    """Decode the image and encode it as an RGB baseline JPEG (runs in the worker processes)."""
+    with Image.open(BytesIO(data)) as img:
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        out = BytesIO()
+        img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def _get_pool():
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: the request threads may hold locks a forked child would inherit
+                _pool = ProcessPoolExecutor(
+                    max_workers=cfgservice.image_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def to_portrait_jpeg(data):
+    """Convert an image to the mdoc portrait profile
+
+    Keyword arguments:
+    + data -- image (bytes)
+
+    Return: JPEG image (bytes)
+    Raises ValueError if the image is too big or can not be identified, ImageBusy if
+    cfgservice.image_max_pending conversions are already queued or running.
+    """
+    key = hashlib.sha256(data).digest()
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    probe_image(data)
+
+    if cfgservice.image_workers:
+        if not _slots.acquire(timeout=cfgservice.image_queue_timeout):
+            raise ImageBusy("Image processing is busy. Please try again later.")
+        try:
+            jpeg = _get_pool().submit(
+                _encode_portrait, data, cfgservice.portrait_jpeg_quality
+            ).result()
+        finally:
+            _slots.release()
+    else:
+        jpeg = _encode_portrait(data, cfgservice.portrait_jpeg_quality)
+
+    with _cache_lock:
+        _cache[key] = jpeg
+        _cache.move_to_end(key)
+        while len(_cache) > cfgservice.image_cache_size:
+            _cache.popitem(last=False)
+
+    return jpeg
+
+
+def read_upload(file):
+    """Read an uploaded file, up to cfgservice.image_max_bytes
+
+    Keyword arguments:
+    + file -- werkzeug FileStorage
+
+    Return: (bytes, None) or (None, error message)
+    """
+    if file.filename == "":
+        return None, "No selected file"
+
+    data = file.read(cfgservice.image_max_bytes + 1)
+    if len(data) > cfgservice.image_max_bytes:
+        return None, "Image file is too big."
+
+    return data, None
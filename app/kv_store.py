@@ -0,0 +1,158 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This kv_store.py contains the key/value stores (with per key time-to-live) used to keep
+short lived service state, either in the process memory or in a Redis protocol server
+(Redis, Valkey, KeyDB, ...) shared by several service nodes.
+"""
+
+import heapq
+import threading
+import time
+
+
+class MemoryStore:
+    """In-process key/value store with per key expiry.
+
+    Expired keys are never returned and are purged incrementally (oldest expiry first),
+    so no periodic full scan is needed.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expiries = []
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._expiries and self._expiries[0][0] <= now:
+            expires, key = heapq.heappop(self._expiries)
+            entry = self._data.get(key)
+            if entry is not None and entry[0] == expires:
+                del self._data[key]
+
+    def get(self, key):
+        """Return the value stored in key, or None if missing or expired."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        """Store value in key for ttl seconds."""
+        now = time.monotonic()
+        expires = now + ttl
+        with self._lock:
+            self._purge(now)
+            self._data[key] = (expires, value)
+            heapq.heappush(self._expiries, (expires, key))
+
+    def add(self, key, value, ttl):
+        """Store value in key for ttl seconds, only if key does not exist.
+
+        Return: True if the value was stored, False if the key already existed.
+        """
+        now = time.monotonic()
+        expires = now + ttl
+        with self._lock:
+            self._purge(now)
+            if key in self._data:
+                return False
+            self._data[key] = (expires, value)
+            heapq.heappush(self._expiries, (expires, key))
+        return True
+
+    def touch(self, key, ttl):
+        """Reset the time-to-live of an existing key."""
+        now = time.monotonic()
+        expires = now + ttl
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                return False
+            self._data[key] = (expires, entry[1])
+            heapq.heappush(self._expiries, (expires, key))
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            self._purge(time.monotonic())
+            return len(self._data)
+
+
+class RedisStore:
+    """Key/value store backed by a Redis protocol server, shared between service nodes."""
+
+    def __init__(self, url, prefix="eudiw:"):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    @property
+    def client(self):
+        return self._client
+
+    def get(self, key):
+        return self._client.get(self._prefix + key)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, value, px=int(ttl * 1000))
+
+    def add(self, key, value, ttl):
+        return bool(
+            self._client.set(self._prefix + key, value, px=int(ttl * 1000), nx=True)
+        )
+
+    def touch(self, key, ttl):
+        return bool(self._client.pexpire(self._prefix + key, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._client.delete(self._prefix + key)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(backend, url=None):
+    """Return the shared store for the given backend.
+
+    Keyword arguments:
+    + backend -- "memory" or "redis"
+    + url -- Redis URL (only used by the "redis" backend)
+
+    Return: MemoryStore or RedisStore instance (one per backend and url).
+    """
+    with _stores_lock:
+        store = _stores.get((backend, url))
+        if store is None:
+            if backend == "memory":
+                store = MemoryStore()
+            elif backend == "redis":
+                store = RedisStore(url)
+            else:
+                raise ValueError("Unsupported store backend: " + str(backend))
+            _stores[(backend, url)] = store
+        return store
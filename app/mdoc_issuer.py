@@ -0,0 +1,248 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This mdoc_issuer.py contains the reusable mdoc (ISO 18013-5) issuer.
+
+An MdocIssuer is built once per (document signer, doctype) (see ds_keys.py): the COSE protected
+header and x5chain (DER certificate) are encoded once. issue_many signs one MSO per device key,
+with the same structure as pymdoccbor MdocCborIssuer (issuerSigned nameSpaces and untagged
+COSE_Sign1 issuerAuth).
+"""
+
+import base64
+import datetime
+import hashlib
+import os
+import random
+
+import cbor2
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from pymdoccbor import settings
+
+from .app_config.config_countries import ConfCountries as cfgcountries
+from .signers import load_signer
+
+# curve name -> (COSE alg, COSE alg id, digest algorithm)
+CURVES = {
+    "secp256r1": ("ES256", -7, ("SHA-256", hashlib.sha256)),
+    "secp384r1": ("ES384", -35, ("SHA-384", hashlib.sha384)),
+    "secp521r1": ("ES512", -36, ("SHA-512", hashlib.sha512)),
+}
+
+# COSE curve identifiers of the device keys
+DEVICE_KEY_CURVES = {
+    "secp256r1": 1,
+    "secp384r1": 2,
+    "secp521r1": 3,
+    "brainpoolP256r1": 8,
+    "brainpoolP384r1": 9,
+    "brainpoolP512r1": 10,
+}
+
+
+def device_cose_key(device_publickey):
+    """COSE key (deviceKeyInfo) of the holder device key
+
+    Keyword arguments:
+    + device_publickey -- urlsafe base64 encoded PEM public key (EC)
+
+    Return: dict
+    """
+    public_key = serialization.load_pem_public_key(
+        base64.urlsafe_b64decode(device_publickey.encode("utf-8"))
+    )
+    if not isinstance(public_key, ec.EllipticCurvePublicKey):
+        raise TypeError("Device key is not an EllipticCurvePublicKey")
+
+    numbers = public_key.public_numbers()
+    return {
+        1: 2,
+        -1: DEVICE_KEY_CURVES.get(public_key.curve.name),
+        -2: numbers.x.to_bytes((numbers.x.bit_length() + 7) // 8, "big"),
+        -3: numbers.y.to_bytes((numbers.y.bit_length() + 7) // 8, "big"),
+    }
+
+
+def _tagged(name, value):
+    """Element value with the CBOR tags of pymdoccbor (full-date elements)."""
+    tag = settings.CBORTAGS_ATTR_MAP.get(name)
+    if tag:
+        return cbor2.CBORTag(tag, value=value)
+
+    if isinstance(value, dict):
+        return {key: _tagged(key, item) for key, item in value.items()}
+
+    if isinstance(value, list) and name != "nationality":
+        return [
+            {key: _tagged(key, item) for key, item in element.items()}
+            if isinstance(element, dict)
+            else element
+            for element in value
+        ]
+
+    return value
+
+
+def _cbor_datetime(dt):
+    return cbor2.CBORTag(0, dt.isoformat().split(".")[0] + "Z")
+
+
+class MdocIssuer:
+    """mdoc issuer bound to one document signer and doctype."""
+
+    def __init__(self, signer, doctype):
+        """
+        Keyword arguments:
+        + signer -- document signer (signers.Signer), its certificate is the x5chain
+        + doctype -- mdoc doctype
+        """
+        self.alg, alg_id, (self.digest_algorithm, self._digest) = CURVES[signer.curve]
+        self._signer = signer
+        self.doctype = doctype
+
+        self._protected = cbor2.dumps({1: alg_id})
+        self._unprotected = {33: signer.certificate_der}
+
+    @classmethod
+    def from_country(cls, country, doctype):
+        """Issuer with the document signer of a country (cfgcountries)."""
+        return cls(load_signer(cfgcountries.supported_countries[country]), doctype)
+
+    def _sign(self, payload):
+        sig_structure = cbor2.dumps(["Signature1", self._protected, b"", payload])
+        return [
+            self._protected,
+            self._unprotected,
+            payload,
+            self._signer.sign(sig_structure),
+        ]
+
+    def _validity_info(self, validity):
+        utcnow = datetime.datetime.utcnow()
+        valid_from = max(
+            datetime.datetime.strptime(validity["issuance_date"], "%Y-%m-%d"), utcnow
+        )
+        if settings.PYMDOC_EXP_DELTA_HOURS:
+            valid_until = utcnow + datetime.timedelta(
+                hours=int(settings.PYMDOC_EXP_DELTA_HOURS)
+            )
+        else:
+            valid_until = datetime.datetime.strptime(
+                validity["expiry_date"], "%Y-%m-%d"
+            ).replace(hour=23, minute=59, second=59)
+
+        return {
+            "signed": _cbor_datetime(utcnow),
+            "validFrom": _cbor_datetime(valid_from),
+            "validUntil": _cbor_datetime(valid_until),
+        }
+
+    def issue_many(self, data, device_keys, validity, revocation=None):
+        """Issue one mdoc per device key
+
+        Keyword arguments:
+        + data -- {namespace: {element identifier: value}}
+        + device_keys -- holder device keys (urlsafe base64 encoded PEM)
+        + validity -- {"issuance_date": "YYYY-MM-DD", "expiry_date": "YYYY-MM-DD"}
+        + revocation -- MSO status (optional)
+
+        Return: list of CBOR encoded mdocs (bytes)
+        """
+        elements = [
+            (namespace, name, _tagged(name, value))
+            for namespace, values in data.items()
+            for name, value in values.items()
+        ]
+        salt_length = settings.DIGEST_SALT_LENGTH
+        salts = os.urandom(salt_length * len(elements) * len(device_keys))
+        validity_info = self._validity_info(validity)
+
+        mdocs = []
+        for doc, device_key in enumerate(device_keys):
+            order = list(range(len(elements)))
+            random.shuffle(order)
+
+            name_spaces = {namespace: [] for namespace in data}
+            value_digests = {namespace: {} for namespace in data}
+            offset = doc * len(elements) * salt_length
+
+            for digest_id, index in enumerate(order):
+                namespace, name, value = elements[index]
+                item = cbor2.CBORTag(
+                    24,
+                    value=cbor2.dumps(
+                        {
+                            "digestID": digest_id,
+                            "random": salts[
+                                offset + digest_id * salt_length : offset
+                                + (digest_id + 1) * salt_length
+                            ],
+                            "elementIdentifier": name,
+                            "elementValue": value,
+                        },
+                        canonical=True,
+                    ),
+                )
+                name_spaces[namespace].append(item)
+                value_digests[namespace][digest_id] = self._digest(
+                    cbor2.dumps(item, canonical=True)
+                ).digest()
+
+            mso = {
+                "docType": self.doctype,
+                "version": "1.0",
+                "validityInfo": validity_info,
+                "valueDigests": value_digests,
+                "deviceKeyInfo": {"deviceKey": device_cose_key(device_key)},
+                "digestAlgorithm": self.digest_algorithm,
+            }
+            if revocation is not None:
+                mso["status"] = revocation
+
+            payload = cbor2.dumps(
+                cbor2.CBORTag(24, cbor2.dumps(mso, canonical=True)), canonical=True
+            )
+
+            mdocs.append(
+                cbor2.dumps(
+                    {
+                        "version": "1.0",
+                        "documents": [
+                            {
+                                "docType": self.doctype,
+                                "issuerSigned": {
+                                    "nameSpaces": name_spaces,
+                                    "issuerAuth": self._sign(payload),
+                                },
+                            }
+                        ],
+                        "status": 0,
+                    },
+                    canonical=True,
+                )
+            )
+
+        return mdocs
+
+    def issue(self, data, device_key, validity, revocation=None):
+        """Issue one mdoc (see issue_many)."""
+        return self.issue_many(data, [device_key], validity, revocation)[0]
@@ -0,0 +1,103 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This metrics.py contains the service metrics (counters and gauges), exposed in the
+Prometheus text format by /admin/metrics.
+"""
+
+import threading
+
+_lock = threading.Lock()
+_help = {}
+_counters = {}
+_gauges = {}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, help, amount=1, **labels):
+    """Increment a counter
+
+    Keyword arguments:
+    + name -- metric name
+    + help -- metric description
+    + amount -- increment
+    + labels -- metric labels
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        _help.setdefault(name, help)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauge(name, help, function):
+    """Register a gauge, read when the metrics are collected
+
+    Keyword arguments:
+    + name -- metric name
+    + help -- metric description
+    + function -- function returning the gauge value
+    """
+    with _lock:
+        _help[name] = help
+        _gauges[name] = function
+
+
+def render():
+    """Metrics in the Prometheus text format."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        helps = dict(_help)
+
+    lines = []
+
+    by_name = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    for name in sorted(by_name):
+        lines.append("# HELP " + name + " " + helps[name])
+        lines.append("# TYPE " + name + " counter")
+        for labels, value in sorted(by_name[name]):
+            lines.append(name + _format_labels(labels) + " " + str(value))
+
+    for name in sorted(gauges):
+        lines.append("# HELP " + name + " " + helps[name])
+        lines.append("# TYPE " + name + " gauge")
+        lines.append(name + " " + str(gauges[name]()))
+
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for key, value in labels
+        )
+        + "}"
+    )
@@ -26,11 +26,10 @@ import base64
 import datetime
 
 # from app.route_oidc import authentication_error_redirect
-from io import BytesIO
 import secrets
 from urllib import request
-from PIL import Image
 from app import oidc_metadata
+from app.image_pipeline import to_portrait_jpeg
 from flask import jsonify, current_app, redirect
 from flask.helpers import make_response
 from redirect_func import url_get
@@ -95,19 +94,8 @@ def calculate_age(date_of_birth: str):
 
 
 def convert_png_to_jpeg(png_bytes):
-    # Open the PNG image from bytes
-    png_image = Image.open(BytesIO(png_bytes))
-
-    # Create a new in-memory file-like object
-    jpeg_buffer = BytesIO()
-
-    # Convert the PNG image to JPEG format and save to the buffer
-    png_image.convert("RGB").save(jpeg_buffer, format="JPEG")
-
-    # Get the JPEG bytes from the buffer
-    jpeg_bytes = jpeg_buffer.getvalue()
-
-    return jpeg_bytes
+    """Convert an image (PNG or JPEG) to the mdoc portrait profile (see image_pipeline.to_portrait_jpeg)"""
+    return to_portrait_jpeg(png_bytes)
 
 def getNamespaces(claims):
     namespaces = []
@@ -556,24 +544,6 @@ def generate_unique_id():
     return str(uuid.uuid4())
 
 
-def validate_image(file):
-    """
-    Converts input file value into base64url
-    """
-    try:
-        if file.filename == "":
-            return False, "No selected file"
-
-        img = Image.open(file)
-
-        width, height = img.size
-        if width != 360 or height != 433:
-            return False, "Image dimensions are invalid."
-    except:
-        return False, "Failed to open image."
-
-    return True, None
-
 def getSubClaims(claimLv1, vct):
     subclaims = []
     credentialsSupported = oidc_metadata["credential_configurations_supported"]
@@ -652,6 +622,39 @@ def scope2details(scope):
     return configuration_ids
 
 
+def get_proof_jwts(credential_request):
+    """Get the proof JWTs of a credential request ("proof" or "proofs" parameter)
+
+    Keyword arguments:
+    + credential_request -- credential request (dict)
+
+    Return: list of proof JWTs
+    """
+    proof_jwts = []
+
+    proof = credential_request.get("proof")
+    if isinstance(proof, dict) and "jwt" in proof:
+        proof_jwts.append(proof["jwt"])
+
+    proofs = credential_request.get("proofs")
+    if isinstance(proofs, dict) and isinstance(proofs.get("jwt"), list):
+        proof_jwts.extend(proofs["jwt"])
+
+    return proof_jwts
+
+
+def jwt_claims(token):
+    """Decode the payload of a JWT (the signature is not verified)
+
+    Keyword arguments:
+    + token -- JWT (compact serialization)
+
+    Return: dict with the JWT claims
+    """
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+
 def credential_error_resp(error, desc):
     return (
         jsonify(
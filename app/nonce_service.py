@@ -0,0 +1,142 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This nonce_service.py contains the c_nonce issuance and stateless verification.
+
+Nonces carry their own expiry and are protected either with HMAC-SHA256 ("HS256") or
+sealed with AES-256-GCM ("A256GCM"). The symmetric keys are derived once per process from the
+nonce secret of config_secrets.py (nonce_secret_key), so every node sharing that secret accepts
+the same nonces.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import time
+from functools import lru_cache
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from .app_config.config_service import ConfService as cfgservice
+from app_config.config_secrets import nonce_secret_key
+
+NONCE_ALGORITHMS = ("HS256", "A256GCM")
+
+_AAD = b"eudiw c_nonce"
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+@lru_cache(maxsize=None)
+def nonce_secret(algorithm):
+    """Derive the symmetric key used by the nonce algorithm from the nonce secret (once per
+    algorithm, the key is cached)
+
+    Keyword arguments:
+    + algorithm -- "HS256" or "A256GCM"
+
+    Return: 32 byte key
+    """
+    if not nonce_secret_key or nonce_secret_key == "secret_here":
+        raise ValueError("nonce_secret_key is not set in config_secrets.py")
+
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=_AAD + b" " + algorithm.encode("ascii"),
+    ).derive(nonce_secret_key.encode("utf-8"))
+
+
+@lru_cache(maxsize=None)
+def _aesgcm():
+    return AESGCM(nonce_secret("A256GCM"))
+
+
+def new_nonce(algorithm=None, expires_in=None):
+    """Create a new c_nonce
+
+    Keyword arguments:
+    + algorithm -- "HS256" or "A256GCM". Defaults to cfgservice.nonce_algorithm
+    + expires_in -- nonce lifetime in seconds. Defaults to cfgservice.nonce_expiry
+
+    Return: c_nonce (string)
+    """
+    algorithm = algorithm or cfgservice.nonce_algorithm
+    if expires_in is None:
+        expires_in = cfgservice.nonce_expiry * 60
+
+    # 8 bytes expiry (unix time) + 16 random bytes
+    payload = struct.pack(">Q", int(time.time()) + expires_in) + os.urandom(16)
+
+    if algorithm == "HS256":
+        mac = hmac.new(nonce_secret(algorithm), payload, hashlib.sha256).digest()[:16]
+        return _b64encode(payload) + "." + _b64encode(mac)
+
+    if algorithm == "A256GCM":
+        iv = os.urandom(12)
+        return _b64encode(iv + _aesgcm().encrypt(iv, payload, _AAD))
+
+    raise ValueError("Unsupported nonce algorithm: " + str(algorithm))
+
+
+def verify_nonce(nonce, algorithm=None):
+    """Verify a c_nonce created by new_nonce, without any server side state
+
+    Keyword arguments:
+    + nonce -- c_nonce (string)
+    + algorithm -- "HS256" or "A256GCM". Defaults to cfgservice.nonce_algorithm
+
+    Return: True if the nonce is authentic and not expired, False otherwise.
+    """
+    algorithm = algorithm or cfgservice.nonce_algorithm
+
+    try:
+        if algorithm == "HS256":
+            encoded_payload, encoded_mac = nonce.split(".")
+            payload = _b64decode(encoded_payload)
+            mac = hmac.new(nonce_secret(algorithm), payload, hashlib.sha256).digest()[:16]
+            if not hmac.compare_digest(mac, _b64decode(encoded_mac)):
+                return False
+
+        elif algorithm == "A256GCM":
+            sealed = _b64decode(nonce)
+            payload = _aesgcm().decrypt(sealed[:12], sealed[12:], _AAD)
+
+        else:
+            return False
+
+        (expires,) = struct.unpack(">Q", payload[:8])
+
+    except Exception:
+        return False
+
+    return time.time() < expires
@@ -0,0 +1,228 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This notification_pipeline.py contains the asynchronous notification events ingestion.
+
+Validated notification events are put in a bounded in-memory queue and a background thread
+appends them in batches to the notification_events table (SQLite), updating the
+per-credential counters (notification_counters table) in the same transaction.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from .app_config.config_service import ConfService as cfgservice
+
+NOTIFICATION_EVENTS = ("credential_accepted", "credential_failure", "credential_deleted")
+
+UNKNOWN_CREDENTIAL = "unknown"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notification_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    received REAL NOT NULL,
+    session_id TEXT,
+    notification_id TEXT NOT NULL,
+    credential TEXT NOT NULL,
+    event TEXT NOT NULL,
+    event_description TEXT
+);
+CREATE TABLE IF NOT EXISTS notification_credentials (
+    notification_id TEXT PRIMARY KEY,
+    credential TEXT NOT NULL,
+    issued REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notification_counters (
+    credential TEXT NOT NULL,
+    event TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (credential, event)
+);
+"""
+
+_queue = queue.Queue(maxsize=cfgservice.notification_queue_size)
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _connect():
+    os.makedirs(os.path.dirname(cfgservice.notification_db), exist_ok=True)
+    conn = sqlite3.connect(cfgservice.notification_db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def validate_notification(payload):
+    """Validate a notification request
+
+    Keyword arguments:
+    + payload -- notification request (dict)
+
+    Return: error description, or None if the notification is valid
+    """
+    if not isinstance(payload, dict):
+        return "Notification request must be a JSON object"
+
+    if not isinstance(payload.get("notification_id"), str) or not payload["notification_id"]:
+        return "Missing notification_id"
+
+    if payload.get("event") not in NOTIFICATION_EVENTS:
+        return "Invalid event"
+
+    if "event_description" in payload and not isinstance(payload["event_description"], str):
+        return "Invalid event_description"
+
+    return None
+
+
+def _submit(record):
+    _start_flusher()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        return False
+    return True
+
+
+def submit_notification(payload, session_id=None):
+    """Queue a (validated) notification event
+
+    Keyword arguments:
+    + payload -- notification request (dict)
+    + session_id -- session id of the access token
+
+    Return: True if the event was queued, False if the queue is full
+    """
+    return _submit(
+        (
+            "event",
+            (
+                time.time(),
+                session_id,
+                payload["notification_id"],
+                payload["event"],
+                payload.get("event_description"),
+            ),
+        )
+    )
+
+
+def register_notification_id(notification_id, credential):
+    """Record the credential configuration issued with a notification_id
+
+    Keyword arguments:
+    + notification_id -- notification_id returned in the credential response
+    + credential -- credential configuration id
+    """
+    _submit(("credential", (notification_id, credential, time.time())))
+
+
+def _write_batch(conn, batch):
+    with conn:
+        for kind, values in batch:
+            if kind == "credential":
+                conn.execute(
+                    "INSERT OR REPLACE INTO notification_credentials "
+                    "(notification_id, credential, issued) VALUES (?, ?, ?)",
+                    values,
+                )
+                continue
+
+            received, session_id, notification_id, event, event_description = values
+            row = conn.execute(
+                "SELECT credential FROM notification_credentials WHERE notification_id = ?",
+                (notification_id,),
+            ).fetchone()
+            credential = row[0] if row else UNKNOWN_CREDENTIAL
+
+            conn.execute(
+                "INSERT INTO notification_events (received, session_id, notification_id, "
+                "credential, event, event_description) VALUES (?, ?, ?, ?, ?, ?)",
+                (received, session_id, notification_id, credential, event, event_description),
+            )
+            conn.execute(
+                "INSERT INTO notification_counters (credential, event, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (credential, event) DO UPDATE SET count = count + 1",
+                (credential, event),
+            )
+
+
+def _flush_loop():
+    conn = _connect()
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + cfgservice.notification_flush_interval
+        while len(batch) < cfgservice.notification_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        try:
+            _write_batch(conn, batch)
+        except Exception as e:
+            cfgservice.app_logger.exception(
+                "Failed to write " + str(len(batch)) + " notification records: " + str(e)
+            )
+
+
+def _start_flusher():
+    global _flusher
+
+    if _flusher is not None:
+        return
+
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_loop, name="notification-flusher", daemon=True
+            )
+            _flusher.start()
+
+
+def notification_counters():
+    """Get the notification counters
+
+    Return: {credential configuration id: {event: count}}
+    """
+    conn = _connect()
+    try:
+        counters = {}
+        for credential, event, count in conn.execute(
+            "SELECT credential, event, count FROM notification_counters ORDER BY credential, event"
+        ):
+            counters.setdefault(credential, {})[event] = count
+        return counters
+    finally:
+        conn.close()
+
+
+def queue_size():
+    """Number of notification records waiting to be written."""
+    return _queue.qsize()
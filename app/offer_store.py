@@ -0,0 +1,108 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This offer_store.py contains the credential offer references store and the creation of
+credential offer URIs, either by value (credential_offer) or by reference (credential_offer_uri).
+"""
+
+import json
+import secrets
+import time
+import urllib.parse
+
+from .app_config.config_service import ConfService as cfgservice
+from .kv_store import get_store
+
+_offers = get_store(cfgservice.state_backend, cfgservice.redis_url)
+
+# expired references are kept for this long (seconds) so they can be answered with 410
+EXPIRED_GRACE = 3600
+
+OFFER_EXPIRED = "expired"
+
+
+def store_offer(credential_offer):
+    """Store a credential offer by reference
+
+    Keyword arguments:
+    + credential_offer -- credential offer (dict)
+
+    Return: reference id
+    """
+    reference_id = secrets.token_urlsafe(12)
+    ttl = cfgservice.form_expiry * 60
+    entry = {"credential_offer": credential_offer, "expires": time.time() + ttl}
+
+    _offers.set(
+        "offer:" + reference_id, json.dumps(entry).encode("utf-8"), ttl + EXPIRED_GRACE
+    )
+
+    return reference_id
+
+
+def get_offer(reference_id):
+    """Get a credential offer by reference
+
+    Keyword arguments:
+    + reference_id -- reference id returned by store_offer
+
+    Return: (credential offer, seconds until expiry); (OFFER_EXPIRED, 0) if the reference
+    has expired; (None, 0) if the reference is unknown.
+    """
+    raw = _offers.get("offer:" + reference_id)
+    if raw is None:
+        return None, 0
+
+    entry = json.loads(raw)
+    remaining = int(entry["expires"] - time.time())
+    if remaining <= 0:
+        return OFFER_EXPIRED, 0
+
+    return entry["credential_offer"], remaining
+
+
+def offer_uri(credential_offer, credential_offer_URI, mode=None):
+    """Create the credential offer URI (encoded in the QR code)
+
+    Keyword arguments:
+    + credential_offer -- credential offer (dict)
+    + credential_offer_URI -- URI scheme of the offer (e.g. openid-credential-offer://)
+    + mode -- "value" (the offer is embedded in the URI) or "reference" (only a
+              credential_offer_uri pointing to the stored offer is embedded).
+              Defaults to cfgservice.credential_offer_mode
+
+    Return: credential offer URI
+    """
+    mode = mode or cfgservice.credential_offer_mode
+
+    if mode == "reference":
+        reference_id = store_offer(credential_offer)
+        return (
+            f"{credential_offer_URI}credential_offer?credential_offer_uri="
+            + urllib.parse.quote(
+                cfgservice.service_url + "credential-offer-reference/" + reference_id,
+                safe=":/",
+            )
+        )
+
+    return f"{credential_offer_URI}credential_offer?credential_offer=" + urllib.parse.quote(
+        json.dumps(credential_offer), safe=":/"
+    )
@@ -0,0 +1,121 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This page_cache.py contains the cache of the rendered pages that only depend on the
+configuration and the metadata (landing page, credential offer choice, authentication method
+and country selection pages).
+
+A page is rendered once per template, template context and configuration version, and kept
+with its gzip variant and ETag (cfgservice.page_cache_size pages, least recently used first out).
+Requests with a matching If-None-Match get a 304. invalidate() starts a new configuration
+version, e.g. after the metadata or the countries configuration changed.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import make_response, render_template, request
+
+from .app_config.config_service import ConfService as cfgservice
+from . import metrics, oidc_metadata
+
+
+class _Page:
+    def __init__(self, body):
+        self.body = body
+        self.gzip = gzip.compress(body, 9)
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+_pages = OrderedDict()
+_lock = threading.Lock()
+_version = None
+
+
+def version():
+    """Configuration version (digest of the metadata and service URL, new after invalidate)."""
+    global _version
+
+    if _version is None:
+        digest = hashlib.sha256(
+            json.dumps(oidc_metadata, sort_keys=True, default=str).encode("utf-8")
+        )
+        digest.update(cfgservice.service_url.encode("utf-8"))
+        _version = digest.hexdigest()[:16]
+    return _version
+
+
+def invalidate():
+    """Drop the rendered pages and start a new configuration version."""
+    global _version
+
+    with _lock:
+        _pages.clear()
+        _version = None
+
+
+def render_page(template, build=None, **context):
+    """Rendered page, from the cache when possible
+
+    Keyword arguments:
+    + template -- template name
+    + build -- function returning additional template context that only depends on the
+      configuration (only called when the page is rendered)
+    + context -- template context (part of the cache key)
+
+    Return: Flask response (gzip encoded if accepted, 304 if If-None-Match matches)
+    """
+    key = (template, version(), json.dumps(context, sort_keys=True, default=str))
+
+    with _lock:
+        page = _pages.get(key)
+        if page is not None:
+            _pages.move_to_end(key)
+
+    if page is None:
+        metrics.inc("page_cache_renders_total", "Pages rendered for the page cache", template=template)
+        if build is not None:
+            context = dict(build(), **context)
+        page = _Page(render_template(template, **context).encode("utf-8"))
+        with _lock:
+            _pages[key] = page
+            while len(_pages) > cfgservice.page_cache_size:
+                _pages.popitem(last=False)
+
+    if "gzip" in request.accept_encodings:
+        body, etag = page.gzip, page.etag + "-gzip"
+    else:
+        body, etag = page.body, page.etag
+
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(body)
+        if body is page.gzip:
+            response.headers["Content-Encoding"] = "gzip"
+
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
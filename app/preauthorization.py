@@ -22,10 +22,8 @@ This route generates a client registration capable of using a pre-authorization
 """
 
 import base64
-import io
 import json
 import random
-from PIL import Image
 from flask import Blueprint, current_app, make_response, redirect, render_template, request, session
 from flask_cors import CORS
 import requests
@@ -33,14 +31,18 @@ import urllib.parse
 from datetime import date, datetime, timedelta
 from redirect_func import url_get
 
-import segno
+from app.qr_code import qr_image_url
+from app.offer_store import offer_uri
+from app.rate_limit import rate_limited
 
 from app.route_oidc import service_endpoint
 from .app_config.config_service import ConfService as cfgservice
-from app.misc import authentication_error_redirect, calculate_age, generate_unique_id, getAttributesForm, getAttributesForm2, validate_image
+from app.misc import authentication_error_redirect, calculate_age, generate_unique_id, getAttributesForm, getAttributesForm2
+from app.image_pipeline import ImageBusy, read_upload, to_portrait_jpeg, validate_portrait
+from app.blob_store import blob_from_b64, blob_store, display_b64, store_blobs
 
 from app.data_management import parRequests, transaction_codes, getSessionId_requestUri, session_ids
-from app.data_management import form_dynamic_data
+from app.data_management import admit_form, form_dynamic_data
 from . import oidc_metadata
 
 from idpyoidc.message.oidc import AuthorizationRequest
@@ -91,7 +93,15 @@ def preauthRed():
 
 
 @preauth.route("/preauth_form", methods=["GET", "POST"])
+@rate_limited("preauth_form")
 def preauth_form():
+    if not admit_form():
+        return (
+            "Error 503: " + cfgservice.error_list["503"] + "\n",
+            503,
+            {"Retry-After": str(cfgservice.form_retry_after)},
+        )
+
     form_data = request.form.to_dict()
 
     user_id = generate_unique_id()
@@ -144,29 +154,29 @@ def preauth_form():
             
         elif item == "portrait":
             if grouped[item] == "Port1":
-                cleaned_data["portrait"] = cfgservice.portrait1
+                cleaned_data["portrait"] = blob_from_b64(cfgservice.portrait1)
             elif grouped[item] == "Port2":
-                cleaned_data["portrait"] = cfgservice.portrait2
+                cleaned_data["portrait"] = blob_from_b64(cfgservice.portrait2)
             elif grouped[item] == "Port3":
-                portrait= request.files["Image"]
+                portrait, error_msg = read_upload(request.files["Image"])
 
-                img = Image.open(portrait)
-                #imgbytes = img.tobytes()
-                bio = io.BytesIO()
-                img.save(bio, format="JPEG")
-                del img
+                if portrait is not None:
+                    response, error_msg = validate_portrait(portrait)
 
-                response,error_msg = validate_image(portrait)
+                if portrait is not None and response:
+                    try:
+                        portrait = to_portrait_jpeg(portrait)
+                    except (ValueError, ImageBusy) as e:
+                        portrait, error_msg = None, str(e)
 
-                if response==False:
+                if portrait is None or response==False:
                     return authentication_error_redirect(
                         jws_token=session["jws_token"],
                         error="Invalid Image",
                         error_description=error_msg,
                     )
                 else :
-                    imgurlbase64=base64.urlsafe_b64encode(bio.getvalue()).decode('utf-8')
-                    cleaned_data["portrait"]=imgurlbase64
+                    cleaned_data["portrait"] = blob_store.put(portrait)
 
         elif item == "Category1":
             DrivingPrivileges = []
@@ -200,7 +210,7 @@ def preauth_form():
         }
     )
 
-    form_dynamic_data[user_id] = cleaned_data.copy()
+    form_dynamic_data[user_id] = store_blobs(cleaned_data)
     form_dynamic_data[user_id].update({"expires":datetime.now() + timedelta(minutes=cfgservice.form_expiry)})
 
     credentialsSupported = oidc_metadata["credential_configurations_supported"]
@@ -259,7 +269,7 @@ def preauth_form():
             presentation_data[credential].update({"driving_privileges":json_priv})
         
         if "portrait" in presentation_data[credential]:
-            presentation_data[credential].update({"portrait":base64.b64encode(base64.urlsafe_b64decode(presentation_data[credential]["portrait"])).decode("utf-8")})
+            presentation_data[credential].update({"portrait":display_b64(presentation_data[credential]["portrait"])})
         
         if "NumberCategories" in presentation_data[credential]:
             for i in range(int(presentation_data[credential]["NumberCategories"])):
@@ -309,22 +319,11 @@ def generate_offer(data):
 
     
     # create URI
-    json_string = json.dumps(credential_offer)
-    
     credential_offer_URI = session["credential_offer_URI"]
 
-    uri = f"{credential_offer_URI}credential_offer?credential_offer=" + urllib.parse.quote(
-                    json_string, safe=":/"
-                )
-
-    qrcode = segno.make(uri)
-    out = io.BytesIO()
-    qrcode.save(out, kind='png', scale=2)
-    
+    uri = offer_uri(credential_offer, credential_offer_URI, session.get("credential_offer_mode"))
 
-    qr_img_base64 = "data:image/png;base64," + base64.b64encode(
-        out.getvalue()
-    ).decode("utf-8")
+    qr_img_url = qr_image_url(uri, scale=2)
 
     wallet_url = cfgservice.wallet_test_url + "redirect_preauth"
 
@@ -333,12 +332,13 @@ def generate_offer(data):
         wallet_dev= wallet_url + "?code=" + transaction_id + "&tx_code=" + str(tx_code) + "&credential_offer=" + json.dumps(credential_offer),
         url_data=uri,
         tx_code=tx_code,
-        qrcode=qr_img_base64,
+        qrcode=qr_img_url,
     )
 
 
 
 @preauth.route("/credentialOfferReq2", methods=["POST"])
+@rate_limited("credential_offer")
 def credentialOfferReq2():
 
     json_token = request.form.get('request')
@@ -406,7 +406,7 @@ def generate_preauth_token(data, authorization_details):
  
     data.update({"issuing_country": "FC"})
 
-    form_dynamic_data[user_id] = data.copy()
+    form_dynamic_data[user_id] = store_blobs(data)
 
     form_dynamic_data[user_id].update({"expires":datetime.now() + timedelta(minutes=cfgservice.form_expiry)})
 
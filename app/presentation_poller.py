@@ -0,0 +1,172 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This presentation_poller.py contains the shared polling of the OpenID4VP presentations.
+
+The browsers waiting on the QR code page of a presentation (SSE or long-poll on
+pid_authorization) do not call the verifier backend themselves: one poller per presentation_id
+asks the verifier, every cfgservice.presentation_poll_min_interval seconds at first and then
+less often (x cfgservice.presentation_poll_backoff, up to cfgservice.presentation_poll_max_interval),
+and wakes up every waiting client when the wallet response is there. A poller stops when
+the presentation is ready, after cfgservice.presentation_poll_timeout seconds, or when no client
+has waited for it for cfgservice.presentation_poll_idle seconds.
+"""
+
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .app_config.config_service import ConfService as cfgservice
+from . import metrics, verifier_client
+
+PENDING = "pending"
+READY = "ready"
+EXPIRED = "expired"
+
+# seconds a ready presentation is kept for the clients that did not get it yet
+READY_TTL = 60
+
+
+class PollerBusy(RuntimeError):
+    """Too many presentations are being polled."""
+
+
+class _Presentation:
+    def __init__(self, presentation_id, now):
+        self.id = presentation_id
+        self.state = PENDING
+        self.done = threading.Event()
+        self.deadline = now + cfgservice.presentation_poll_timeout
+        self.interval = cfgservice.presentation_poll_min_interval
+        self.last_wait = now
+
+
+_presentations = {}
+_schedule = []
+_condition = threading.Condition()
+_executor = None
+
+metrics.register_gauge(
+    "presentation_pollers", "Number of presentations being polled", lambda: len(_presentations)
+)
+
+
+def _start():
+    global _executor
+
+    if _executor is not None:
+        return
+
+    _executor = ThreadPoolExecutor(
+        max_workers=cfgservice.presentation_poll_workers, thread_name_prefix="presentation"
+    )
+    threading.Thread(target=_dispatch_loop, name="presentation-poller", daemon=True).start()
+
+
+def _finish(presentation, state):
+    presentation.state = state
+    presentation.done.set()
+
+
+def _dispatch_loop():
+    while True:
+        with _condition:
+            while True:
+                now = time.monotonic()
+                if _schedule and _schedule[0][0] <= now:
+                    break
+                _condition.wait(_schedule[0][0] - now if _schedule else None)
+
+            _, presentation_id = heapq.heappop(_schedule)
+            presentation = _presentations.get(presentation_id)
+            if presentation is None:
+                continue
+
+            if presentation.done.is_set():
+                # ready presentation kept READY_TTL seconds
+                del _presentations[presentation_id]
+                continue
+
+            if now >= presentation.deadline:
+                del _presentations[presentation_id]
+                _finish(presentation, EXPIRED)
+                continue
+
+            if now - presentation.last_wait >= cfgservice.presentation_poll_idle:
+                # abandoned page
+                del _presentations[presentation_id]
+                continue
+
+        _executor.submit(_poll, presentation)
+
+
+def _poll(presentation):
+    try:
+        ready = verifier_client.get_presentation(presentation.id).status_code == 200
+    except Exception as e:
+        cfgservice.app_logger.warning(
+            "Presentation " + presentation.id + " poll failed: " + str(e)
+        )
+        ready = False
+    metrics.inc("presentation_polls_total", "Verifier presentation polls", ready=str(ready).lower())
+
+    with _condition:
+        now = time.monotonic()
+        if ready:
+            _finish(presentation, READY)
+            heapq.heappush(_schedule, (now + READY_TTL, presentation.id))
+        else:
+            presentation.interval = min(
+                presentation.interval * cfgservice.presentation_poll_backoff,
+                cfgservice.presentation_poll_max_interval,
+            )
+            heapq.heappush(_schedule, (now + presentation.interval, presentation.id))
+        _condition.notify()
+
+
+def wait(presentation_id, timeout):
+    """Wait for the wallet response of a presentation
+
+    Keyword arguments:
+    + presentation_id -- transaction_id of the presentation (cross device flow)
+    + timeout -- maximum wait (seconds), 0 returns the current state
+
+    Return: PENDING, READY or EXPIRED
+    Raises PollerBusy if the presentation is not polled yet and cfgservice.presentation_poll_max
+    presentations are.
+    """
+    with _condition:
+        _start()
+        now = time.monotonic()
+        presentation = _presentations.get(presentation_id)
+        if presentation is None:
+            if len(_presentations) >= cfgservice.presentation_poll_max:
+                raise PollerBusy("Too many presentations are being polled")
+            presentation = _presentations[presentation_id] = _Presentation(presentation_id, now)
+            heapq.heappush(_schedule, (now, presentation_id))
+            _condition.notify()
+        presentation.last_wait = now
+
+    if timeout > 0:
+        presentation.done.wait(timeout)
+    presentation.last_wait = time.monotonic()
+    return presentation.state
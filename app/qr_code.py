@@ -0,0 +1,142 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This qr_code.py contains the QR code rendering service.
+Pages reference QR codes by URL (see qr_image_url); images are rendered (PNG or SVG) on a
+thread pool, kept in an LRU cache keyed by (payload, scale, kind) and served by the
+/qr/<qr_id>.<kind> route.
+"""
+
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import segno
+from flask import Blueprint, abort, make_response, request
+
+from .app_config.config_service import ConfService as cfgservice
+from .kv_store import get_store
+
+qr = Blueprint("qr", __name__, url_prefix="/qr")
+
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+_executor = ThreadPoolExecutor(
+    max_workers=cfgservice.qr_workers, thread_name_prefix="qr"
+)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_payloads = get_store(cfgservice.state_backend, cfgservice.redis_url)
+
+
+def render_qr(payload, scale, kind):
+    """Render a QR code image
+
+    Keyword arguments:
+    + payload -- data encoded in the QR code
+    + scale -- size of a single module, in pixels
+    + kind -- image format ("png" or "svg")
+
+    Return: image bytes
+    """
+    out = io.BytesIO()
+    segno.make(payload).save(out, kind=kind, scale=scale)
+    return out.getvalue()
+
+
+def _get_rendered(payload, scale, kind):
+    """Return a future with the rendered image, submitting the rendering if not cached."""
+    key = (payload, scale, kind)
+    with _cache_lock:
+        future = _cache.get(key)
+        if future is not None:
+            _cache.move_to_end(key)
+            return future
+
+        future = _executor.submit(render_qr, payload, scale, kind)
+        _cache[key] = future
+        if len(_cache) > cfgservice.qr_cache_size:
+            _cache.popitem(last=False)
+
+    future.add_done_callback(lambda done: _drop_failed(key, done))
+    return future
+
+
+def _drop_failed(key, future):
+    """Remove a failed rendering from the cache, so that the next request renders it again."""
+    if future.exception() is None:
+        return
+    with _cache_lock:
+        if _cache.get(key) is future:
+            del _cache[key]
+
+
+def _qr_id(payload):
+    digest = hashlib.sha256(payload.encode("utf-8")).digest()[:18]
+    return base64.urlsafe_b64encode(digest).decode("ascii")
+
+
+def qr_image_url(payload, scale=3, kind=None):
+    """Register a QR code payload and start rendering it in the background
+
+    Keyword arguments:
+    + payload -- data encoded in the QR code
+    + scale -- size of a single module, in pixels
+    + kind -- image format ("png" or "svg"). Defaults to cfgservice.qr_format
+
+    Return: URL of the QR code image
+    """
+    kind = kind or cfgservice.qr_format
+    qr_id = _qr_id(payload)
+    _payloads.set("qr:" + qr_id, payload.encode("utf-8"), cfgservice.qr_expiry * 60)
+    _get_rendered(payload, scale, kind)
+
+    return f"{cfgservice.service_url}qr/{qr_id}.{kind}?scale={scale}"
+
+
+@qr.route("/<string:qr_id>.<string:kind>", methods=["GET"])
+def qr_image(qr_id, kind):
+    if kind not in MIMETYPES:
+        abort(404)
+
+    payload = _payloads.get("qr:" + qr_id)
+    if payload is None:
+        abort(404)
+
+    scale = request.args.get("scale", 3, type=int)
+    if not 1 <= scale <= 10:
+        abort(400)
+
+    etag = f"{qr_id}-{scale}-{kind}"
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        image = _get_rendered(payload.decode("utf-8"), scale, kind).result()
+        response = make_response(image)
+        response.mimetype = MIMETYPES[kind]
+
+    # the payload may carry one-time codes: cacheable by the browser only
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"private, max-age={cfgservice.qr_expiry * 60}"
+    return response
@@ -0,0 +1,240 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This rate_limit.py contains the rate limiting of the issuance endpoints.
+
+Each limited route has token buckets (rate in requests per second, burst) per client
+(client_id parameter, or access token), per client IP address and for all the requests,
+configured in cfgservice.rate_limits. A request takes one token from each of its buckets, or
+none when one of them is empty: it is then refused with a 429 and Retry-After. The client IP
+address is taken from X-Forwarded-For behind cfgservice.proxy_trusted_hops reverse proxies
+(ProxyFix, see create_app). The buckets are kept in memory, or in the Redis protocol server (cfgservice.redis_url) with
+cfgservice.rate_limit_backend = "redis" so that all the service nodes share them.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, make_response, request
+
+from .app_config.config_service import ConfService as cfgservice
+from .kv_store import get_store
+from . import metrics
+
+SCOPES = ("client", "ip", "global")
+
+# buckets kept in memory before idle (full) buckets are dropped
+MEMORY_SWEEP_SIZE = 100000
+
+
+class MemoryBuckets:
+    """Token buckets in the process memory."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        for key, (tokens, updated, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+    def take(self, buckets):
+        """Take one token from each bucket, or none if a bucket is empty
+
+        Keyword arguments:
+        + buckets -- list of (bucket key, tokens added per second, bucket capacity)
+
+        Return: None if the tokens were taken, otherwise (index of the first empty bucket, wait
+        in seconds for its next token)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) >= MEMORY_SWEEP_SIZE and any(
+                key not in self._buckets for key, _, _ in buckets
+            ):
+                self._sweep(now)
+
+            levels = []
+            for key, rate, burst in buckets:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    levels.append(burst)
+                else:
+                    levels.append(min(burst, bucket[0] + (now - bucket[1]) * rate))
+
+            for index, (tokens, (_, rate, _)) in enumerate(zip(levels, buckets)):
+                if tokens < 1:
+                    return index, (1 - tokens) / rate
+
+            for tokens, (key, rate, burst) in zip(levels, buckets):
+                self._buckets[key] = (tokens - 1, now, rate, burst)
+            return None
+
+
+# KEYS buckets, ARGV rate and burst of each bucket; takes one token from each bucket, or none if a
+# bucket is empty. Returns {} if taken, otherwise {index (1-based), wait (milliseconds)}
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1]) / 1000
+    local burst = tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = burst
+    if bucket[1] then
+        tokens = math.min(burst, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+    end
+    if tokens < 1 then
+        return {i, math.ceil((1 - tokens) / rate)}
+    end
+    levels[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1]) / 1000
+    local burst = tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'updated', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate))
+end
+return {}
+"""
+
+
+class RedisBuckets:
+    """Token buckets in a Redis protocol server, shared by the service nodes."""
+
+    def __init__(self, url, prefix="eudiw:rate:"):
+        self._client = get_store("redis", url).client
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+        self._prefix = prefix
+
+    def take(self, buckets):
+        """Take one token from each bucket, or none (see MemoryBuckets.take)."""
+        args = []
+        for _, rate, burst in buckets:
+            args.extend((rate, burst))
+        rejected = self._take(keys=[self._prefix + key for key, _, _ in buckets], args=args)
+        if not rejected:
+            return None
+        return rejected[0] - 1, rejected[1] / 1000
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    """Token buckets of the service (cfgservice.rate_limit_backend), created on first use."""
+    global _buckets
+
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                if cfgservice.rate_limit_backend == "redis":
+                    _buckets = RedisBuckets(cfgservice.redis_url)
+                else:
+                    _buckets = MemoryBuckets()
+    return _buckets
+
+
+def _client_key():
+    client_id = request.values.get("client_id")
+    if client_id:
+        return "id:" + client_id
+
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        return "token:" + hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:32]
+    return None
+
+
+def check(route):
+    """Take a token from each bucket of a route for the current request
+
+    Keyword arguments:
+    + route -- route name (key of cfgservice.rate_limits)
+
+    Return: None if the request is allowed, otherwise (scope, wait in seconds)
+    """
+    limits = cfgservice.rate_limits.get(route)
+    if not cfgservice.rate_limit_enabled or not limits:
+        return None
+
+    keys = {"client": _client_key(), "ip": request.remote_addr or "unknown", "global": ""}
+    scopes = [scope for scope in SCOPES if scope in limits and keys[scope] is not None]
+    if not scopes:
+        return None
+
+    rejected = get_buckets().take(
+        [(route + ":" + scope + ":" + keys[scope],) + tuple(limits[scope]) for scope in scopes]
+    )
+    if rejected is None:
+        return None
+    index, wait = rejected
+    return scopes[index], wait
+
+
+def rate_limited(route):
+    """Decorator of the routes limited by cfgservice.rate_limits[route]."""
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            try:
+                rejected = check(route)
+            except Exception as e:
+                # the rate limiter never blocks the service (e.g. Redis not available)
+                cfgservice.app_logger.warning("Rate limiter error: " + str(e))
+                metrics.inc(
+                    "rate_limit_decisions_total", "Rate limiter decisions", route=route, decision="error"
+                )
+                return f(*args, **kwargs)
+
+            if rejected is None:
+                metrics.inc(
+                    "rate_limit_decisions_total", "Rate limiter decisions", route=route, decision="allowed"
+                )
+                return f(*args, **kwargs)
+
+            scope, wait = rejected
+            metrics.inc(
+                "rate_limit_decisions_total",
+                "Rate limiter decisions",
+                route=route,
+                decision="rejected",
+                scope=scope,
+            )
+            _resp = make_response(
+                jsonify(
+                    {"error": "too_many_requests", "error_description": "Too many requests, retry later"}
+                ),
+                429,
+            )
+            _resp.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+            return _resp
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,220 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This replay_index.py contains the detection of replayed proofs (credential endpoint).
+
+Each proof is identified by (nonce, jti), or (nonce, hash of the JWS signing input) when the
+proof has no jti, and is remembered for cfgservice.proof_replay_window minutes.
+
+The proofs of a credential request are reserved together before the credential is built
+(reserve_proofs), and released if the request fails (release_proofs).
+"""
+
+import hashlib
+import threading
+import time
+from collections import deque
+
+from .app_config.config_service import ConfService as cfgservice
+from .kv_store import get_store
+from .misc import jwt_claims
+
+
+class BloomFilter:
+    """Fixed size Bloom filter over 16 byte digests."""
+
+    def __init__(self, size_bits, hashes=4):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray((size_bits + 7) // 8)
+
+    def _positions(self, digest):
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[4 * i : 4 * i + 4], "big") % self.size_bits
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(digest)
+        )
+
+
+class _Bucket:
+    __slots__ = ("bucket_id", "digests", "bloom", "overflow")
+
+    def __init__(self, bucket_id, bloom_bits):
+        self.bucket_id = bucket_id
+        self.digests = set()
+        self.bloom = BloomFilter(bloom_bits) if bloom_bits else None
+        self.overflow = False
+
+
+class ReplayIndex:
+    """In-process replay index: a time bucketed set of digests.
+
+    The window is split in a fixed number of buckets; a whole bucket is dropped when it
+    leaves the window, so checks and insertions are O(1). Each bucket holds at most
+    max_entries digests. With a Bloom filter front, lookups skip buckets that surely do
+    not hold the digest and, once a bucket is full, new digests are only recorded in its
+    Bloom filter (a false positive is then reported as a replay).
+    """
+
+    def __init__(self, window, buckets, max_entries, bloom_bits=0):
+        """
+        Keyword arguments:
+        + window -- replay window in seconds
+        + buckets -- number of time buckets in the window
+        + max_entries -- maximum number of digests per bucket
+        + bloom_bits -- size of the Bloom filter of each bucket (0 disables it)
+        """
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.max_entries = max_entries
+        self.bloom_bits = bloom_bits
+        self._buckets = deque()
+        self._lock = threading.Lock()
+
+    def check_and_add(self, key):
+        """Record key
+
+        Keyword arguments:
+        + key -- proof identifier (string)
+
+        Return: True if key was not seen in the window, False if it is a replay.
+        """
+        digest = hashlib.sha256(key.encode("utf-8")).digest()[:16]
+        bucket_id = int(time.time() // self.bucket_seconds)
+
+        with self._lock:
+            # the current bucket is partly elapsed: buckets + 1 buckets cover the whole window
+            while self._buckets and self._buckets[0].bucket_id < bucket_id - self.buckets:
+                self._buckets.popleft()
+
+            for bucket in self._buckets:
+                if bucket.bloom is not None:
+                    if digest not in bucket.bloom:
+                        continue
+                    if bucket.overflow:
+                        return False
+                if digest in bucket.digests:
+                    return False
+
+            if not self._buckets or self._buckets[-1].bucket_id != bucket_id:
+                self._buckets.append(_Bucket(bucket_id, self.bloom_bits))
+            bucket = self._buckets[-1]
+
+            if bucket.bloom is not None:
+                bucket.bloom.add(digest)
+            if len(bucket.digests) < self.max_entries:
+                bucket.digests.add(digest)
+            elif bucket.bloom is not None:
+                bucket.overflow = True
+            else:
+                # full bucket without Bloom filter: evict an arbitrary digest
+                bucket.digests.pop()
+                bucket.digests.add(digest)
+
+        return True
+
+    def discard(self, key):
+        """Forget key (a digest only held by a full bucket's Bloom filter stays recorded)
+
+        Keyword arguments:
+        + key -- proof identifier (string)
+        """
+        digest = hashlib.sha256(key.encode("utf-8")).digest()[:16]
+        with self._lock:
+            for bucket in self._buckets:
+                bucket.digests.discard(digest)
+
+
+class SharedReplayIndex:
+    """Replay index kept in the shared kv_store (atomic set-if-absent with expiry)."""
+
+    def __init__(self, store, window):
+        self.store = store
+        self.window = window
+
+    def check_and_add(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return self.store.add("replay:" + digest, b"1", self.window)
+
+    def discard(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        self.store.delete("replay:" + digest)
+
+
+def proof_key(proof_jwt):
+    """Identifier of a proof: nonce and jti (or hash of the JWS signing input when there is no jti)
+
+    The signature is left out: ECDSA signatures are malleable, a replayed proof can carry
+    another valid signature of the same header and payload.
+
+    Keyword arguments:
+    + proof_jwt -- proof JWT (compact serialization)
+
+    Return: string
+    """
+    claims = jwt_claims(proof_jwt)
+    signing_input = proof_jwt.rsplit(".", 1)[0]
+    proof_id = claims.get("jti") or hashlib.sha256(signing_input.encode("utf-8")).hexdigest()
+    return str(claims.get("nonce", "")) + "|" + str(proof_id)
+
+
+if cfgservice.state_backend == "memory":
+    proof_replay_index = ReplayIndex(
+        window=cfgservice.proof_replay_window * 60,
+        buckets=cfgservice.proof_replay_buckets,
+        max_entries=cfgservice.proof_replay_max_entries,
+        bloom_bits=cfgservice.proof_replay_bloom_bits,
+    )
+else:
+    proof_replay_index = SharedReplayIndex(
+        get_store(cfgservice.state_backend, cfgservice.redis_url),
+        window=cfgservice.proof_replay_window * 60,
+    )
+
+
+def reserve_proofs(keys):
+    """Record the proofs of a request, or none of them if one is a replay
+
+    Keyword arguments:
+    + keys -- proof identifiers (see proof_key)
+
+    Return: True if the proofs were recorded, False if one of them was already seen
+    """
+    reserved = []
+    for key in keys:
+        if not proof_replay_index.check_and_add(key):
+            release_proofs(reserved)
+            return False
+        reserved.append(key)
+    return True
+
+
+def release_proofs(keys):
+    """Forget the proofs reserved by a request that failed (see reserve_proofs)."""
+    for key in keys:
+        proof_replay_index.discard(key)
@@ -0,0 +1,213 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This response_encryption.py contains the encryption of the credential responses (JWE compact
+serialization, OpenID4VCI credential_response_encryption), built with cryptojwt.
+
+The wallet JWK is parsed once and cached. The ECDH-ES key agreement runs on a thread pool while
+the credential is being built, so only the content encryption is left on the request thread.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cryptojwt.jwe.jwe import JWE
+from cryptojwt.jwe.jwe_ec import JWE_EC
+from cryptojwt.jwk.ec import ECKey
+from cryptojwt.jwk.jwk import key_from_jwk_dict
+
+from .app_config.config_service import ConfService as cfgservice
+
+ENC_ALGORITHMS = (
+    "A128GCM",
+    "A192GCM",
+    "A256GCM",
+    "A128CBC-HS256",
+    "A192CBC-HS384",
+    "A256CBC-HS512",
+)
+
+# RSA1_5 is deprecated (RFC 8725) and not accepted
+KEY_ALGORITHMS = ("ECDH-ES", "RSA-OAEP", "RSA-OAEP-256")
+
+
+class EncryptionError(ValueError):
+    """Unsupported or invalid credential_response_encryption parameters."""
+
+
+_keys = OrderedDict()
+_keys_lock = threading.Lock()
+
+
+def wallet_key(jwk):
+    """Public key of a wallet JWK (parsed once, LRU cache)
+
+    Keyword arguments:
+    + jwk -- JWK (dict) of the credential_response_encryption parameters
+
+    Return: cryptojwt key (ECKey or RSAKey)
+    """
+    cache_key = json.dumps(jwk, sort_keys=True)
+    with _keys_lock:
+        key = _keys.get(cache_key)
+        if key is not None:
+            _keys.move_to_end(cache_key)
+            return key
+
+    if not isinstance(jwk, dict) or jwk.get("kty") not in ("EC", "RSA"):
+        raise EncryptionError("Unsupported key type")
+    try:
+        key = key_from_jwk_dict(jwk, private=False)
+    except Exception as e:
+        raise EncryptionError("Invalid jwk: " + str(e))
+
+    with _keys_lock:
+        _keys[cache_key] = key
+        while len(_keys) > cfgservice.response_encryption_cache_size:
+            _keys.popitem(last=False)
+    return key
+
+
+class ResponseEncrypter:
+    """Key agreement and JWE header of one credential response."""
+
+    def __init__(self, key, alg, enc):
+        """
+        Keyword arguments:
+        + key -- wallet key (cryptojwt)
+        + alg -- key management algorithm
+        + enc -- content encryption algorithm
+        """
+        self._key = key
+        self._headers = {"alg": alg, "enc": enc}
+        if key.kid:
+            self._headers["kid"] = key.kid
+
+        self._setup = None
+        if alg == "ECDH-ES":
+            self._setup = JWE_EC(**self._headers).enc_setup(None, key=key)
+
+    def encrypt(self, plaintext):
+        """JWE (compact serialization) of the plaintext
+
+        The key agreement made in advance is used once, a new one is made for the next calls.
+
+        Keyword arguments:
+        + plaintext -- bytes or str
+
+        Return: str
+        """
+        setup, self._setup = self._setup, None
+        if setup is None:
+            return JWE(plaintext, **self._headers).encrypt(keys=[self._key])
+
+        cek, encrypted_key, iv, params, _ = setup
+        return JWE_EC(plaintext, **self._headers).encrypt(
+            cek=cek, iv=iv, params=params, encrypted_key=encrypted_key
+        )
+
+
+def _parameters(encryption):
+    if not isinstance(encryption, dict) or "jwk" not in encryption:
+        raise EncryptionError("Missing credential_response_encryption jwk")
+
+    alg = encryption.get("alg")
+    enc = encryption.get("enc")
+    if alg not in KEY_ALGORITHMS:
+        raise EncryptionError("Unsupported alg: " + str(alg))
+    if enc not in ENC_ALGORITHMS or enc not in cfgservice.response_encryption_enc:
+        raise EncryptionError("Unsupported enc: " + str(enc))
+
+    key = wallet_key(encryption["jwk"])
+    if (alg == "ECDH-ES") != isinstance(key, ECKey):
+        raise EncryptionError("Key type does not match alg " + alg)
+
+    return key, alg, enc
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=cfgservice.response_encryption_workers,
+                    thread_name_prefix="response-encryption",
+                )
+    return _executor
+
+
+def prepare(encryption):
+    """Start the key agreement of a credential response
+
+    The parameters are checked on the calling thread (EncryptionError), the key agreement runs
+    on the worker pool.
+
+    Keyword arguments:
+    + encryption -- credential_response_encryption parameters (jwk, alg, enc)
+
+    Return: Future of a ResponseEncrypter
+    """
+    parameters = _parameters(encryption)
+    if cfgservice.response_encryption_workers > 0:
+        return _pool().submit(ResponseEncrypter, *parameters)
+
+    future = Future()
+    future.set_result(ResponseEncrypter(*parameters))
+    return future
+
+
+def encrypt(encrypter, response):
+    """JWE of a credential response
+
+    Keyword arguments:
+    + encrypter -- Future of a ResponseEncrypter (see prepare)
+    + response -- credential response (dict, or JSON str/bytes)
+
+    Return: str
+    """
+    if isinstance(response, dict):
+        response = json.dumps(response)
+    return encrypter.result().encrypt(response)
+
+
+def encrypt_many(items):
+    """Encrypt a batch of credential responses on the worker pool
+
+    Keyword arguments:
+    + items -- list of (credential_response_encryption parameters, credential response)
+
+    Return: list of JWEs (same order)
+    """
+    parameters = [_parameters(encryption) for encryption, _ in items]
+
+    def _encrypt(index):
+        return ResponseEncrypter(*parameters[index]).encrypt(json.dumps(items[index][1]))
+
+    if cfgservice.response_encryption_workers <= 0:
+        return [_encrypt(index) for index in range(len(items))]
+    return list(_pool().map(_encrypt, range(len(items))))
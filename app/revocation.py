@@ -22,30 +22,52 @@ import json
 from urllib.parse import urlparse
 import uuid
 import cbor2
-from flask import Blueprint, jsonify, redirect, render_template, request, session, url_for
+from flask import Blueprint, jsonify, make_response, redirect, render_template, request, session, url_for
 import urllib
 from formatter_func import cbor2elems
 import requests
-import segno
+from app.qr_code import qr_image_url
 from .app_config.config_service import ConfService as cfgservice
 from app.misc import auth_error_redirect, authentication_error_redirect, scope2details, vct2doctype, vct2id
 from app.validate_vp_token import validate_vp_token
-from . import oidc_metadata, openid_metadata, oauth_metadata, oidc_metadata_clean
+from . import oidc_metadata, openid_metadata, oauth_metadata, oidc_metadata_clean, status_list
 from datetime import datetime, timedelta
 from app.data_management import (
     getSessionId_accessToken,
     parRequests,
     transaction_codes,
-    deferredRequests,
     session_ids,
     getSessionId_requestUri,
     getSessionId_authCode,
-    credential_offer_references,
     oid4vp_requests
 )
 
 revocation = Blueprint("revocation", __name__, url_prefix="/revocation")
 
+
+@revocation.route("status_list/<list_id>", methods=["GET"])
+def status_list_token(list_id):
+    """Status list token (statuslist+jwt) of a status list
+
+    Keyword arguments:
+    + list_id -- status list identifier (uri of the status claim / MSO status)
+
+    Return: signed status list token, 304 if it matches If-None-Match
+    """
+    entry = status_list.get_status_list(list_id)
+    if entry is None:
+        return make_response(jsonify({"error": "not_found"}), 404)
+
+    token, etag = entry.token()
+    if etag in request.headers.get("If-None-Match", ""):
+        response = make_response("", 304)
+    else:
+        response = make_response(token)
+        response.headers["Content-Type"] = "application/statuslist+jwt"
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "public, max-age=" + str(cfgservice.status_list_ttl)
+    return response
+
 #TODO finish revocation pages.
 """ @revocation.route("revocation_choice", methods=["GET"])
 def revocation_choice():
@@ -246,25 +268,12 @@ def oid4vp_call():
     )
 
     # Generate QR code
-    # img = qrcode.make("uri")
-    # QRCode.print_ascii()
-
-    qrcode = segno.make(qr_code_url)
-    out = io.BytesIO()
-    qrcode.save(out, kind='png', scale=3)
-
-
-    # qrcode.terminal()
-    # qr_img_base64 = qrcode.png_data_uri(scale=4)
-
-    qr_img_base64 = "data:image/png;base64," + base64.b64encode(out.getvalue()).decode(
-        "utf-8"
-    )
+    qr_img_url = qr_image_url(qr_code_url, scale=3)
 
     return render_template(
         "openid/revocation_qr_code.html",
         url_data=deeplink_url,
-        qrcode=qr_img_base64,
+        qrcode=qr_img_url,
         presentation_id=response_cross["transaction_id"],
         redirect_url= cfgservice.service_url
     )
@@ -0,0 +1,106 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This route_admin.py file contains the administration routes (protected with the X-Api-Key header).
+"""
+
+import hmac
+from functools import wraps
+
+from flask import Blueprint, Response, jsonify, make_response, request
+
+from app_config.config_secrets import admin_api_key
+from app_config.config_service import ConfService as cfgservice
+from . import ds_keys, metrics, notification_pipeline, status_list
+
+admin = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+def api_key_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not admin_api_key or admin_api_key == "secret_here":
+            # example value of config_secrets.py: the admin routes stay disabled
+            cfgservice.app_logger.warning(
+                "Admin route refused: admin_api_key is not set in config_secrets.py"
+            )
+            return make_response(jsonify({"error": "unauthorized"}), 401)
+
+        api_key = request.headers.get("X-Api-Key", "")
+        if not hmac.compare_digest(
+            api_key.encode("utf-8"), admin_api_key.encode("utf-8")
+        ):
+            return make_response(jsonify({"error": "unauthorized"}), 401)
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+@admin.route("/notifications", methods=["GET"])
+@api_key_required
+def notifications():
+    """Notification events counters per credential configuration id and event"""
+    return jsonify(
+        {
+            "counters": notification_pipeline.notification_counters(),
+            "queued": notification_pipeline.queue_size(),
+        }
+    )
+
+
+@admin.route("/metrics", methods=["GET"])
+@api_key_required
+def service_metrics():
+    """Service metrics (Prometheus text format)"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@admin.route("/ds_keys", methods=["GET"])
+@api_key_required
+def ds_key_stats():
+    """Weight, health and signatures of the DS keys in use, per country"""
+    return jsonify(ds_keys.key_stats())
+
+
+@admin.route("/status", methods=["POST"])
+@api_key_required
+def credential_status():
+    """Change the status of credentials
+
+    Body: {"statuses": [{"uri": status list uri or id, "idx": index, "status": 0 (valid),
+    1 (invalid) or 2 (suspended)}, ...]}, written in one transaction
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("statuses"), list):
+        return make_response(jsonify({"error": "invalid_request"}), 400)
+
+    updates = []
+    for entry in payload["statuses"]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("uri"), str):
+            return make_response(jsonify({"error": "invalid_request"}), 400)
+        updates.append((entry["uri"].rsplit("/", 1)[-1], entry.get("idx"), entry.get("status")))
+
+    error = status_list.set_statuses(updates)
+    if error:
+        return make_response(
+            jsonify({"error": "invalid_request", "error_description": error}), 400
+        )
+    return jsonify({"updated": len(updates)})
@@ -25,7 +25,6 @@ This route_dynamic.py file is the blueprint for the route /dynamic of the PID Is
 from datetime import datetime
 from datetime import date
 from datetime import timedelta
-import io
 import json
 import base64
 from formatter_func import cbor2elems
@@ -33,7 +32,6 @@ import threading
 import schedule
 import time
 from uuid import uuid4
-from PIL import Image
 from flask import Blueprint, Flask, make_response, redirect, render_template, request, session, jsonify
 from flask_api import status
 from flask_cors import CORS
@@ -41,6 +39,9 @@ import requests
 import urllib.parse
 from app.lighttoken import handle_response
 from app.validate_vp_token import validate_vp_token
+from app.image_pipeline import ImageBusy, read_upload, to_portrait_jpeg, validate_portrait
+from app.blob_store import blob_from_b64, blob_store, display_b64, store_blobs
+from app import credential_index, page_cache
 
 from boot_validate import (
     validate_mandatory_args,
@@ -58,7 +59,6 @@ from misc import (
     getAttributesForm2,
     scope2details,
     calculate_age,
-    validate_image,
     vct2doctype,
     vct2id,
     vct2scope,
@@ -77,7 +77,7 @@ app = Flask(__name__)
 #app.config["SECRET_KEY"] = flask_secret_key
 #app.config["dynamic"] = {}
 
-from app.data_management import form_dynamic_data
+from app.data_management import admit_form, form_dynamic_data
 
 
 @dynamic.route("/", methods=["GET", "POST"])
@@ -87,7 +87,7 @@ def Supported_Countries():
     """
 
     if "Cancelled" in request.form.keys():  # Form request Cancelled
-        return render_template(
+        return page_cache.render_page(
             "misc/auth_method.html", redirect_url=cfgserv.service_url
         )
 
@@ -120,16 +120,7 @@ def Supported_Countries():
 
     session["credentials_requested"] = credentials_requested
 
-    display_countries = {}
-    for country in cfgcountries.supported_countries:
-        res = all(
-            ele in cfgcountries.supported_countries[country]["supported_credentials"]
-            for ele in credentials_requested
-        )
-        if res:
-            display_countries.update(
-                {str(country): str(cfgcountries.supported_countries[country]["name"])}
-            )
+    display_countries = credential_index.get_index().display_countries(credentials_requested)
     
     if len(display_countries) == 1:
         country = next(iter(display_countries))
@@ -172,6 +163,7 @@ def Supported_Countries():
 
     session["jws_token"] = authorization_params["token"]
 
+    # per request authorization_details: not cached (page_cache)
     return render_template(
         "dynamic/dynamic-countries.html",
         countries=display_countries,
@@ -214,9 +206,16 @@ def dynamic_R1(country):
         )
 
     elif country == "sample":
+        if not admit_form():
+            return (
+                "Error 503: " + cfgserv.error_list["503"] + "\n",
+                503,
+                {"Retry-After": str(cfgserv.form_retry_after)},
+            )
+
         user_id = generate_unique_id()
 
-        form_dynamic_data[user_id] = cfgserv.sample_data.copy()
+        form_dynamic_data[user_id] = store_blobs(cfgserv.sample_data)
         form_dynamic_data[user_id].update({"expires":datetime.now() + timedelta(minutes=cfgserv.form_expiry)})
 
         if "jws_token" not in session or "authorization_params" in session:
@@ -543,7 +542,7 @@ def red():
             presentation_data[credential].update({"driving_privileges":json_priv})
         
         if "portrait" in presentation_data[credential]:
-            presentation_data[credential].update({"portrait":base64.b64encode(base64.urlsafe_b64decode(presentation_data[credential]["portrait"])).decode("utf-8")})
+            presentation_data[credential].update({"portrait":display_b64(presentation_data[credential]["portrait"])})
         
         if "NumberCategories" in presentation_data[credential]:
             for i in range(int(presentation_data[credential]["NumberCategories"])):
@@ -844,9 +843,14 @@ def credentialCreation(credential_request, data, country):
                     ).strftime("%Y-%m-%d")
 
                 if "portrait" in form_data:
-                    form_data["portrait"] = base64.urlsafe_b64encode(
-                        convert_png_to_jpeg(base64.b64decode(form_data["portrait"]))
-                    ).decode("utf-8")
+                    try:
+                        portrait = convert_png_to_jpeg(base64.b64decode(form_data["portrait"]))
+                    except (ValueError, ImageBusy) as e:
+                        return {
+                            "error": "invalid_credential_request",
+                            "error_description": str(e),
+                        }
+                    form_data["portrait"] = base64.urlsafe_b64encode(portrait).decode("utf-8")
 
                 form_data["nationality"] = ["PT"]
                 form_data["nationalities"] = ["PT"]
@@ -875,9 +879,14 @@ def credentialCreation(credential_request, data, country):
                     form_data["birth_date"], "%d-%m-%Y"
                 ).strftime("%Y-%m-%d")
 
-                form_data["portrait"] = base64.urlsafe_b64encode(
-                    convert_png_to_jpeg(base64.b64decode(form_data["Portrait"]))
-                ).decode("utf-8")
+                try:
+                    portrait = convert_png_to_jpeg(base64.b64decode(form_data["Portrait"]))
+                except (ValueError, ImageBusy) as e:
+                    return {
+                        "error": "invalid_credential_request",
+                        "error_description": str(e),
+                    }
+                form_data["portrait"] = base64.urlsafe_b64encode(portrait).decode("utf-8")
 
             else:
 
@@ -955,7 +964,14 @@ def Dynamic_form():
             )
 
     if "Cancelled" in request.form.keys():  # Form request Cancelled
-        return render_template('misc/auth_method.html')
+        return page_cache.render_page('misc/auth_method.html')
+
+    if not admit_form():
+        return (
+            "Error 503: " + cfgserv.error_list["503"] + "\n",
+            503,
+            {"Retry-After": str(cfgserv.form_retry_after)},
+        )
 
     # if submitted form is valid
     """  v = validate_params_getpid_or_mdl(
@@ -1027,29 +1043,29 @@ def Dynamic_form():
             
         elif item == "portrait":
             if grouped[item] == "Port1":
-                cleaned_data["portrait"] = cfgserv.portrait1
+                cleaned_data["portrait"] = blob_from_b64(cfgserv.portrait1)
             elif grouped[item] == "Port2":
-                cleaned_data["portrait"] = cfgserv.portrait2
+                cleaned_data["portrait"] = blob_from_b64(cfgserv.portrait2)
             elif grouped[item] == "Port3":
-                portrait= request.files["Image"]
+                portrait, error_msg = read_upload(request.files["Image"])
 
-                img = Image.open(portrait)
-                #imgbytes = img.tobytes()
-                bio = io.BytesIO()
-                img.save(bio, format="JPEG")
-                del img
+                if portrait is not None:
+                    response, error_msg = validate_portrait(portrait)
 
-                response,error_msg = validate_image(portrait)
+                if portrait is not None and response:
+                    try:
+                        portrait = to_portrait_jpeg(portrait)
+                    except (ValueError, ImageBusy) as e:
+                        portrait, error_msg = None, str(e)
 
-                if response==False:
+                if portrait is None or response==False:
                     return authentication_error_redirect(
                         jws_token=session["jws_token"],
                         error="Invalid Image",
                         error_description=error_msg,
                     )
                 else :
-                    imgurlbase64=base64.urlsafe_b64encode(bio.getvalue()).decode('utf-8')
-                    cleaned_data["portrait"]=imgurlbase64
+                    cleaned_data["portrait"] = blob_store.put(portrait)
 
         elif item == "Category1":
             DrivingPrivileges = []
@@ -1086,7 +1102,7 @@ def Dynamic_form():
 
     print("\nCleaned Data: ", cleaned_data)
 
-    form_dynamic_data[user_id] = cleaned_data.copy()
+    form_dynamic_data[user_id] = store_blobs(cleaned_data)
     form_dynamic_data[user_id].update({"expires":datetime.now() + timedelta(minutes=cfgserv.form_expiry)})
 
     if "jws_token" not in session or "authorization_params" in session:
@@ -1149,7 +1165,7 @@ def Dynamic_form():
             presentation_data[credential].update({"driving_privileges":json_priv})
         
         if "portrait" in presentation_data[credential]:
-            presentation_data[credential].update({"portrait":base64.b64encode(base64.urlsafe_b64decode(presentation_data[credential]["portrait"])).decode("utf-8")})
+            presentation_data[credential].update({"portrait":display_b64(presentation_data[credential]["portrait"])})
         
         if "NumberCategories" in presentation_data[credential]:
             for i in range(int(presentation_data[credential]["NumberCategories"])):
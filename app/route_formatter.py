@@ -41,6 +41,7 @@ from flask import (
 from validate import validate_mandatory_args, validate_date_format
 from app_config.config_service import ConfService as cfgservice
 from formatter_func import mdocFormatter, sdjwtFormatter
+from app.signing_pool import SigningBusy
 
 from app_config.config_countries import ConfCountries as cfcountries
 
@@ -171,12 +172,21 @@ def cborformatter():
             }
         )
 
-    base64_mdoc = mdocFormatter(
-        request.json["data"],
-        request.json["credential_metadata"],
-        request.json["country"],
-        request.json["device_publickey"],
-    )
+    try:
+        base64_mdoc = mdocFormatter(
+            request.json["data"],
+            request.json["credential_metadata"],
+            request.json["country"],
+            request.json["device_publickey"],
+        )
+    except SigningBusy:
+        return jsonify(
+            {
+                "error_code": 503,
+                "error_message": cfgservice.error_list["503"],
+                "mdoc": "",
+            }
+        ), 503
 
     import requests
 
@@ -313,7 +323,16 @@ def sd_jwtformatter():
 
     # return error_message
 
-    sd_jwt = sdjwtFormatter(PID, request.json["country"])
+    try:
+        sd_jwt = sdjwtFormatter(PID, request.json["country"])
+    except SigningBusy:
+        return jsonify(
+            {
+                "error_code": 503,
+                "error_message": cfgservice.error_list["503"],
+                "sd-jwt": "",
+            }
+        ), 503
 
     return jsonify(
         {"error_code": 0, "error_message": cfgservice.error_list["0"], "sd-jwt": sd_jwt}
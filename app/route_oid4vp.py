@@ -23,18 +23,17 @@ It has support for both same device and cross device oid4vp
 
 import base64
 from datetime import date, timedelta, datetime
-import io
 import json
 from urllib.parse import urlparse
 from uuid import uuid4
 from flask import Blueprint, Flask, jsonify, render_template, request, session
 from flask_cors import CORS
-import requests
-import segno
+from app.qr_code import qr_image_url
 from misc import generate_unique_id, authentication_error_redirect, getAttributesForm, getAttributesForm2, scope2details
 from formatter_func import cbor2elems
 
 from app.validate_vp_token import validate_vp_token
+from app import verifier_client
 from .app_config.config_service import ConfService as cfgservice
 
 oid4vp = Blueprint("oid4vp", __name__, url_prefix="/")
@@ -42,6 +41,7 @@ CORS(oid4vp)  # enable CORS on the blue print
 
 # secrets
 from app.data_management import oid4vp_requests, form_dynamic_data
+from app.blob_store import store_blobs
 
 
 
@@ -70,77 +70,20 @@ def openid4vp():
 
     session["oid4vp_cred_requested"] = credentials_requested 
 
-    input_descriptors = []
-
-    for id in credentials_requested:
-        for doctype in cfgservice.dynamic_issuing[id]:
-            fields = []
-            input_descriptors.append(
-                {
-                    "id": doctype,
-                    "format": {
-                    "mso_mdoc": {
-                        "alg": [
-                        "ES256",
-                        "ES384",
-                        "ES512",
-                        "EdDSA"
-                        ]
-                    }
-                    },
-                    "name": "EUDI PID",
-                    "purpose": "We need to verify your identity",
-                    "constraints": {
-                    "fields": fields
-                    }
-                }
-            )
-            for namespace in cfgservice.dynamic_issuing[id][doctype]:
-                for attribute in cfgservice.dynamic_issuing[id][doctype][namespace]:
-                    fields.append(
-                        {
-                        "path": [
-                            "$['" + namespace + "']['"+ attribute +"']"
-                        ],
-                        "intent_to_retain": False
-                        }
-                    )
-
-    url = cfgservice.dynamic_presentation_url
-    payload_cross_device = json.dumps(
-        {
-            "type": "vp_token",
-            "nonce": "hiCV7lZi5qAeCy7NFzUWSR4iCfSmRb99HfIvCkPaCLc=",
-            "presentation_definition": {
-                "id": "32f54163-7166-48f1-93d8-ff217bdb0653",
-                "input_descriptors": input_descriptors
-            }
-        }
-    )
-
-    payload_same_device = json.dumps(
-        {
-            "type": "vp_token",
-            "nonce": "hiCV7lZi5qAeCy7NFzUWSR4iCfSmRb99HfIvCkPaCLc=",
-            "presentation_definition": {
-                "id": "32f54163-7166-48f1-93d8-ff217bdb0653",
-                "input_descriptors": input_descriptors
-            },
-            "wallet_response_redirect_uri_template":cfgservice.service_url + "getpidoid4vp?response_code={RESPONSE_CODE}&session_id=" + session["session_id"]
-        }
+    # same device and cross device transactions are created concurrently
+    future_same = verifier_client.create_transaction(
+        credentials_requested,
+        cfgservice.service_url + "getpidoid4vp?response_code={RESPONSE_CODE}&session_id=" + session["session_id"],
     )
+    future_cross = None
+    if not cfgservice.oid4vp_lazy_cross_device:
+        future_cross = verifier_client.create_transaction(credentials_requested)
 
-    headers = {
-        "Content-Type": "application/json",
-    }
-
-    response_cross = requests.request("POST", url[:-1], headers=headers, data=payload_cross_device).json()
-
-    response_same = requests.request("POST", url[:-1], headers=headers, data=payload_same_device).json()
+    response_same = future_same.result()
     
     oid4vp_requests.update({session["session_id"]:{"response": response_same, "expires":datetime.now() + timedelta(minutes=cfgservice.deffered_expiry)}})
 
-    domain = urlparse(url).netloc
+    domain = urlparse(cfgservice.dynamic_presentation_url).netloc
 
     deeplink_url = (
         "eudi-openid4vp://" + domain + "?client_id="
@@ -149,6 +92,24 @@ def openid4vp():
         + response_same["request_uri"]
     )
 
+    qr_img_url = None
+    presentation_id = None
+    if future_cross is not None:
+        qr_img_url, presentation_id = _cross_device_qr(future_cross.result())
+
+    return render_template(
+        "openid/pid_login_qr_code.html",
+        url_data=deeplink_url,
+        qrcode=qr_img_url,
+        presentation_id=presentation_id,
+        redirect_url= cfgservice.service_url
+    )
+
+
+def _cross_device_qr(response_cross):
+    """QR code image URL and presentation id of a cross device transaction"""
+    domain = urlparse(cfgservice.dynamic_presentation_url).netloc
+
     qr_code_url = (
         "eudi-openid4vp://" + domain + "?client_id="
         + response_cross["client_id"]
@@ -157,33 +118,21 @@ def openid4vp():
     )
 
     # Generate QR code
-    # img = qrcode.make("uri")
-    # QRCode.print_ascii()
-
-    qrcode = segno.make(qr_code_url)
-    out = io.BytesIO()
-    qrcode.save(out, kind='png', scale=3)
-
-    """ qrcode.to_artistic(
-        background=cfgtest.qr_png,
-        target=out,
-        kind="png",
-        scale=4,
-    ) """
-    # qrcode.terminal()
-    # qr_img_base64 = qrcode.png_data_uri(scale=4)
-
-    qr_img_base64 = "data:image/png;base64," + base64.b64encode(out.getvalue()).decode(
-        "utf-8"
-    )
+    return qr_image_url(qr_code_url, scale=3), response_cross["transaction_id"]
 
-    return render_template(
-        "openid/pid_login_qr_code.html",
-        url_data=deeplink_url,
-        qrcode=qr_img_base64,
-        presentation_id=response_cross["transaction_id"],
-        redirect_url= cfgservice.service_url
+
+@oid4vp.route("/oid4vp/cross_device", methods=["GET"])
+def openid4vp_cross_device():
+    """Cross device transaction of the login page, created when the QR code is shown
+    (cfgservice.oid4vp_lazy_cross_device)"""
+
+    if "oid4vp_cred_requested" not in session:
+        return jsonify({"error": "invalid_request"}), 400
+
+    qr_img_url, presentation_id = _cross_device_qr(
+        verifier_client.create_transaction(session["oid4vp_cred_requested"]).result()
     )
+    return jsonify({"qrcode": qr_img_url, "presentation_id": presentation_id})
 
 
 @oid4vp.route("/getpidoid4vp", methods=["GET"])
@@ -194,28 +143,13 @@ def getpidoid4vp():
 
         response_code = request.args.get("response_code")
         presentation_id = oid4vp_requests[request.args.get("session_id")]["response"]["transaction_id"]
-        url = (
-            cfgservice.dynamic_presentation_url
-            + presentation_id
-            + "?nonce=hiCV7lZi5qAeCy7NFzUWSR4iCfSmRb99HfIvCkPaCLc="
-            + "&response_code=" + response_code
-        )
 
     elif "presentation_id" in request.args:
         cfgservice.app_logger.info(", Session ID: " + session["session_id"] + ", " + "oid4vp flow: cross_device")
         presentation_id = request.args.get("presentation_id")
+        response_code = None
 
-        url = (
-            cfgservice.dynamic_presentation_url
-            + presentation_id
-            + "?nonce=hiCV7lZi5qAeCy7NFzUWSR4iCfSmRb99HfIvCkPaCLc="
-        )
-
-    headers = {
-        "Content-Type": "application/json",
-    }
-
-    response = requests.request("GET", url, headers=headers)
+    response = verifier_client.get_presentation(presentation_id, response_code)
     if response.status_code != 200:
         error_msg = str(response.status_code)
         return jsonify({"error": error_msg}), 400
@@ -283,7 +217,7 @@ def getpidoid4vp():
             attributesForm.update({"credential_type":doctype_config["credential_type"] })
 
         user_id = generate_unique_id()
-        form_dynamic_data[user_id] = attributesForm.copy()
+        form_dynamic_data[user_id] = store_blobs(attributesForm)
 
         form_dynamic_data[user_id].update({"expires":datetime.now() + timedelta(minutes=cfgservice.form_expiry)})
         
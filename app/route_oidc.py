@@ -24,7 +24,6 @@ This route_oidc.py file is the blueprint for the route /oidc of the PID Issuer W
 """
 import base64
 import hashlib
-import io
 import random
 import re
 import sys
@@ -32,7 +31,7 @@ import time
 import uuid
 import threading
 import urllib.parse
-import segno
+from app.qr_code import qr_image_url
 
 from flask import (
     Blueprint,
@@ -63,7 +62,16 @@ import werkzeug
 
 from idpyoidc.server.exception import FailedAuthentication, ClientAuthenticationError
 from idpyoidc.server.oidc.token import Token
-from app.misc import auth_error_redirect, authentication_error_redirect, scope2details, vct2id
+from app.misc import auth_error_redirect, authentication_error_redirect, get_proof_jwts, jwt_claims, scope2details, vct2id
+from app.nonce_service import NONCE_ALGORITHMS, new_nonce, verify_nonce
+from app.replay_index import proof_key, release_proofs, reserve_proofs
+from app import deferred_worker
+from app import notification_pipeline
+from app import credential_index
+from app import page_cache
+from app import presentation_poller
+from app.rate_limit import rate_limited
+from app import response_encryption
 
 from datetime import datetime, timedelta
 
@@ -83,12 +91,11 @@ from app.data_management import (
     getSessionId_accessToken,
     parRequests,
     transaction_codes,
-    deferredRequests,
     session_ids,
     getSessionId_requestUri,
     getSessionId_authCode,
-    credential_offer_references
 )
+from app.offer_store import OFFER_EXPIRED, get_offer, offer_uri
 
 
 def _add_cookie(resp: Response, cookie_spec: Union[dict, list]):
@@ -525,35 +532,71 @@ def authorizationV3():
 
 @oidc.route("/pid_authorization")
 def pid_authorization_get():
+    """Wallet response of a cross device presentation (long-poll)
+
+    Query parameters:
+    + presentation_id -- transaction_id of the presentation
+    + wait -- maximum wait (seconds, at most cfgservice.presentation_sse_heartbeat) for the
+      wallet response, 0 (default) returns the current state
+    """
 
     presentation_id = request.args.get("presentation_id")
+    if not presentation_id:
+        return jsonify({"error": "invalid_request"}), 400
 
-    url = (
-        cfgservice.dynamic_presentation_url
-        + presentation_id
-        + "?nonce=hiCV7lZi5qAeCy7NFzUWSR4iCfSmRb99HfIvCkPaCLc="
-    )
-    headers = {
-        "Content-Type": "application/json",
-    }
+    timeout = min(max(request.args.get("wait", 0, type=float), 0), cfgservice.presentation_sse_heartbeat)
 
-    response = requests.request("GET", url, headers=headers)
-    if response.status_code != 200:
-        error_msg = str(response.status_code)
-        return jsonify({"error": error_msg}), 500
+    try:
+        state = presentation_poller.wait(presentation_id, timeout)
+    except presentation_poller.PollerBusy:
+        return jsonify({"error": "server_error", "error_description": cfgservice.error_list["503"]}), 503
+
+    if state != presentation_poller.READY:
+        return jsonify({"error": state}), 500
     else:
         data = {"message": "Sucess"}
         return jsonify({"message": data}), 200
 
 
+@oidc.route("/pid_authorization/events")
+def pid_authorization_events():
+    """Wallet response of a cross device presentation (server-sent events)
+
+    Sends a "ready" or "expired" event when the presentation is complete or expired, and a
+    comment every cfgservice.presentation_sse_heartbeat seconds until then.
+    """
+
+    presentation_id = request.args.get("presentation_id")
+    if not presentation_id:
+        return jsonify({"error": "invalid_request"}), 400
+
+    try:
+        state = presentation_poller.wait(presentation_id, 0)
+    except presentation_poller.PollerBusy:
+        return jsonify({"error": "server_error", "error_description": cfgservice.error_list["503"]}), 503
+
+    def events(state):
+        yield "retry: 5000\n\n"
+        while state == presentation_poller.PENDING:
+            yield ": waiting\n\n"
+            try:
+                state = presentation_poller.wait(
+                    presentation_id, cfgservice.presentation_sse_heartbeat
+                )
+            except presentation_poller.PollerBusy:
+                state = presentation_poller.EXPIRED
+        yield "event: " + state + "\ndata: {}\n\n"
+
+    response = Response(events(state), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @oidc.route("/auth_choice", methods=["GET"])
 def auth_choice():
     token = request.args.get("token")
 
-    supported_credencials = cfgservice.auth_method_supported_credencials
-    pid_auth = True
-    country_selection = True
-
     if "authorization_params" not in session:
         cfgservice.app_logger.info(
             "Authorization Params didn't exist in Authentication Choice"
@@ -584,22 +627,7 @@ def auth_choice():
             if cred_id not in credentials_requested:
                 credentials_requested.append(cred_id)
 
-    for cred in credentials_requested:
-        if (
-            cred in supported_credencials["PID_login"]
-            and cred not in supported_credencials["country_selection"]
-        ):
-            country_selection = False
-
-        elif (
-            cred not in supported_credencials["PID_login"]
-            and cred in supported_credencials["country_selection"]
-        ):
-            pid_auth = False
-        
-        elif cred not in supported_credencials["PID_login"] and cred not in supported_credencials["country_selection"]:
-            country_selection = False
-            pid_auth = False
+    pid_auth, country_selection = credential_index.get_index().auth_choice(credentials_requested)
 
     if country_selection == False and pid_auth == True:
         return redirect(cfgservice.service_url + "oid4vp")
@@ -611,7 +639,7 @@ def auth_choice():
     if pid_auth == False and country_selection == False:
         error = "Combination of requested credentials is not valid!"
 
-    return render_template(
+    return page_cache.render_page(
         "misc/auth_method.html",
         pid_auth=pid_auth,
         country_selection=country_selection,
@@ -633,6 +661,7 @@ def token_service():
 
 
 @oidc.route("/token", methods=["POST"])
+@rate_limited("token")
 def token():
 
     req_args = dict([(k, v) for k, v in request.form.items()])
@@ -784,6 +813,7 @@ def par_endpoint():
 
 
 @oidc.route("/pushed_authorizationv2", methods=["POST"])
+@rate_limited("pushed_authorization")
 def par_endpointv2():
 
     session_id = str(uuid.uuid4())
@@ -839,6 +869,7 @@ def par_endpointv2():
 
 
 @oidc.route("/credential", methods=["POST"])
+@rate_limited("credential")
 def credential():
 
     headers = dict(request.headers)
@@ -875,34 +906,6 @@ def credential():
         )
         return _response
 
-    """ if (
-        "transaction_id" in _response
-        and _response["transaction_id"] not in deferredRequests
-    ):
-
-        request_data = request.data
-        request_headers = dict(request.headers)
-        deferredRequests.update(
-            {
-                _response["transaction_id"]: {
-                    "data": request_data,
-                    "headers": request_headers,
-                    "expires": datetime.now()
-                    + timedelta(minutes=cfgservice.deffered_expiry),
-                }
-            }
-        )
-
-        cfgservice.app_logger.info(
-            ", Session ID: "
-            + session_id
-            + ", "
-            + "Credential response, Payload: "
-            + str(_response)
-        )
-
-        return make_response(jsonify(_response), 202) """
-
     cfgservice.app_logger.info(
         ", Session ID: "
         + session_id
@@ -925,35 +928,68 @@ def notification():
     access_token = headers["Authorization"][7:]
     session_id = getSessionId_accessToken(access_token)
 
-    cfgservice.app_logger.info(
-        ", Session ID: "
-        + session_id
-        + ", "
-        + "Notification Request, Payload: "
-        + str(payload)
-    )
-
-    _resp = service_endpoint(current_app.server.get_endpoint("notification"))
+    if not cfgservice.notification_async:
+        _resp = service_endpoint(current_app.server.get_endpoint("notification"))
 
-    if isinstance(_resp, Response):
         cfgservice.app_logger.info(
             ", Session ID: "
-            + session_id
+            + str(session_id)
             + ", "
-            + "Notification response, Payload: "
+            + "Notification Request, Payload: "
+            + str(payload)
+            + ", Response: "
             + str(_resp)
         )
+
+        return _resp
+
+    if session_id is None:
+        return make_response(
+            jsonify({"error": "invalid_token", "error_description": "Unknown access token"}),
+            401,
+        )
+
+    error = notification_pipeline.validate_notification(payload)
+    if error:
+        return make_response(
+            jsonify({"error": "invalid_notification_request", "error_description": error}),
+            400,
+        )
+
+    # notification_id issued to this access token (openid4v Notification validation), only
+    # the event storage is asynchronous
+    try:
+        _resp = current_app.server.get_endpoint("notification").process_request(
+            dict(payload, access_token=access_token, oidc_config=cfgoidc)
+        )
+    except Exception as err:
+        cfgservice.app_logger.error(err)
+        return make_response(
+            jsonify({"error": "invalid_notification_request", "error_description": str(err)}),
+            400,
+        )
+
+    if isinstance(_resp, ResponseMessage) and "error" in _resp:
+        cfgservice.app_logger.error("Error response: {}".format(_resp))
+        return make_response(_resp.to_json(), 400)
+
+    if not notification_pipeline.submit_notification(payload, session_id):
+        _resp = make_response(
+            jsonify({"error": "server_error", "error_description": "Notification queue is full"}),
+            503,
+        )
+        _resp.headers["Retry-After"] = str(cfgservice.notification_flush_interval)
         return _resp
 
     cfgservice.app_logger.info(
         ", Session ID: "
         + session_id
         + ", "
-        + "Notification response, Payload: "
-        + str(_resp)
+        + "Notification Request, Payload: "
+        + str(payload)
     )
 
-    return _resp
+    return make_response("", 204)
 
 @oidc.route("/nonce", methods=["POST"])
 def nonce():
@@ -994,6 +1030,55 @@ def deferred_credential():
         + str(payload)
     )
 
+    if cfgservice.deferred_worker:
+        job = deferred_worker.get_job(payload.get("transaction_id", ""))
+
+        if job is not None:
+            if (
+                not deferred_worker.token_matches(job, access_token)
+                or job["status"] == deferred_worker.EXPIRED
+            ):
+                return (
+                    jsonify({"error": "invalid_transaction_id"}),
+                    400,
+                    {"Content-Type": "application/json", "Cache-Control": "no-store"},
+                )
+
+            if job["status"] != deferred_worker.DONE:
+                # built by this process if the one that queued it is gone
+                deferred_worker.resume(job["transaction_id"], access_token)
+                return (
+                    jsonify(
+                        {
+                            "error": "issuance_pending",
+                            "interval": cfgservice.deferred_poll_interval,
+                        }
+                    ),
+                    400,
+                    {"Content-Type": "application/json", "Cache-Control": "no-store"},
+                )
+
+            cfgservice.app_logger.info(
+                ", Session ID: "
+                + session_id
+                + ", "
+                + "Deferred response (transaction "
+                + job["transaction_id"]
+                + ")"
+            )
+            encrypter = prepare_response_encryption(payload)
+            if isinstance(encrypter, tuple):
+                return encrypter
+
+            return encrypt_response(
+                make_response(
+                    job["response"],
+                    job["status_code"],
+                    {"Content-Type": job["content_type"], "Cache-Control": "no-store"},
+                ),
+                encrypter,
+            )
+
     current_app.server.get_endpoint("credential").process_deferred()
 
     _resp = service_endpoint(current_app.server.get_endpoint("deferred_credential"))
@@ -1030,41 +1115,40 @@ def credential_offer():
 
     Loads credentials supported by EUDIW Issuer
     """
+    return page_cache.render_page(
+        "openid/credential_offer.html",
+        build=_offer_credentials,
+        redirect_url=cfgservice.service_url,
+        credential_offer_URI="openid-credential-offer://",
+        credential_offer_mode=cfgservice.credential_offer_mode,
+    )
+
+
+def _offer_credentials():
+    """Credentials of the credential offer page, grouped by format"""
     credentialsSupported = oidc_metadata["credential_configurations_supported"]
+    offered = credential_index.get_index().offered
 
     credentials = {"sd-jwt vc format": {}, "mdoc format": {}}
 
     for cred in credentialsSupported:
+        if cred not in offered:
+            continue
         credential = credentialsSupported[cred]
 
         if credential["format"] == "dc+sd-jwt":
             # if credential["scope"] == "eu.europa.ec.eudiw.pid.1":
-            if (
-                cred in cfgservice.auth_method_supported_credencials["PID_login"]
-                or cred
-                in cfgservice.auth_method_supported_credencials["country_selection"]
-            ):
-                credentials["sd-jwt vc format"].update(
-                    # {"Personal Identification Data": cred}
-                    {cred: credential["display"][0]["name"]}
-                )
+            credentials["sd-jwt vc format"].update(
+                # {"Personal Identification Data": cred}
+                {cred: credential["display"][0]["name"]}
+            )
 
         if credential["format"] == "mso_mdoc":
-            if (
-                cred in cfgservice.auth_method_supported_credencials["PID_login"]
-                or cred
-                in cfgservice.auth_method_supported_credencials["country_selection"]
-            ):
-                credentials["mdoc format"].update(
-                    {cred: credential["display"][0]["name"]}
-                )
+            credentials["mdoc format"].update(
+                {cred: credential["display"][0]["name"]}
+            )
 
-    return render_template(
-        "openid/credential_offer.html",
-        cred=credentials,
-        redirect_url=cfgservice.service_url,
-        credential_offer_URI="openid-credential-offer://",
-    )
+    return {"cred": credentials}
 
 
 """ @oidc.route("/test_dump", methods=["GET", "POST"])
@@ -1099,12 +1183,15 @@ def credentialOffer():
     auth_choice = request.form.get("Authorization Code Grant")
     form_keys = request.form.keys()
     credential_offer_URI = request.form.get("credential_offer_URI")
+    offer_mode = request.form.get("credential_offer_mode", cfgservice.credential_offer_mode)
 
     if "proceed" in form_keys:
         form = list(form_keys)
         form.remove("proceed")
         form.remove("credential_offer_URI")
         form.remove("Authorization Code Grant")
+        if "credential_offer_mode" in form:
+            form.remove("credential_offer_mode")
         all_exist = all(credential in credentialsSupported for credential in form)
 
         if all_exist:
@@ -1113,6 +1200,7 @@ def credentialOffer():
             credentials_id_list = json.dumps(form)
             if auth_choice == "pre_auth_code":
                 session["credential_offer_URI"] = credential_offer_URI
+                session["credential_offer_mode"] = offer_mode
                 return redirect(
                     url_for("preauth.preauthRed", credentials_id=credentials_id_list)
                 )
@@ -1125,37 +1213,11 @@ def credentialOffer():
                     "grants": {"authorization_code": {}},
                 }
 
-                reference_id = str(uuid.uuid4())
-                credential_offer_references.update({reference_id:{"credential_offer":credential_offer, "expires":datetime.now() + timedelta(minutes=cfgservice.form_expiry)}})
-
                 # create URI
-                json_string = json.dumps(credential_offer)
-
-                uri = (
-                    f"{credential_offer_URI}credential_offer?credential_offer="
-                    + urllib.parse.quote(json_string, safe=":/")
-                )
+                uri = offer_uri(credential_offer, credential_offer_URI, offer_mode)
 
                 # Generate QR code
-                # img = qrcode.make("uri")
-                # QRCode.print_ascii()
-
-                qrcode = segno.make(uri)
-                out = io.BytesIO()
-                qrcode.save(out, kind="png", scale=3)
-
-                """ qrcode.to_artistic(
-                    background=cfgtest.qr_png,
-                    target=out,
-                    kind="png",
-                    scale=4,
-                ) """
-                # qrcode.terminal()
-                # qr_img_base64 = qrcode.png_data_uri(scale=4)
-
-                qr_img_base64 = "data:image/png;base64," + base64.b64encode(
-                    out.getvalue()
-                ).decode("utf-8")
+                qr_img_url = qr_image_url(uri, scale=3)
 
                 wallet_url = cfgservice.wallet_test_url + "credential_offer"
 
@@ -1165,7 +1227,7 @@ def credentialOffer():
                     + "?credential_offer="
                     + json.dumps(credential_offer),
                     url_data=uri,
-                    qrcode=qr_img_base64,
+                    qrcode=qr_img_url,
                 )
 
     else:
@@ -1173,7 +1235,24 @@ def credentialOffer():
 
 @oidc.route("/credential-offer-reference/<string:reference_id>", methods=["GET"])
 def offer_reference(reference_id):
-    return credential_offer_references[reference_id]["credential_offer"]
+    credential_offer, remaining = get_offer(reference_id)
+
+    if credential_offer is None:
+        return (
+            jsonify({"error": "not_found", "error_description": "Unknown credential offer"}),
+            404,
+        )
+
+    if credential_offer == OFFER_EXPIRED:
+        return (
+            jsonify({"error": "expired", "error_description": "Credential offer expired"}),
+            410,
+        )
+
+    response = make_response(jsonify(credential_offer))
+    response.headers["Cache-Control"] = f"private, max-age={remaining}"
+    response.set_etag(reference_id)
+    return response.make_conditional(request)
 
 """ @oidc.route("/testgetauth", methods=["GET"])
 def testget():
@@ -1189,6 +1268,40 @@ def testget():
 IGNORE = ["cookie", "user-agent"]
 
 
+def prepare_response_encryption(req_args):
+    """Start the credential response encryption (app/response_encryption.py)
+
+    The credential_response_encryption parameters are removed from the request so that the
+    response is built unencrypted by openid4v.
+
+    Keyword arguments:
+    + req_args -- credential or deferred credential request
+
+    Return: Future of the encrypter, None (no encryption) or an error response
+    """
+    if not cfgservice.response_encryption or "credential_response_encryption" not in req_args:
+        return None
+
+    try:
+        return response_encryption.prepare(req_args.pop("credential_response_encryption"))
+    except response_encryption.EncryptionError as e:
+        return (
+            jsonify({"error": "invalid_encryption_parameters", "error_description": str(e)}),
+            400,
+            {"Content-Type": "application/json", "Cache-Control": "no-store"},
+        )
+
+
+def encrypt_response(response, encrypter):
+    """Encrypt the body of a successful credential response (application/jwt)"""
+    if encrypter is None or response.status_code >= 300:
+        return response
+
+    response.set_data(response_encryption.encrypt(encrypter, response.get_data()))
+    response.headers["Content-Type"] = "application/jwt"
+    return response
+
+
 def service_endpoint(endpoint):
     # _log = current_app.logger
     cfgservice.app_logger.info('At the "{}" endpoint'.format(endpoint.name))
@@ -1211,26 +1324,85 @@ def service_endpoint(endpoint):
             req_args["access_token"] = accessToken
             req_args["oidc_config"] = cfgoidc
             req_args["aud"] = cfgservice.service_url[:-1]
-            args = endpoint.process_request(req_args)
 
-            if "response_args" in args:
-                if "error" in args["response_args"]:
-                    return (
-                        jsonify(args["response_args"]),
-                        400,
-                        {"Content-Type": "application/json"},
-                    )
-                response = args["response_args"]
+            if cfgservice.nonce_algorithm in NONCE_ALGORITHMS:
+                for proof_jwt in get_proof_jwts(req_args):
+                    if not verify_nonce(jwt_claims(proof_jwt).get("nonce", "")):
+                        return (
+                            jsonify(
+                                {
+                                    "error": "invalid_nonce",
+                                    "error_description": "Invalid or expired c_nonce",
+                                }
+                            ),
+                            400,
+                            {"Content-Type": "application/json", "Cache-Control": "no-store"},
+                        )
+
+            # all the proofs are reserved before the credential is built, so that a replayed
+            # proof is refused before anything is signed; they are released if the request
+            # fails, so that an invalid request does not use up its proofs
+            proof_keys = [proof_key(proof_jwt) for proof_jwt in get_proof_jwts(req_args)]
+            if not reserve_proofs(proof_keys):
+                cfgservice.app_logger.warning("Replayed proof rejected")
+                return (
+                    jsonify(
+                        {
+                            "error": "invalid_proof",
+                            "error_description": "Proof already used",
+                        }
+                    ),
+                    400,
+                    {"Content-Type": "application/json", "Cache-Control": "no-store"},
+                )
+
+            encrypter = prepare_response_encryption(req_args)
+            if isinstance(encrypter, tuple):
+                release_proofs(proof_keys)
+                return encrypter
+
+            try:
+                args = endpoint.process_request(req_args)
+            except Exception:
+                release_proofs(proof_keys)
+                raise
+
+            if isinstance(args, ResponseMessage) and "error" in args:
+                release_proofs(proof_keys)
+                cfgservice.app_logger.error("Error response: {}".format(args))
+                return make_response(args.to_json(), 400)
+
+            if "response_args" in args and "error" in args["response_args"]:
+                release_proofs(proof_keys)
+                return (
+                    jsonify(args["response_args"]),
+                    400,
+                    {"Content-Type": "application/json"},
+                )
+
             if "encrypted_response" in args:
                 response = make_response(args["encrypted_response"])
                 response.headers["Content-Type"] = "application/jwt"
                 return response
-            else:
-                if isinstance(args, ResponseMessage) and "error" in args:
-                    cfgservice.app_logger.error("Error response: {}".format(args))
-                    response = make_response(args.to_json(), 400)
-                else:
-                    response = do_response(endpoint, args, **args)
+
+            response = encrypt_response(do_response(endpoint, args, **args), encrypter)
+
+            response_args = args.get("response_args", {})
+            if cfgservice.notification_async and "notification_id" in response_args:
+                notification_pipeline.register_notification_id(
+                    response_args["notification_id"],
+                    req_args.get("credential_configuration_id")
+                    or req_args.get("credential_identifier")
+                    or req_args.get("vct")
+                    or req_args.get("doctype")
+                    or notification_pipeline.UNKNOWN_CREDENTIAL,
+                )
+
+            if cfgservice.deferred_worker and "transaction_id" in response_args:
+                # the deferred credential is built by deferred_worker
+                deferred_worker.enqueue(response_args["transaction_id"], accessToken)
+                response.status_code = 202
+
             return response
         except Exception as err:
             message = traceback.format_exception(*sys.exc_info())
@@ -1262,6 +1434,13 @@ def service_endpoint(endpoint):
         return _resp
     
     if endpoint.name == "nonce":
+        if cfgservice.nonce_algorithm in NONCE_ALGORITHMS:
+            return (
+                jsonify({"c_nonce": new_nonce()}),
+                200,
+                {"Cache-Control": "no-store"},
+            )
+
         try:
             req_args = {}
             req_args["key_path"] = cfgservice.nonce_key
@@ -1289,6 +1468,11 @@ def service_endpoint(endpoint):
             req_args = request.json
             req_args["access_token"] = accessToken
             req_args["oidc_config"] = cfgoidc
+
+            encrypter = prepare_response_encryption(req_args)
+            if isinstance(encrypter, tuple):
+                return encrypter
+
             args = endpoint.process_request(req_args)
             if "response_args" in args:
                 if "error" in args["response_args"]:
@@ -1309,7 +1493,9 @@ def service_endpoint(endpoint):
                     cfgservice.app_logger.error("Error response: {}".format(args))
                     response = make_response(args.to_json(), 400)
                 else:
-                    response = do_response(endpoint, args, **args)
+                    response = encrypt_response(
+                        do_response(endpoint, args, **args), encrypter
+                    )
             return response
 
         except Exception as err:
@@ -0,0 +1,187 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This sdjwt_engine.py contains the SD-JWT issuance engine.
+
+An SDJWTEngine is built once per document signer (see ds_keys.py): the JWS protected header
+(alg, typ, x5c) is encoded once. Claims marked with SDObj (see formatter_func.sdjwtNestedClaims)
+become disclosures, with salts taken from one os.urandom call per issuance. The engine holds no per-call state and can be shared between threads.
+"""
+
+import base64
+import hashlib
+import json
+import os
+
+from cryptography.hazmat.primitives import serialization
+from sd_jwt.common import SDObj
+
+from .app_config.config_countries import ConfCountries as cfgcountries
+from .signers import load_signer
+
+SD_JWT_TYP = "dc+sd-jwt"
+
+SALT_SIZE = 16
+
+# curve name -> (JWK crv, JWS alg, coordinate size)
+CURVES = {
+    "secp256r1": ("P-256", "ES256", 32),
+    "secp384r1": ("P-384", "ES384", 48),
+    "secp521r1": ("P-521", "ES512", 66),
+}
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def holder_jwk(device_publickey):
+    """JWK (cnf claim) of the holder device key
+
+    Keyword arguments:
+    + device_publickey -- urlsafe base64 encoded PEM public key (EC)
+
+    Return: dict
+    """
+    public_key = serialization.load_pem_public_key(
+        base64.urlsafe_b64decode(device_publickey.encode("utf-8"))
+    )
+    crv, _, size = CURVES[public_key.curve.name]
+    numbers = public_key.public_numbers()
+    return {
+        "kty": "EC",
+        "crv": crv,
+        "x": _b64(numbers.x.to_bytes(size, "big")),
+        "y": _b64(numbers.y.to_bytes(size, "big")),
+    }
+
+
+def _count_disclosures(claims):
+    if isinstance(claims, dict):
+        return sum(
+            isinstance(key, SDObj) + _count_disclosures(value)
+            for key, value in claims.items()
+        )
+    if isinstance(claims, list):
+        return sum(
+            _count_disclosures(element.value) + 1
+            if isinstance(element, SDObj)
+            else _count_disclosures(element)
+            for element in claims
+        )
+    return 0
+
+
+class SDJWTEngine:
+    """SD-JWT issuer bound to one document signer."""
+
+    def __init__(self, signer):
+        """
+        Keyword arguments:
+        + signer -- document signer (signers.Signer), its certificate is the x5c header
+        """
+        _, self.alg, _ = CURVES[signer.curve]
+        self._signer = signer
+
+        header = {
+            "alg": self.alg,
+            "typ": SD_JWT_TYP,
+            "x5c": [base64.b64encode(signer.certificate_der).decode("utf-8")],
+        }
+        self._header_b64 = _b64(json.dumps(header).encode("utf-8"))
+
+    @classmethod
+    def from_country(cls, country):
+        """Engine with the document signer of a country (cfgcountries)."""
+        return cls(load_signer(cfgcountries.supported_countries[country]))
+
+    def _sign(self, payload):
+        signing_input = self._header_b64 + "." + _b64(json.dumps(payload).encode("utf-8"))
+        return signing_input + "." + _b64(self._signer.sign(signing_input.encode("ascii")))
+
+    def _disclose(self, claims, salts, disclosures):
+        # same structure as sd_jwt.issuer.SDJWTIssuer._create_sd_claims (without decoys)
+        if isinstance(claims, dict):
+            output = {"_sd": []}
+            for key, value in claims.items():
+                value = self._disclose(value, salts, disclosures)
+                if isinstance(key, SDObj):
+                    output["_sd"].append(
+                        self._disclosure([next(salts), key.value, value], disclosures)
+                    )
+                else:
+                    output[key] = value
+            if output["_sd"]:
+                output["_sd"].sort()
+            else:
+                del output["_sd"]
+            return output
+
+        if isinstance(claims, list):
+            output = []
+            for element in claims:
+                if isinstance(element, SDObj):
+                    value = self._disclose(element.value, salts, disclosures)
+                    output.append({"...": self._disclosure([next(salts), value], disclosures)})
+                else:
+                    output.append(self._disclose(element, salts, disclosures))
+            return output
+
+        return claims
+
+    @staticmethod
+    def _disclosure(content, disclosures):
+        disclosure = _b64(json.dumps(content).encode("utf-8"))
+        disclosures.append(disclosure)
+        return _b64(hashlib.sha256(disclosure.encode("ascii")).digest())
+
+    def issue_many(self, claims, holder_jwks):
+        """Issue one SD-JWT per holder key
+
+        Keyword arguments:
+        + claims -- claims, selectively disclosable claims marked with SDObj
+        + holder_jwks -- holder keys (JWK dict, cnf claim), or None for no key binding
+
+        Return: list of SD-JWTs (compact serialization, with disclosures)
+        """
+        count = _count_disclosures(claims)
+        random = os.urandom(SALT_SIZE * count * len(holder_jwks))
+        salts = iter(
+            [
+                _b64(random[i : i + SALT_SIZE])
+                for i in range(0, len(random), SALT_SIZE)
+            ]
+        )
+
+        sd_jwts = []
+        for jwk in holder_jwks:
+            disclosures = []
+            payload = self._disclose(claims, salts, disclosures)
+            payload["_sd_alg"] = "sha-256"
+            if jwk is not None:
+                payload["cnf"] = {"jwk": jwk}
+            sd_jwts.append("~".join([self._sign(payload)] + disclosures) + "~")
+
+        return sd_jwts
+
+    def issue(self, claims, holder_jwk=None):
+        """Issue one SD-JWT (see issue_many)."""
+        return self.issue_many(claims, [holder_jwk])[0]
@@ -0,0 +1,123 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This session_store.py contains the server-side Flask session interface.
+Sessions are serialized with CBOR and kept in a kv_store (memory or Redis protocol)
+with a time-to-live, reset on each request of the session. A session is only written back
+to the store when it was modified.
+"""
+
+import secrets
+
+import cbor2
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dictionary that tracks modifications."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class StoreSessionInterface(SessionInterface):
+    """Flask session interface backed by a kv_store."""
+
+    session_class = ServerSideSession
+
+    def __init__(self, store, lifetime, key_prefix="session:"):
+        """
+        Keyword arguments:
+        + store -- kv_store instance (MemoryStore or RedisStore)
+        + lifetime -- session time-to-live in seconds (reset on each request)
+        + key_prefix -- prefix of the session keys in the store
+        """
+        self.store = store
+        self.lifetime = lifetime
+        self.key_prefix = key_prefix
+
+    def _new_session(self):
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self._new_session()
+
+        raw = self.store.get(self.key_prefix + sid)
+        if raw is None:
+            return self._new_session()
+
+        try:
+            data = cbor2.loads(raw)
+        except Exception:
+            app.logger.warning("Discarding unreadable session data")
+            return self._new_session()
+
+        return self.session_class(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        key = self.key_prefix + session.sid
+
+        if not session:
+            if session.modified:
+                self.store.delete(key)
+                response.delete_cookie(
+                    name,
+                    domain=domain,
+                    path=path,
+                    secure=secure,
+                    samesite=samesite,
+                    httponly=httponly,
+                )
+            return
+
+        # sliding expiry: the time-to-live is reset by every request of the session (the
+        # cookie is a browser session cookie, SESSION_PERMANENT = False)
+        if session.modified:
+            self.store.set(key, cbor2.dumps(dict(session)), self.lifetime)
+        else:
+            self.store.touch(key, self.lifetime)
+
+        if self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
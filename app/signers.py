@@ -0,0 +1,223 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This signers.py contains the document signer keys used by the mdoc and SD-JWT issuers.
+
+A signer returns raw (r || s) ECDSA signatures, as used by JWS and COSE, with the hash of its
+curve (P-256/SHA-256, P-384/SHA-384, P-521/SHA-512):
++ KeySigner -- key file (pid_mdoc_privkey) loaded once in process memory
++ PKCS11Signer -- key held by a PKCS#11 token (HSM, SoftHSM), with a pool of logged-in sessions
+  shared by the request threads (python-pkcs11)
+"""
+
+import hashlib
+import queue
+import threading
+from abc import ABC, abstractmethod
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+from .app_config.config_service import ConfService as cfgservice
+
+# curve name -> (hash, hashlib digest, signature coordinate size)
+CURVES = {
+    "secp256r1": (hashes.SHA256(), hashlib.sha256, 32),
+    "secp384r1": (hashes.SHA384(), hashlib.sha384, 48),
+    "secp521r1": (hashes.SHA512(), hashlib.sha512, 66),
+}
+
+
+def load_certificate(path):
+    """DER encoded certificate of a PEM or DER certificate file."""
+    with open(path, "rb") as cert_file:
+        certificate = cert_file.read()
+
+    if certificate.lstrip().startswith(b"-----BEGIN"):
+        certificate = x509.load_pem_x509_certificate(certificate).public_bytes(
+            serialization.Encoding.DER
+        )
+    return certificate
+
+
+class Signer(ABC):
+    """Document signer key and certificate."""
+
+    def __init__(self, certificate_der, curve):
+        """
+        Keyword arguments:
+        + certificate_der -- DER encoded certificate of the key
+        + curve -- curve name of the key (e.g. secp256r1)
+        """
+        self.certificate_der = certificate_der
+        self.curve = curve
+
+    @abstractmethod
+    def sign(self, data):
+        """Raw (r || s) ECDSA signature of data
+
+        Keyword arguments:
+        + data -- bytes to sign
+
+        Return: bytes
+        """
+
+
+class KeySigner(Signer):
+    """Signer with the key in process memory."""
+
+    def __init__(self, private_key, certificate_der):
+        """
+        Keyword arguments:
+        + private_key -- EC private key (cryptography)
+        + certificate_der -- DER encoded certificate of the key
+        """
+        super().__init__(certificate_der, private_key.curve.name)
+        self._private_key = private_key
+        self._hash, _, self._size = CURVES[self.curve]
+
+    def sign(self, data):
+        r, s = decode_dss_signature(self._private_key.sign(data, ec.ECDSA(self._hash)))
+        return r.to_bytes(self._size, "big") + s.to_bytes(self._size, "big")
+
+
+# one PKCS#11 library (C_Initialize) per module path and process
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def _pkcs11_library(module):
+    import pkcs11
+
+    with _libraries_lock:
+        if module not in _libraries:
+            _libraries[module] = pkcs11.lib(module)
+        return _libraries[module]
+
+
+class PKCS11Signer(Signer):
+    """Signer with the key held by a PKCS#11 token.
+
+    The sessions are opened and logged in once, and kept in a pool: concurrent sign calls
+    use different sessions, so they are not serialized on one session.
+    """
+
+    def __init__(self, module, token_label, pin, key_label, certificate_der, sessions):
+        """
+        Keyword arguments:
+        + module -- PKCS#11 module path (e.g. /usr/lib/softhsm/libsofthsm2.so)
+        + token_label -- token label
+        + pin -- user PIN
+        + key_label -- label of the private key
+        + certificate_der -- DER encoded certificate of the key
+        + sessions -- maximum number of sessions
+        """
+        public_key = x509.load_der_x509_certificate(certificate_der).public_key()
+        super().__init__(certificate_der, public_key.curve.name)
+        _, self._digest, _ = CURVES[self.curve]
+
+        self._token = _pkcs11_library(module).get_token(token_label=token_label)
+        self._pin = pin
+        self._key_label = key_label
+
+        self._sessions = queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(sessions)
+        self._lock = threading.Lock()
+
+    def _open(self):
+        from pkcs11 import KeyType, ObjectClass
+        from pkcs11.exceptions import UserAlreadyLoggedIn
+
+        # the login is shared by all the sessions of the process
+        try:
+            session = self._token.open(user_pin=self._pin)
+        except UserAlreadyLoggedIn:
+            session = self._token.open()
+
+        key = session.get_key(
+            object_class=ObjectClass.PRIVATE_KEY, key_type=KeyType.EC, label=self._key_label
+        )
+        return session, key
+
+    def sign(self, data):
+        from pkcs11 import Mechanism
+        from pkcs11.exceptions import PKCS11Error
+
+        digest = self._digest(data).digest()
+
+        self._available.acquire()
+        try:
+            try:
+                session, key = self._sessions.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    session, key = self._open()
+
+            try:
+                signature = key.sign(digest, mechanism=Mechanism.ECDSA)
+            except PKCS11Error:
+                # the session is dropped (e.g. token reset), the next call opens a new one
+                session.close()
+                raise
+
+            self._sessions.put((session, key))
+            return signature
+        finally:
+            self._available.release()
+
+    def close(self):
+        while True:
+            try:
+                session, _ = self._sessions.get_nowait()
+            except queue.Empty:
+                return
+            session.close()
+
+
+def load_signer(config):
+    """Document signer of a country
+
+    Keyword arguments:
+    + config -- country configuration (cfgcountries): pid_mdoc_cert and either
+      pid_mdoc_privkey/pid_mdoc_privkey_passwd (key file) or
+      pkcs11_module/pkcs11_token/pkcs11_pin/pkcs11_key_label (PKCS#11 token)
+
+    Return: Signer
+    """
+    certificate_der = load_certificate(config["pid_mdoc_cert"])
+
+    if config.get("pkcs11_module"):
+        return PKCS11Signer(
+            config["pkcs11_module"],
+            config["pkcs11_token"],
+            config["pkcs11_pin"],
+            config["pkcs11_key_label"],
+            certificate_der,
+            cfgservice.pkcs11_sessions,
+        )
+
+    with open(config["pid_mdoc_privkey"], "rb") as key_file:
+        private_key = serialization.load_pem_private_key(
+            key_file.read(), password=config["pid_mdoc_privkey_passwd"]
+        )
+    return KeySigner(private_key, certificate_der)
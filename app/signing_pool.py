@@ -0,0 +1,222 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This signing_pool.py contains the signing worker processes.
+
+The CBOR/JSON encoding, digests and ECDSA signatures of the credentials are CPU-bound and
+would serialize on the GIL of the request threads. With cfgservice.signing_workers > 0 they run
+on a pool of worker processes: each worker loads the DS keys of the countries (ds_keys.py)
+once, when it starts, and receives the issuance jobs as pickled arguments on its pipe. At most
+cfgservice.signing_max_pending jobs are queued or running; callers wait up to
+cfgservice.signing_queue_timeout seconds for a slot and then get SigningBusy.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .app_config.config_countries import ConfCountries as cfgcountries
+from .app_config.config_service import ConfService as cfgservice
+from .ds_keys import DSKeySet, collect_outcomes, get_key_set, record_outcomes, take_outcomes
+from . import metrics
+
+# document signer settings of a country (key file or PKCS#11 token, see signers.load_signer)
+KEY_SETTINGS = (
+    "pid_mdoc_privkey",
+    "pid_mdoc_privkey_passwd",
+    "pid_mdoc_cert",
+    "pkcs11_module",
+    "pkcs11_token",
+    "pkcs11_pin",
+    "pkcs11_key_label",
+    "ds_keys",
+)
+
+
+class SigningBusy(RuntimeError):
+    """All signing slots are taken."""
+
+
+# Worker process state
+_key_sets = {}
+
+
+def _init_worker(countries):
+    collect_outcomes()
+    for country, config in countries.items():
+        key_set = _key_sets[country] = DSKeySet.from_config(country, config)
+        for key in key_set.keys:
+            try:
+                key.signer()
+            except Exception as e:
+                # the first job of the country retries (and fails over to the next key)
+                cfgservice.app_logger.warning(
+                    "Signing worker: cannot load the DS key " + key.id + " (" + country + "): " + str(e)
+                )
+
+
+def sign_sdjwt(key_set, claims, holder_jwk, doctype=None):
+    return key_set.run(lambda key: key.sdjwt_engine().issue(claims, holder_jwk), doctype)
+
+
+def sign_mdoc(key_set, doctype, data, device_publickey, validity, revocation):
+    return key_set.run(
+        lambda key: key.mdoc_issuer(doctype).issue(data, device_publickey, validity, revocation),
+        doctype,
+    )
+
+
+def _job(function, *args):
+    # the DS key outcomes go back with the result (or error), see SigningPool._run
+    try:
+        result = function(*args)
+    except Exception as e:
+        return None, e, take_outcomes()
+    return result, None, take_outcomes()
+
+
+def _issue_sdjwt(country, claims, holder_jwk, doctype):
+    return _job(sign_sdjwt, _key_sets[country], claims, holder_jwk, doctype)
+
+
+def _issue_mdoc(country, doctype, data, device_publickey, validity, revocation):
+    return _job(
+        sign_mdoc, _key_sets[country], doctype, data, device_publickey, validity, revocation
+    )
+
+
+def country_keys():
+    """Key settings of the supported countries (cfgcountries)."""
+    return {
+        country: {setting: config[setting] for setting in KEY_SETTINGS if setting in config}
+        for country, config in cfgcountries.supported_countries.items()
+        if "pid_mdoc_cert" in config
+    }
+
+
+class SigningPool:
+    """Pool of signing worker processes."""
+
+    def __init__(self, workers, max_pending, countries, queue_timeout=None):
+        """
+        Keyword arguments:
+        + workers -- number of worker processes
+        + max_pending -- maximum number of queued or running jobs
+        + countries -- {country: key settings} loaded by the workers (see country_keys)
+        + queue_timeout -- maximum wait (seconds) for a free slot (None: wait)
+        """
+        # spawn: the request threads may hold locks a forked child would inherit
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(countries,),
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue_timeout = queue_timeout
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self._queue_timeout):
+            metrics.inc("signing_rejected_total", "Signing jobs refused (queue full)")
+            raise SigningBusy("Signing queue is full")
+
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        result, error, outcomes = future.result()
+        # the stats and metrics of the DS keys (/admin/ds_keys) are kept by this process
+        record_outcomes(outcomes)
+        if error is not None:
+            raise error
+        return result
+
+    def issue_sdjwt(self, country, claims, holder_jwk, doctype=None):
+        """SD-JWT signed by a worker (see SDJWTEngine.issue)."""
+        return self._run(_issue_sdjwt, country, claims, holder_jwk, doctype)
+
+    def issue_mdoc(self, country, doctype, data, device_publickey, validity, revocation=None):
+        """mdoc signed by a worker (see MdocIssuer.issue)."""
+        return self._run(
+            _issue_mdoc, country, doctype, data, device_publickey, validity, revocation
+        )
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_signing_pool():
+    """Signing pool of the service, started on first use."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SigningPool(
+                    cfgservice.signing_workers,
+                    cfgservice.signing_max_pending,
+                    country_keys(),
+                    cfgservice.signing_queue_timeout,
+                )
+    return _pool
+
+
+def issue_sdjwt(country, claims, holder_jwk, doctype=None):
+    """Issue an SD-JWT with a DS key of a country (worker process or request thread)
+
+    Keyword arguments:
+    + country -- issuing country
+    + claims -- claims, selectively disclosable claims marked with SDObj
+    + holder_jwk -- holder key (JWK dict)
+    + doctype -- credential doctype (DS key selection)
+
+    Return: SD-JWT (compact serialization, with disclosures)
+    """
+    if cfgservice.signing_workers > 0:
+        return get_signing_pool().issue_sdjwt(country, claims, holder_jwk, doctype)
+    return sign_sdjwt(get_key_set(country), claims, holder_jwk, doctype)
+
+
+def issue_mdoc(country, doctype, data, device_publickey, validity, revocation=None):
+    """Issue an mdoc with a DS key of a country (worker process or request thread)
+
+    Keyword arguments:
+    + country -- issuing country
+    + doctype -- mdoc doctype
+    + data -- {namespace: {element identifier: value}}
+    + device_publickey -- holder device key (urlsafe base64 encoded PEM)
+    + validity -- {"issuance_date": "YYYY-MM-DD", "expiry_date": "YYYY-MM-DD"}
+    + revocation -- MSO status (optional)
+
+    Return: CBOR encoded mdoc (bytes)
+    """
+    if cfgservice.signing_workers > 0:
+        return get_signing_pool().issue_mdoc(
+            country, doctype, data, device_publickey, validity, revocation
+        )
+    return sign_mdoc(get_key_set(country), doctype, data, device_publickey, validity, revocation)
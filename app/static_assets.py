@@ -0,0 +1,175 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This static_assets.py contains the fingerprinted static assets.
+
+When the app starts, every file under app/static gets a name with a digest of its content
+(css/site.css -> css/site.<digest>.css) and text files are compressed once (gzip). Templates
+link the assets with asset_url('css/site.css'); the fingerprinted URLs (/assets/...) are served
+with Cache-Control immutable and a one-year max-age, since a new content gets a new URL. The
+original names are also served under /assets/ (relative URLs in the stylesheets), with ETag
+revalidation.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Blueprint, abort, make_response, request, send_from_directory, url_for
+
+from .app_config.config_service import ConfService as cfgservice
+
+assets = Blueprint("assets", __name__, url_prefix="/assets")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# compressed when served (gzip) if at least static_gzip_min_size bytes
+TEXT_EXTENSIONS = frozenset(
+    (".css", ".js", ".svg", ".json", ".map", ".html", ".txt", ".xml", ".eot", ".ttf")
+)
+
+
+class Asset:
+    """Static file, with its fingerprinted name and gzip variant."""
+
+    def __init__(self, path, digest, gzip_body):
+        """
+        Keyword arguments:
+        + path -- path relative to the static folder (/ separated)
+        + digest -- hex digest of the content
+        + gzip_body -- gzip compressed content, None if not compressed
+        """
+        self.path = path
+        self.etag = digest[:32]
+        self.gzip = gzip_body
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+        directory, name = os.path.split(path)
+        stem, ext = os.path.splitext(name)
+        self.fingerprinted = "/".join(filter(None, (directory, stem + "." + digest[:12] + ext)))
+
+
+class AssetManifest:
+    """Static files of a folder, by path and by fingerprinted path."""
+
+    def __init__(self, static_folder):
+        """
+        Keyword arguments:
+        + static_folder -- folder of the static files
+        """
+        self.static_folder = static_folder
+        self.assets = {}
+        self.fingerprinted = {}
+
+        for root, _, files in os.walk(static_folder):
+            for name in files:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, static_folder).replace(os.sep, "/")
+                with open(full_path, "rb") as asset_file:
+                    content = asset_file.read()
+
+                gzip_body = None
+                if (
+                    os.path.splitext(name)[1].lower() in TEXT_EXTENSIONS
+                    and len(content) >= cfgservice.static_gzip_min_size
+                ):
+                    gzip_body = gzip.compress(content, 9)
+                    if len(gzip_body) >= len(content):
+                        gzip_body = None
+
+                asset = Asset(path, hashlib.sha256(content).hexdigest(), gzip_body)
+                self.assets[path] = asset
+                self.fingerprinted[asset.fingerprinted] = asset
+
+
+_manifest = None
+
+
+def asset_url(filename):
+    """URL of a static file (template helper)
+
+    Keyword arguments:
+    + filename -- path relative to app/static
+
+    Return: fingerprinted URL, or the static URL if the file is not in the manifest
+    """
+    asset = _manifest.assets.get(filename) if _manifest is not None else None
+    if asset is None:
+        return url_for("static", filename=filename)
+    return url_for("assets.asset", filename=asset.fingerprinted)
+
+
+def _send(asset, cache_control):
+    if asset.gzip is not None and "gzip" in request.accept_encodings:
+        etag = asset.etag + "-gzip"
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(asset.gzip)
+            response.mimetype = asset.mimetype
+            response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+    else:
+        response = send_from_directory(
+            _manifest.static_folder, asset.path, mimetype=asset.mimetype, etag=asset.etag
+        )
+
+    if asset.gzip is not None:
+        response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+@assets.route("/<path:filename>", methods=["GET"])
+def asset(filename):
+    if _manifest is None:
+        abort(404)
+
+    asset = _manifest.fingerprinted.get(filename)
+    if asset is not None:
+        return _send(asset, IMMUTABLE)
+
+    asset = _manifest.assets.get(filename)
+    if asset is not None:
+        return _send(asset, REVALIDATE)
+
+    abort(404)
+
+
+def send_asset(filename):
+    """Response with a static file at a fixed URL (e.g. /favicon.ico), revalidated with its ETag."""
+    asset = _manifest.assets.get(filename) if _manifest is not None else None
+    if asset is None:
+        abort(404)
+    return _send(asset, REVALIDATE)
+
+
+def init_app(app):
+    """Build the manifest of the app static folder and add the asset_url template helper."""
+    global _manifest
+
+    _manifest = AssetManifest(app.static_folder)
+    app.jinja_env.globals["asset_url"] = asset_url
+    cfgservice.app_logger.info(
+        "Static assets: " + str(len(_manifest.assets)) + " files fingerprinted"
+    )
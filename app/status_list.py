@@ -0,0 +1,421 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This status_list.py contains the token status lists of the issued credentials.
+
+Each (doctype, country) has a current status list of cfgservice.status_list_size entries of
+cfgservice.status_list_bits bits, held in memory as a bitstring:
++ indexes are handed out from a counter, shuffled by a per-list odd multiplier and increment so that
+  consecutive credentials do not get neighbouring indexes. Each process reserves blocks of
+  cfgservice.status_list_block indexes with one SQLite write, the issuance itself does not touch
+  the database. A full list is replaced by a new one.
++ status changes (set_statuses) are written in one transaction per batch and bump the list
+  version
++ the signed status list token (statuslist+jwt, zlib compressed bitstring) is built on request
+  and kept until the list version changes or the token gets close to its expiry; its ETag is the
+  version of the list
+"""
+
+import base64
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from .app_config.config_service import ConfService as cfgservice
+from .ds_keys import get_key_set
+from .sdjwt_engine import CURVES
+from . import metrics
+
+STATUS_VALID = 0
+STATUS_INVALID = 1
+STATUS_SUSPENDED = 2
+
+STATUS_LIST_TYP = "statuslist+jwt"
+
+# seconds between two checks of the list versions written by other processes
+SYNC_INTERVAL = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS status_lists (
+    list_id TEXT PRIMARY KEY,
+    doctype TEXT NOT NULL,
+    country TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    bits INTEGER NOT NULL,
+    multiplier INTEGER NOT NULL,
+    increment INTEGER NOT NULL,
+    reserved INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS status_lists_current ON status_lists (doctype, country, created);
+CREATE TABLE IF NOT EXISTS status_entries (
+    list_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (list_id, idx)
+);
+"""
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _connect():
+    os.makedirs(os.path.dirname(cfgservice.status_list_db), exist_ok=True)
+    conn = sqlite3.connect(cfgservice.status_list_db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class StatusList:
+    """One status list: bitstring, index allocation and token."""
+
+    def __init__(self, list_id, doctype, country, size, bits, multiplier, increment, version):
+        """
+        Keyword arguments:
+        + list_id -- list identifier (last segment of the list uri)
+        + doctype -- doctype of the credentials of the list
+        + country -- issuing country (DS key of the token)
+        + size -- number of entries (power of 2)
+        + bits -- bits per entry (1, 2, 4 or 8)
+        + multiplier, increment -- index shuffle (odd multiplier)
+        + version -- list version
+        """
+        self.list_id = list_id
+        self.doctype = doctype
+        self.country = country
+        self.size = size
+        self.bits = bits
+        self.multiplier = multiplier
+        self.increment = increment
+        self.version = version
+        self.uri = cfgservice.service_url + "revocation/status_list/" + list_id
+
+        self.statuses = bytearray(size * bits // 8)
+        self._next = 0
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+        self._token_lock = threading.Lock()
+        self._token = None
+        self._token_version = None
+        self._token_exp = 0
+        self._synced = time.monotonic()
+
+    def index(self, counter):
+        """Index of the counter-th credential of the list."""
+        return (counter * self.multiplier + self.increment) % self.size
+
+    def allocate(self):
+        """Next free index of the list, None if the list is full."""
+        with self._lock:
+            if self._next == self._reserved:
+                start, end = _reserve_block(self.list_id)
+                if start == end:
+                    return None
+                self._next, self._reserved = start, end
+            counter = self._next
+            self._next += 1
+        return self.index(counter)
+
+    def get(self, idx):
+        per_byte = 8 // self.bits
+        shift = (idx % per_byte) * self.bits
+        return (self.statuses[idx // per_byte] >> shift) & ((1 << self.bits) - 1)
+
+    def set(self, idx, status):
+        per_byte = 8 // self.bits
+        shift = (idx % per_byte) * self.bits
+        mask = ((1 << self.bits) - 1) << shift
+        byte = idx // per_byte
+        self.statuses[byte] = (self.statuses[byte] & ~mask) | (status << shift)
+
+    def status(self, idx):
+        """Status of the credential at idx (changes of the other processes included)."""
+        self._sync()
+        return self.get(idx)
+
+    def load(self, conn):
+        """Read the statuses and version of the list from the database."""
+        statuses = bytearray(self.size * self.bits // 8)
+        with self._lock:
+            current, self.statuses = self.statuses, statuses
+            try:
+                for idx, status in conn.execute(
+                    "SELECT idx, status FROM status_entries WHERE list_id = ?", (self.list_id,)
+                ):
+                    self.set(idx, status)
+                self.version = conn.execute(
+                    "SELECT version FROM status_lists WHERE list_id = ?", (self.list_id,)
+                ).fetchone()[0]
+            except Exception:
+                self.statuses = current
+                raise
+
+    def _sync(self):
+        """Reload the list if another process changed it."""
+        now = time.monotonic()
+        if now - self._synced < SYNC_INTERVAL:
+            return
+        self._synced = now
+
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT version FROM status_lists WHERE list_id = ?", (self.list_id,)
+            ).fetchone()
+            if row and row[0] != self.version:
+                self.load(conn)
+        finally:
+            conn.close()
+
+    def token(self):
+        """Signed status list token of the list
+
+        Return: (token, etag)
+        """
+        self._sync()
+
+        now = int(time.time())
+        with self._token_lock:
+            if (
+                self._token is not None
+                and self._token_version == self.version
+                and self._token_exp - now >= cfgservice.status_list_ttl
+            ):
+                return self._token, self._etag
+
+            with self._lock:
+                bitstring, version = bytes(self.statuses), self.version
+            exp = now + cfgservice.status_list_token_expiry
+            payload = {
+                "sub": self.uri,
+                "iat": now,
+                "exp": exp,
+                "ttl": cfgservice.status_list_ttl,
+                "status_list": {"bits": self.bits, "lst": _b64(zlib.compress(bitstring, 9))},
+            }
+            token = get_key_set(self.country).run(lambda key: _sign(key.signer(), payload))
+            metrics.inc("status_list_tokens_total", "Status list tokens signed")
+
+            self._token, self._token_version, self._token_exp = token, version, exp
+            self._etag = '"' + self.list_id + "-" + str(version) + '"'
+            return self._token, self._etag
+
+
+def _sign(signer, payload):
+    header = {
+        "alg": CURVES[signer.curve][1],
+        "typ": STATUS_LIST_TYP,
+        "x5c": [base64.b64encode(signer.certificate_der).decode("utf-8")],
+    }
+    signing_input = _b64(json.dumps(header).encode("utf-8")) + "." + _b64(
+        json.dumps(payload).encode("utf-8")
+    )
+    return signing_input + "." + _b64(signer.sign(signing_input.encode("ascii")))
+
+
+def _reserve_block(list_id):
+    """Reserve the next block of counters of a list (shared by the processes)
+
+    Return: (start, end), start == end if the list is full
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        size, reserved = conn.execute(
+            "SELECT size, reserved FROM status_lists WHERE list_id = ?", (list_id,)
+        ).fetchone()
+        end = min(size, reserved + cfgservice.status_list_block)
+        conn.execute("UPDATE status_lists SET reserved = ? WHERE list_id = ?", (end, list_id))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return reserved, end
+
+
+_lists = {}
+_current = {}
+_lock = threading.Lock()
+
+
+def _from_row(row):
+    status_list = StatusList(*row)
+    _lists[status_list.list_id] = status_list
+    return status_list
+
+
+def _create(conn, doctype, country):
+    size = cfgservice.status_list_size
+    row = (
+        uuid.uuid4().hex,
+        doctype,
+        country,
+        size,
+        cfgservice.status_list_bits,
+        secrets.randbelow(size // 2) * 2 + 1,
+        secrets.randbelow(size),
+        0,
+    )
+    with conn:
+        conn.execute(
+            "INSERT INTO status_lists (list_id, doctype, country, size, bits, multiplier, "
+            "increment, version, reserved, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+            row + (time.time(),),
+        )
+    return _from_row(row)
+
+
+def _current_list(doctype, country, full=None):
+    """Status list used for new credentials of (doctype, country)."""
+    with _lock:
+        status_list = _current.get((doctype, country))
+        if status_list is not None and status_list is not full:
+            return status_list
+
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT list_id, doctype, country, size, bits, multiplier, increment, version "
+                "FROM status_lists WHERE doctype = ? AND country = ? AND reserved < size "
+                "ORDER BY created DESC LIMIT 1",
+                (doctype, country),
+            ).fetchone()
+            if row is None or (full is not None and row[0] == full.list_id):
+                status_list = _create(conn, doctype, country)
+            else:
+                status_list = _lists.get(row[0]) or _from_row(row)
+                status_list.load(conn)
+        finally:
+            conn.close()
+
+        _current[(doctype, country)] = status_list
+        return status_list
+
+
+def get_status_list(list_id):
+    """Status list by id (loaded from the database on first use), None if unknown."""
+    status_list = _lists.get(list_id)
+    if status_list is not None:
+        return status_list
+
+    with _lock:
+        status_list = _lists.get(list_id)
+        if status_list is None:
+            conn = _connect()
+            try:
+                row = conn.execute(
+                    "SELECT list_id, doctype, country, size, bits, multiplier, increment, version "
+                    "FROM status_lists WHERE list_id = ?",
+                    (list_id,),
+                ).fetchone()
+                if row is None:
+                    return None
+                status_list = _from_row(row)
+                status_list.load(conn)
+            finally:
+                conn.close()
+    return status_list
+
+
+def allocate(doctype, country):
+    """Status list entry of a new credential
+
+    Keyword arguments:
+    + doctype -- credential doctype
+    + country -- issuing country
+
+    Return: {"status_list": {"idx": index, "uri": list uri}} (status claim / MSO status)
+    """
+    status_list = _current_list(doctype, country)
+    idx = status_list.allocate()
+    while idx is None:
+        status_list = _current_list(doctype, country, full=status_list)
+        idx = status_list.allocate()
+
+    metrics.inc("status_list_allocations_total", "Status list indexes allocated")
+    return {"status_list": {"idx": idx, "uri": status_list.uri}}
+
+
+def set_statuses(updates):
+    """Change the status of credentials, in one transaction
+
+    Keyword arguments:
+    + updates -- list of (list_id, idx, status)
+
+    Return: error description, or None if the statuses were changed
+    """
+    changes = {}
+    for list_id, idx, status in updates:
+        status_list = get_status_list(list_id)
+        if status_list is None:
+            return "Unknown status list " + str(list_id)
+        if not isinstance(idx, int) or not 0 <= idx < status_list.size:
+            return "Invalid index " + str(idx)
+        if not isinstance(status, int) or not 0 <= status < 1 << status_list.bits:
+            return "Invalid status " + str(status)
+        changes.setdefault(status_list, {})[idx] = status
+
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            versions = {}
+            for status_list, entries in changes.items():
+                versions[status_list] = conn.execute(
+                    "SELECT version FROM status_lists WHERE list_id = ?", (status_list.list_id,)
+                ).fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO status_entries (list_id, idx, status, updated) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (list_id, idx) "
+                    "DO UPDATE SET status = excluded.status, updated = excluded.updated",
+                    [(status_list.list_id, idx, status, now) for idx, status in entries.items()],
+                )
+                conn.execute(
+                    "UPDATE status_lists SET version = version + 1 WHERE list_id = ?",
+                    (status_list.list_id,),
+                )
+
+        for status_list, entries in changes.items():
+            if versions[status_list] != status_list.version:
+                # changed by another process since the last load
+                status_list.load(conn)
+                continue
+            with status_list._lock:
+                for idx, status in entries.items():
+                    status_list.set(idx, status)
+                status_list.version += 1
+    finally:
+        conn.close()
+
+    metrics.inc("status_list_updates_total", "Credential status changes", len(updates))
+    return None
@@ -0,0 +1,250 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This status_list_client.py contains the status checks of presented credentials.
+
+The status list tokens referenced by the credentials (status_list uri and idx) are fetched
+once and kept decompressed in a shared cache until their ttl (or Cache-Control max-age)
+expires; they are then revalidated with If-None-Match. Validations that need the same list
+while it is being fetched wait for that fetch. Lists hosted by this service (status_list.py) are
+read in process.
+"""
+
+import base64
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+from .app_config.config_service import ConfService as cfgservice
+from . import metrics, status_list, trusted_CAs
+
+# JWS alg -> (hash, signature coordinate size)
+ALGORITHMS = {
+    "ES256": (hashes.SHA256, 32),
+    "ES384": (hashes.SHA384, 48),
+    "ES512": (hashes.SHA512, 66),
+}
+
+LOCAL_PREFIX = "revocation/status_list/"
+
+
+class StatusListError(ValueError):
+    """The status list of a credential can not be fetched or is not valid."""
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class _StatusList:
+    """Decompressed status list."""
+
+    def __init__(self, bits, statuses, expires, etag):
+        self.bits = bits
+        self.statuses = statuses
+        self.expires = expires
+        self.etag = etag
+
+    def get(self, idx):
+        per_byte = 8 // self.bits
+        byte = idx // per_byte
+        if idx < 0 or byte >= len(self.statuses):
+            raise StatusListError("Status list index out of range: " + str(idx))
+        return (self.statuses[byte] >> ((idx % per_byte) * self.bits)) & ((1 << self.bits) - 1)
+
+
+class _Fetch:
+    """Fetch in progress, shared by the validations waiting for the list."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_lists = OrderedDict()
+_fetches = {}
+_lock = threading.Lock()
+
+
+def _verify(token, uri):
+    """Payload of a status list token signed by a trusted DS (x5c header)."""
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        payload = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+        certificate = x509.load_der_x509_certificate(base64.b64decode(header["x5c"][0]))
+        hash_algorithm, size = ALGORITHMS[header["alg"]]
+    except Exception as e:
+        raise StatusListError("Invalid status list token: " + str(e)) from e
+
+    if header.get("typ") != status_list.STATUS_LIST_TYP or payload.get("sub") != uri:
+        raise StatusListError("Invalid status list token")
+
+    if certificate.issuer not in trusted_CAs:
+        raise StatusListError("Status list token signer wasn't emitted by a Trusted CA")
+
+    try:
+        trusted_CAs[certificate.issuer]["public_key"].verify(
+            certificate.signature,
+            certificate.tbs_certificate_bytes,
+            ec.ECDSA(certificate.signature_hash_algorithm),
+        )
+        certificate.public_key().verify(
+            encode_dss_signature(
+                int.from_bytes(signature[:size], "big"), int.from_bytes(signature[size:], "big")
+            ),
+            (header_b64 + "." + payload_b64).encode("ascii"),
+            ec.ECDSA(hash_algorithm()),
+        )
+    except Exception as e:
+        raise StatusListError("Status list token signature not valid") from e
+
+    if payload.get("exp") is not None and payload["exp"] < time.time():
+        raise StatusListError("Status list token expired")
+
+    return payload
+
+
+def _max_age(response):
+    for directive in response.headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    return None
+
+
+def _fetch(uri, cached):
+    """Fetch (or revalidate) a status list token."""
+    headers = {"Accept": "application/statuslist+jwt"}
+    if cached is not None and cached.etag:
+        headers["If-None-Match"] = cached.etag
+
+    try:
+        response = requests.get(uri, headers=headers, timeout=cfgservice.status_list_fetch_timeout)
+    except requests.RequestException as e:
+        raise StatusListError("Status list " + uri + " unavailable: " + str(e)) from e
+
+    max_age = _max_age(response)
+    if response.status_code == 304 and cached is not None:
+        metrics.inc("status_list_fetches_total", "Status list fetches", result="not_modified")
+        ttl = max_age if max_age is not None else cfgservice.status_list_default_ttl
+        return _StatusList(cached.bits, cached.statuses, time.monotonic() + ttl, cached.etag)
+
+    if response.status_code != 200:
+        raise StatusListError(
+            "Status list " + uri + " unavailable: " + str(response.status_code)
+        )
+
+    payload = _verify(response.text.strip(), uri)
+    try:
+        bits = payload["status_list"]["bits"]
+        statuses = zlib.decompress(_b64decode(payload["status_list"]["lst"]))
+    except Exception as e:
+        raise StatusListError("Invalid status list: " + str(e)) from e
+    if bits not in (1, 2, 4, 8):
+        raise StatusListError("Invalid status list bits: " + str(bits))
+
+    ttl = payload.get("ttl", max_age)
+    if ttl is None:
+        ttl = cfgservice.status_list_default_ttl
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+
+    metrics.inc("status_list_fetches_total", "Status list fetches", result="fetched")
+    return _StatusList(bits, statuses, time.monotonic() + ttl, response.headers.get("ETag"))
+
+
+def _get(uri):
+    """Status list of uri, from the cache or fetched once for all the waiting validations."""
+    with _lock:
+        cached = _lists.get(uri)
+        if cached is not None and cached.expires > time.monotonic():
+            _lists.move_to_end(uri)
+            return cached
+
+        fetch = _fetches.get(uri)
+        leader = fetch is None
+        if leader:
+            fetch = _fetches[uri] = _Fetch()
+
+    if not leader:
+        if not fetch.done.wait(cfgservice.status_list_fetch_timeout * 2):
+            raise StatusListError("Status list " + uri + " unavailable: timeout")
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.result
+
+    try:
+        fetch.result = _fetch(uri, cached)
+    except Exception as e:
+        fetch.error = e if isinstance(e, StatusListError) else StatusListError(str(e))
+        raise fetch.error from e
+    finally:
+        with _lock:
+            if fetch.result is not None:
+                _lists[uri] = fetch.result
+                _lists.move_to_end(uri)
+                while len(_lists) > cfgservice.status_list_cache_size:
+                    _lists.popitem(last=False)
+            del _fetches[uri]
+        fetch.done.set()
+
+    return fetch.result
+
+
+def credential_status(status):
+    """Status of a credential
+
+    Keyword arguments:
+    + status -- status of the credential (MSO status / status claim):
+      {"status_list": {"idx": index, "uri": status list uri}}
+
+    Return: status value (0 valid, 1 invalid, 2 suspended, ...)
+    Raises StatusListError if the status list can not be fetched or is not valid.
+    """
+    try:
+        idx = status["status_list"]["idx"]
+        uri = status["status_list"]["uri"]
+    except (KeyError, TypeError) as e:
+        raise StatusListError("Invalid credential status") from e
+    if not isinstance(idx, int) or not isinstance(uri, str):
+        raise StatusListError("Invalid credential status")
+
+    local = cfgservice.service_url + LOCAL_PREFIX
+    if uri.startswith(local):
+        hosted = status_list.get_status_list(uri[len(local) :])
+        if hosted is None:
+            raise StatusListError("Unknown status list " + uri)
+        if not 0 <= idx < hosted.size:
+            raise StatusListError("Status list index out of range: " + str(idx))
+        return hosted.status(idx)
+
+    return _get(uri).get(idx)
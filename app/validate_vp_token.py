@@ -36,6 +36,7 @@ import datetime
 import hashlib
 from . import trusted_CAs
 from .app_config.config_service import ConfService as cfgservice
+from .status_list_client import StatusListError, credential_status
 
 
 def validate_vp_token(response_json, credentials_requested):
@@ -106,6 +107,13 @@ def validate_vp_token(response_json, credentials_requested):
 
             return True, errorMsg
 
+        if cfgservice.status_list_check:
+            error, errorMsg = validate_status(mdoc_cbor["documents"][pos])
+
+            if error == False:
+
+                return True, errorMsg
+
         # Validate values received are the same values requested
         namespaces = mdoc_cbor["documents"][pos]["issuerSigned"]["nameSpaces"]
 
@@ -143,6 +151,32 @@ def validate_vp_token(response_json, credentials_requested):
             return False, ""
 
 
+def validate_status(mdoc):
+    """
+    Function to check the status (status list entry) in the MSO of the mdoc
+
+    """
+    mso = cbor2.decoder.loads(
+        cbor2.decoder.loads(mdoc["issuerSigned"]["issuerAuth"][2]).value
+    )
+
+    if "status" not in mso:
+        return True, ""
+
+    try:
+        status = credential_status(mso["status"])
+    except StatusListError as e:
+        cfgservice.app_logger.warning(str(e))
+        return False, "Credential status could not be checked"
+
+    if status == 1:
+        return False, "Credential revoked"
+    if status != 0:
+        return False, "Credential status invalid: " + str(status)
+
+    return True, ""
+
+
 def validate_certificate(mdoc):
     """
     Function to validate certificate in MSO Header, the siganture and digests
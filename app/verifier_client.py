@@ -0,0 +1,157 @@
+# coding: latin-1
+###############################################################################
+# Copyright (c) 2023 European Commission
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+The PID Issuer Web service is a component of the PID Provider backend.
+Its main goal is to issue the PID in cbor/mdoc (ISO 18013-5 mdoc) and SD-JWT format.
+
+This verifier_client.py contains the client of the OpenID4VP verifier backend
+(cfgservice.dynamic_presentation_url).
+
+The transactions are created over one pooled HTTP session (keep-alive connections to the
+verifier) from cfgservice.verifier_workers threads, so that the same device and cross device
+transactions of a login page are created concurrently. The presentation definition of a set of
+requested credentials is built once.
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .app_config.config_service import ConfService as cfgservice
+
+NONCE = "hiCV7lZi5qAeCy7NFzUWSR4iCfSmRb99HfIvCkPaCLc="
+
+PRESENTATION_DEFINITION_ID = "32f54163-7166-48f1-93d8-ff217bdb0653"
+
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=cfgservice.verifier_pool_size),
+)
+_session.mount(
+    "http://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=cfgservice.verifier_pool_size),
+)
+_session.headers.update({"Content-Type": "application/json"})
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=cfgservice.verifier_workers, thread_name_prefix="verifier"
+                )
+    return _executor
+
+
+@lru_cache(maxsize=256)
+def _presentation_definition(credentials_requested):
+    input_descriptors = []
+
+    for id in credentials_requested:
+        for doctype in cfgservice.dynamic_issuing[id]:
+            fields = []
+            input_descriptors.append(
+                {
+                    "id": doctype,
+                    "format": {"mso_mdoc": {"alg": ["ES256", "ES384", "ES512", "EdDSA"]}},
+                    "name": "EUDI PID",
+                    "purpose": "We need to verify your identity",
+                    "constraints": {"fields": fields},
+                }
+            )
+            for namespace in cfgservice.dynamic_issuing[id][doctype]:
+                for attribute in cfgservice.dynamic_issuing[id][doctype][namespace]:
+                    fields.append(
+                        {
+                            "path": ["$['" + namespace + "']['" + attribute + "']"],
+                            "intent_to_retain": False,
+                        }
+                    )
+
+    # JSON encoded once, spliced in the transaction requests
+    return json.dumps(
+        {"id": PRESENTATION_DEFINITION_ID, "input_descriptors": input_descriptors}
+    )
+
+
+def presentation_definition(credentials_requested):
+    """Presentation definition (JSON) of the requested credentials
+
+    Keyword arguments:
+    + credentials_requested -- list of credential configuration ids (cfgservice.dynamic_issuing)
+
+    Return: JSON encoded presentation definition (cached per set of credentials)
+    """
+    return _presentation_definition(tuple(credentials_requested))
+
+
+def _create(body):
+    response = _session.post(
+        cfgservice.dynamic_presentation_url[:-1], data=body, timeout=cfgservice.verifier_timeout
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def create_transaction(credentials_requested, redirect_uri_template=None):
+    """Create a presentation transaction in the background
+
+    Keyword arguments:
+    + credentials_requested -- list of credential configuration ids
+    + redirect_uri_template -- wallet_response_redirect_uri_template (same device flow),
+      None for the cross device flow
+
+    Return: Future of the verifier response (client_id, request_uri, transaction_id)
+    """
+    body = (
+        '{"type": "vp_token", "nonce": '
+        + json.dumps(NONCE)
+        + ', "presentation_definition": '
+        + presentation_definition(credentials_requested)
+    )
+    if redirect_uri_template is not None:
+        body += ', "wallet_response_redirect_uri_template": ' + json.dumps(redirect_uri_template)
+    body += "}"
+
+    return _get_executor().submit(_create, body)
+
+
+def get_presentation(presentation_id, response_code=None):
+    """Presentation of a transaction (wallet response)
+
+    Keyword arguments:
+    + presentation_id -- transaction_id of the transaction
+    + response_code -- response_code of the same device flow
+
+    Return: requests.Response
+    """
+    url = cfgservice.dynamic_presentation_url + presentation_id + "?nonce=" + NONCE
+    if response_code is not None:
+        url += "&response_code=" + response_code
+    return _session.get(url, timeout=cfgservice.verifier_timeout)
@@ -0,0 +1,156 @@
+"""
+Benchmark of the credential response encryption.
+
+Compares, for each supported alg/enc, the inline cryptojwt JWE (wallet JWK parsed and JWE built
+on the request thread, as openid4v does) with app/response_encryption.py (key agreement made in advance). Every JWE is checked
+by decrypting it with jwcrypto. The wall time of an issuance (SD-JWT signed with
+app/sdjwt_engine.py) is then measured unencrypted, encrypted inline and encrypted with the key
+agreement running while the credential is signed.
+
+Usage (from the repository root): python scripts/bench_encryption.py [--responses 300]
+"""
+
+import argparse
+import base64
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from cryptojwt.jwe.jwe import JWE as CryptoJWE
+from cryptojwt.jwk.jwk import key_from_jwk_dict
+from jwcrypto.jwe import JWE
+from jwcrypto.jwk import JWK
+from sd_jwt.common import SDObj
+
+from app import response_encryption
+from app.sdjwt_engine import SDJWTEngine
+from app.signers import KeySigner
+
+ALGS = {"ECDH-ES": ("EC", "P-256"), "RSA-OAEP-256": ("RSA", 2048), "RSA-OAEP": ("RSA", 2048)}
+
+CLAIMS = {
+    "iss": "https://issuer.example",
+    "iat": 1700000000,
+    "exp": 1800000000,
+    "vct": "urn:eudi:pid:1",
+    SDObj("family_name"): "Sample_Family_Name",
+    SDObj("given_name"): "Sample_Given_name",
+    SDObj("birth_date"): "1990-11-11",
+    SDObj("nationalities"): ["FC"],
+    SDObj("issuing_country"): "FC",
+    SDObj("issuing_authority"): "Test PID issuer",
+    SDObj("portrait"): base64.urlsafe_b64encode(os.urandom(20000)).decode("ascii"),
+}
+
+
+def wallet_keys():
+    keys = {}
+    for alg, (kty, param) in ALGS.items():
+        if kty == "EC":
+            keys[alg] = JWK.generate(kty="EC", crv=param)
+        else:
+            keys[alg] = JWK.generate(kty="RSA", size=param)
+    return keys
+
+
+def issuer_engine():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark DS")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.datetime(2024, 1, 1))
+        .not_valid_after(datetime.datetime(2030, 1, 1))
+        .sign(key, hashes.SHA256())
+    )
+    return SDJWTEngine(KeySigner(key, certificate.public_bytes(serialization.Encoding.DER)))
+
+
+def inline_encrypt(encryption, response):
+    key = key_from_jwk_dict(encryption["jwk"])
+    return CryptoJWE(
+        json.dumps(response), alg=encryption["alg"], enc=encryption["enc"]
+    ).encrypt(keys=[key])
+
+
+def offload_encrypt(encryption, response):
+    return response_encryption.encrypt(
+        response_encryption.prepare(encryption), response
+    )
+
+
+def check(jwk, jwe, response):
+    token = JWE()
+    token.deserialize(jwe, key=jwk)
+    assert json.loads(token.payload) == response, "JWE payload mismatch"
+
+
+def timed(n, function):
+    start = time.perf_counter()
+    for _ in range(n):
+        function()
+    return (time.perf_counter() - start) / n * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--responses", type=int, default=300)
+    args = parser.parse_args()
+
+    keys = wallet_keys()
+    engine = issuer_engine()
+    response = {"credentials": [{"credential": engine.issue(CLAIMS)}], "notification_id": "n"}
+
+    print(f"{'alg':<14}{'enc':<16}{'inline (ms)':>12}{'service (ms)':>14}")
+    for alg, jwk in keys.items():
+        for enc in response_encryption.ENC_ALGORITHMS:
+            encryption = {"jwk": jwk.export_public(as_dict=True), "alg": alg, "enc": enc}
+            check(jwk, inline_encrypt(encryption, response), response)
+            check(jwk, offload_encrypt(encryption, response), response)
+
+            inline = timed(args.responses, lambda: inline_encrypt(encryption, response))
+            service = timed(args.responses, lambda: offload_encrypt(encryption, response))
+            print(f"{alg:<14}{enc:<16}{inline:12.3f}{service:14.3f}")
+
+    encryption = {
+        "jwk": keys["ECDH-ES"].export_public(as_dict=True),
+        "alg": "ECDH-ES",
+        "enc": "A256GCM",
+    }
+
+    def unencrypted():
+        return json.dumps({"credentials": [{"credential": engine.issue(CLAIMS)}]})
+
+    def encrypted_inline():
+        return inline_encrypt(encryption, {"credentials": [{"credential": engine.issue(CLAIMS)}]})
+
+    def encrypted_service():
+        encrypter = response_encryption.prepare(encryption)
+        issued = {"credentials": [{"credential": engine.issue(CLAIMS)}]}
+        return response_encryption.encrypt(encrypter, issued)
+
+    print()
+    print(f"issuance, unencrypted              {timed(args.responses, unencrypted):8.3f} ms")
+    print(f"issuance, ECDH-ES/A256GCM inline   {timed(args.responses, encrypted_inline):8.3f} ms")
+    print(f"issuance, ECDH-ES/A256GCM service  {timed(args.responses, encrypted_service):8.3f} ms")
+
+    start = time.perf_counter()
+    response_encryption.encrypt_many([(encryption, response)] * args.responses)
+    elapsed = time.perf_counter() - start
+    print(f"encrypt_many                       {elapsed / args.responses * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
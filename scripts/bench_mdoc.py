@@ -0,0 +1,147 @@
+"""
+Benchmark of the mdoc issuance.
+
+Compares the previous mdocFormatter path (COSE key dict, new MdocCborIssuer and certificate
+file read for each mdoc) with app/mdoc_issuer.py (issue and issue_many), using a generated
+P-256 document signer key and self-signed certificate. The mdocs of both paths are checked
+with the pymdoccbor verifier.
+
+Usage (from the repository root): python scripts/bench_mdoc.py [--mdocs 200]
+"""
+
+import argparse
+import base64
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from pymdoccbor.mdoc.issuer import MdocCborIssuer
+from pymdoccbor.mdoc.verifier import MdocCbor
+
+from app.mdoc_issuer import MdocIssuer
+from app.signers import KeySigner
+
+DOCTYPE = "eu.europa.ec.eudi.pid.1"
+
+VALIDITY = {
+    "issuance_date": datetime.date.today().strftime("%Y-%m-%d"),
+    "expiry_date": (datetime.date.today() + datetime.timedelta(days=90)).strftime("%Y-%m-%d"),
+}
+
+
+def pid_data():
+    return {
+        DOCTYPE: {
+            "family_name": "Sample_Family_Name",
+            "given_name": "Sample_Given_name",
+            "birth_date": "1990-11-11",
+            "nationality": ["FC"],
+            "place_of_birth": {"locality": "Locality", "country": "FC"},
+            "age_over_18": True,
+            "issuance_date": VALIDITY["issuance_date"],
+            "expiry_date": VALIDITY["expiry_date"],
+            "issuing_country": "FC",
+            "issuing_authority": "Test PID issuer",
+            "portrait": os.urandom(20000),
+        }
+    }
+
+
+def test_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark DS")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.datetime(2024, 1, 1))
+        .not_valid_after(datetime.datetime(2030, 1, 1))
+        .sign(key, hashes.SHA256())
+    )
+    return key, certificate.public_bytes(serialization.Encoding.DER)
+
+
+def device_key():
+    pem = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.urlsafe_b64encode(pem).decode("utf-8")
+
+
+def legacy_issue(key, cert_path, data, device_publickey):
+    priv_d = key.private_numbers().private_value
+    cose_pkey = {
+        "KTY": "EC2",
+        "CURVE": "P_256",
+        "ALG": "ES256",
+        "D": priv_d.to_bytes((priv_d.bit_length() + 7) // 8, "big"),
+        "KID": b"mdocIssuer",
+    }
+    mdoci = MdocCborIssuer(private_key=cose_pkey, alg="ES256")
+    mdoci.new(
+        doctype=DOCTYPE,
+        data=data,
+        validity=VALIDITY,
+        devicekeyinfo=device_publickey,
+        cert_path=cert_path,
+    )
+    return mdoci.dump()
+
+
+def verify(mdoc):
+    verifier = MdocCbor()
+    verifier.loads(mdoc.hex())
+    assert verifier.verify(), "mdoc not valid"
+
+
+def report(name, n, elapsed):
+    print(f"{name:<22} {n / elapsed:10.1f} mdoc/s ({elapsed / n * 1e3:8.3f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mdocs", type=int, default=200)
+    args = parser.parse_args()
+
+    key, certificate = test_key()
+    device_keys = [device_key() for _ in range(args.mdocs)]
+    issuer = MdocIssuer(KeySigner(key, certificate), DOCTYPE)
+
+    with tempfile.NamedTemporaryFile(suffix=".der", delete=False) as cert_file:
+        cert_file.write(certificate)
+
+    try:
+        verify(legacy_issue(key, cert_file.name, pid_data(), device_keys[0]))
+        verify(issuer.issue(pid_data(), device_keys[0], VALIDITY))
+
+        start = time.perf_counter()
+        for device_publickey in device_keys:
+            legacy_issue(key, cert_file.name, pid_data(), device_publickey)
+        report("MdocCborIssuer (legacy)", args.mdocs, time.perf_counter() - start)
+
+    finally:
+        os.unlink(cert_file.name)
+
+    start = time.perf_counter()
+    for device_publickey in device_keys:
+        issuer.issue(pid_data(), device_publickey, VALIDITY)
+    report("issuer issue", args.mdocs, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    issuer.issue_many(pid_data(), device_keys, VALIDITY)
+    report("issuer issue_many", args.mdocs, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark of the c_nonce issuance and verification.
+
+Compares the RSA-OAEP encrypted nonce (key file read and parsed for every nonce, as
+done by the openid4v nonce endpoint) with the HS256 and A256GCM nonces of
+app/nonce_service.py.
+
+Usage (from the repository root): python scripts/bench_nonce.py [--nonces 2000] [--rsa-nonces 10]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from cryptojwt.jwe.jwe import JWE
+from cryptojwt.jwk.rsa import RSAKey, import_private_rsa_key_from_file
+
+from app.app_config.config_service import ConfService as cfgservice
+from app import nonce_service
+from app.nonce_service import new_nonce, verify_nonce
+
+
+def rsa_new_nonce():
+    key = RSAKey(priv_key=import_private_rsa_key_from_file(cfgservice.nonce_key))
+    payload = json.dumps(
+        {
+            "iss": cfgservice.service_url[:-1],
+            "iat": int(time.time()),
+            "exp": int(time.time()) + 600,
+            "source_endpoint": cfgservice.service_url + "nonce",
+            "aud": [cfgservice.service_url + "credential"],
+        }
+    )
+    return JWE(payload, alg="RSA-OAEP", enc="A256GCM").encrypt(keys=[key])
+
+
+def rsa_verify_nonce(nonce):
+    key = RSAKey(priv_key=import_private_rsa_key_from_file(cfgservice.nonce_key))
+    return json.loads(JWE().decrypt(nonce, keys=[key]))["exp"] > time.time()
+
+
+def measure(name, create, verify, n):
+    start = time.perf_counter()
+    nonces = [create() for _ in range(n)]
+    created = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert all(verify(nonce) for nonce in nonces)
+    verified = time.perf_counter() - start
+
+    print(
+        f"{name:<9} issue {n / created:10.1f} nonce/s ({created / n * 1e6:10.1f} us)  "
+        f"verify {n / verified:10.1f} nonce/s ({verified / n * 1e6:10.1f} us)  "
+        f"length {len(nonces[0])}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nonces", type=int, default=2000)
+    parser.add_argument("--rsa-nonces", type=int, default=10)
+    args = parser.parse_args()
+
+    # benchmark secret when config_secrets.py still has the example value
+    if nonce_service.nonce_secret_key == "secret_here":
+        nonce_service.nonce_secret_key = os.urandom(32).hex()
+
+    measure("RSA-OAEP", rsa_new_nonce, rsa_verify_nonce, args.rsa_nonces)
+    for algorithm in ("HS256", "A256GCM"):
+        measure(
+            algorithm,
+            lambda: new_nonce(algorithm),
+            lambda nonce: verify_nonce(nonce, algorithm),
+            args.nonces,
+        )
+
+
+if __name__ == "__main__":
+    main()
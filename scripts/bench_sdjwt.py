@@ -0,0 +1,131 @@
+"""
+Benchmark of the SD-JWT issuance.
+
+Compares the previous sdjwtFormatter path (issuer and holder JWK built with get_jwk and a new
+SDJWTIssuer for each credential) with app/sdjwt_engine.py (issue and issue_many), using a
+generated P-256 document signer key and self-signed certificate.
+
+Usage (from the repository root): python scripts/bench_sdjwt.py [--credentials 200]
+"""
+
+import argparse
+import base64
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from jwcrypto.jwk import JWK
+from sd_jwt.common import SDObj
+from sd_jwt.issuer import SDJWTIssuer
+from sd_jwt.utils.demo_utils import get_jwk
+from sd_jwt.verifier import SDJWTVerifier
+
+from app.sdjwt_engine import SDJWTEngine, holder_jwk
+from app.signers import KeySigner
+
+CLAIMS = {
+    "iss": "https://issuer.example",
+    "iat": 1700000000,
+    "exp": 1800000000,
+    "vct": "urn:eudi:pid:1",
+    SDObj("family_name"): "Sample_Family_Name",
+    SDObj("given_name"): "Sample_Given_name",
+    SDObj("birth_date"): "1990-11-11",
+    SDObj("nationalities"): ["FC"],
+    SDObj("place_of_birth"): {SDObj("locality"): "Locality", SDObj("country"): "FC"},
+    SDObj("age_over_18"): True,
+    SDObj("issuing_country"): "FC",
+    SDObj("issuing_authority"): "Test PID issuer",
+}
+
+
+def test_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark DS")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.datetime(2024, 1, 1))
+        .not_valid_after(datetime.datetime(2030, 1, 1))
+        .sign(key, hashes.SHA256())
+    )
+    return key, certificate.public_bytes(serialization.Encoding.DER)
+
+
+def device_key():
+    pem = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.urlsafe_b64encode(pem).decode("utf-8")
+
+
+def legacy_issue(key, certificate, device_publickey):
+    issuer_jwk = JWK.from_pyca(key).export_private(as_dict=True)
+    jwk_kwargs = {
+        "issuer_key": issuer_jwk,
+        "holder_key": holder_jwk(device_publickey),
+        "key_size": 256,
+        "kty": "EC",
+    }
+    keys = get_jwk(jwk_kwargs, True, 0)
+    SDJWTIssuer.unsafe_randomness = False
+    SDJWTIssuer.SD_JWT_HEADER = "dc+sd-jwt"
+    return SDJWTIssuer(
+        CLAIMS,
+        keys["issuer_key"],
+        keys["holder_key"],
+        add_decoy_claims=False,
+        extra_header_parameters={"x5c": [base64.b64encode(certificate).decode("utf-8")]},
+    ).sd_jwt_issuance
+
+
+def report(name, n, elapsed):
+    print(f"{name:<22} {n / elapsed:10.1f} SD-JWT/s ({elapsed / n * 1e3:8.3f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--credentials", type=int, default=200)
+    args = parser.parse_args()
+
+    key, certificate = test_key()
+    device_keys = [device_key() for _ in range(args.credentials)]
+    engine = SDJWTEngine(KeySigner(key, certificate))
+
+    # the engine output is accepted by the sd_jwt verifier
+    issuer_public_key = JWK.from_pyca(key.public_key())
+    sd_jwt = engine.issue(CLAIMS, holder_jwk(device_keys[0]))
+    verified = SDJWTVerifier(
+        sd_jwt, lambda iss, header: issuer_public_key
+    ).get_verified_payload()
+    assert verified["place_of_birth"]["locality"] == "Locality", json.dumps(verified)
+
+    start = time.perf_counter()
+    for device_publickey in device_keys:
+        legacy_issue(key, certificate, device_publickey)
+    report("SDJWTIssuer (legacy)", args.credentials, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for device_publickey in device_keys:
+        engine.issue(CLAIMS, holder_jwk(device_publickey))
+    report("engine issue", args.credentials, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    engine.issue_many(CLAIMS, [holder_jwk(device_publickey) for device_publickey in device_keys])
+    report("engine issue_many", args.credentials, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
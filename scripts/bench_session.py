@@ -0,0 +1,107 @@
+"""
+Benchmark of the Flask session backends.
+
+Compares the Flask-Session filesystem backend with the kv_store based session
+interface (memory backend, and redis backend when REDIS_URL is set) on a read-mostly
+workload: every request reads the session and one request out of `--write-every`
+modifies it.
+
+Usage: python scripts/bench_session.py [--requests 5000] [--write-every 5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from flask import Flask, session
+from flask_session import Session
+
+from kv_store import get_store
+from session_store import StoreSessionInterface
+
+SESSION_DATA = {
+    "country": "FC",
+    "version": "0.6",
+    "route": "/dynamic/form_R2",
+    "credentials_requested": ["eu.europa.ec.eudi.pid_mdoc", "eu.europa.ec.eudi.pid_vc_sd_jwt"],
+    "authorization_params": {
+        "client_id": "ID",
+        "redirect_uri": "eu.europa.ec.euidi://authorization",
+        "scope": "openid",
+        "code_challenge": "-ciaVij0VMswVfqm3_GK758-_dAI0E9i97hu1SAOiFQ",
+        "code_challenge_method": "S256",
+        "state": "26bf0d94-b6a1-4543-9fde-b16a3dc19d09",
+    },
+}
+
+
+def make_app(backend, session_dir=None):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "bench"
+    app.config["SESSION_PERMANENT"] = False
+
+    if backend == "filesystem":
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config["SESSION_FILE_DIR"] = session_dir
+        app.config["SESSION_FILE_THRESHOLD"] = 100000
+        Session(app)
+    else:
+        app.session_interface = StoreSessionInterface(
+            get_store(backend, os.getenv("REDIS_URL")), lifetime=3600
+        )
+
+    @app.route("/login")
+    def login():
+        session.update(SESSION_DATA)
+        return "ok"
+
+    @app.route("/read")
+    def read():
+        return session["country"]
+
+    @app.route("/write")
+    def write():
+        session["tries"] = session.get("tries", 0) + 1
+        return "ok"
+
+    return app
+
+
+def run(backend, n_requests, write_every, session_dir=None):
+    app = make_app(backend, session_dir)
+    client = app.test_client()
+    client.get("/login")
+
+    start = time.perf_counter()
+    for i in range(n_requests):
+        if write_every and i % write_every == 0:
+            client.get("/write")
+        else:
+            client.get("/read")
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{backend:<12} {n_requests:>7} requests  {elapsed:8.3f} s  "
+        f"{n_requests / elapsed:10.1f} req/s  {elapsed / n_requests * 1e6:8.1f} us/req"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--write-every", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as session_dir:
+        run("filesystem", args.requests, args.write_every, session_dir)
+    run("memory", args.requests, args.write_every)
+    if os.getenv("REDIS_URL"):
+        run("redis", args.requests, args.write_every)
+
+
+if __name__ == "__main__":
+    main()
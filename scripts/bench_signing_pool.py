@@ -0,0 +1,160 @@
+"""
+Benchmark of the signing worker processes.
+
+Issues mdocs and SD-JWTs from a pool of request threads, signed on the threads (GIL bound)
+and on app/signing_pool.py worker processes (1, 2, 4, ... up to the number of cores), with a
+generated P-256 document signer key and self-signed certificate.
+
+Usage (from the repository root): python scripts/bench_signing_pool.py [--jobs 400] [--threads 16]
+"""
+
+import argparse
+import base64
+import datetime
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from sd_jwt.common import SDObj
+
+from app.mdoc_issuer import MdocIssuer
+from app.sdjwt_engine import SDJWTEngine, holder_jwk
+from app.signers import KeySigner
+from app.signing_pool import SigningPool
+
+COUNTRY = "BM"
+DOCTYPE = "eu.europa.ec.eudi.pid.1"
+
+VALIDITY = {
+    "issuance_date": datetime.date.today().strftime("%Y-%m-%d"),
+    "expiry_date": (datetime.date.today() + datetime.timedelta(days=90)).strftime("%Y-%m-%d"),
+}
+
+MDOC_DATA = {
+    DOCTYPE: {
+        "family_name": "Sample_Family_Name",
+        "given_name": "Sample_Given_name",
+        "birth_date": "1990-11-11",
+        "nationality": ["FC"],
+        "age_over_18": True,
+        "issuance_date": VALIDITY["issuance_date"],
+        "expiry_date": VALIDITY["expiry_date"],
+        "issuing_country": "FC",
+        "issuing_authority": "Test PID issuer",
+        "portrait": os.urandom(20000),
+    }
+}
+
+CLAIMS = {
+    "iss": "https://issuer.example",
+    "iat": 1700000000,
+    "exp": 1800000000,
+    "vct": "urn:eudi:pid:1",
+    SDObj("family_name"): "Sample_Family_Name",
+    SDObj("given_name"): "Sample_Given_name",
+    SDObj("birth_date"): "1990-11-11",
+    SDObj("nationalities"): ["FC"],
+    SDObj("issuing_country"): "FC",
+    SDObj("issuing_authority"): "Test PID issuer",
+}
+
+
+def write_key(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark DS")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.datetime(2024, 1, 1))
+        .not_valid_after(datetime.datetime(2030, 1, 1))
+        .sign(key, hashes.SHA256())
+    )
+    key_path = os.path.join(directory, "ds.key.pem")
+    cert_path = os.path.join(directory, "ds.cert.der")
+    with open(key_path, "wb") as key_file:
+        key_file.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    with open(cert_path, "wb") as cert_file:
+        cert_file.write(certificate.public_bytes(serialization.Encoding.DER))
+
+    return key, certificate.public_bytes(serialization.Encoding.DER), {
+        "pid_mdoc_privkey": key_path,
+        "pid_mdoc_privkey_passwd": None,
+        "pid_mdoc_cert": cert_path,
+    }
+
+
+def device_key():
+    pem = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.urlsafe_b64encode(pem).decode("utf-8")
+
+
+def run(threads, jobs, issue):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(issue, jobs))
+    return len(jobs) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    device_keys = [device_key() for _ in range(args.jobs)]
+    holder_jwks = [holder_jwk(device_publickey) for device_publickey in device_keys]
+
+    with tempfile.TemporaryDirectory() as directory:
+        key, certificate, settings = write_key(directory)
+        signer = KeySigner(key, certificate)
+        issuer = MdocIssuer(signer, DOCTYPE)
+        engine = SDJWTEngine(signer)
+
+        print(f"{'signing':<22}{'mdoc/s':>10}{'SD-JWT/s':>10}")
+        mdoc = run(args.threads, device_keys, lambda k: issuer.issue(MDOC_DATA, k, VALIDITY))
+        sdjwt = run(args.threads, holder_jwks, lambda k: engine.issue(CLAIMS, k))
+        print(f"{'request threads':<22}{mdoc:10.1f}{sdjwt:10.1f}")
+
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            pool = SigningPool(workers, 256, {COUNTRY: settings})
+            try:
+                # start the workers (keys loaded once per worker)
+                run(workers, holder_jwks[: workers * 4], lambda k: pool.issue_sdjwt(COUNTRY, CLAIMS, k))
+
+                mdoc = run(
+                    args.threads,
+                    device_keys,
+                    lambda k: pool.issue_mdoc(COUNTRY, DOCTYPE, MDOC_DATA, k, VALIDITY),
+                )
+                sdjwt = run(
+                    args.threads, holder_jwks, lambda k: pool.issue_sdjwt(COUNTRY, CLAIMS, k)
+                )
+                print(f"{str(workers) + ' worker(s)':<22}{mdoc:10.1f}{sdjwt:10.1f}")
+            finally:
+                pool.shutdown()
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
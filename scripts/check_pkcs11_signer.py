@@ -0,0 +1,85 @@
+"""
+Check of a PKCS#11 document signer (app/signers.py PKCS11Signer), e.g. against SoftHSM.
+
+Signs from a pool of threads with 1 and --sessions PKCS#11 sessions, verifies every signature
+with the certificate public key, and prints the signatures per second.
+
+SoftHSM token with a P-256 document signer key (PKCS#8 PEM) and its certificate:
+
+    softhsm2-util --init-token --free --label eudiw --pin 1234 --so-pin 123456
+    softhsm2-util --import ds.key.pem --token eudiw --label ds --id 01 --pin 1234
+
+Usage (from the repository root):
+    python scripts/check_pkcs11_signer.py --module /usr/lib/softhsm/libsofthsm2.so \
+        --token eudiw --pin 1234 --key-label ds --cert ds.cert.pem [--signs 2000] [--sessions 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+from app.signers import CURVES, PKCS11Signer, load_certificate
+
+
+def verifier(certificate_der):
+    public_key = x509.load_der_x509_certificate(certificate_der).public_key()
+    hash_algorithm, _, size = CURVES[public_key.curve.name]
+
+    def verify(data, signature):
+        public_key.verify(
+            encode_dss_signature(
+                int.from_bytes(signature[:size], "big"), int.from_bytes(signature[size:], "big")
+            ),
+            data,
+            ec.ECDSA(hash_algorithm),
+        )
+
+    return verify
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", required=True)
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--pin", required=True)
+    parser.add_argument("--key-label", required=True)
+    parser.add_argument("--cert", required=True)
+    parser.add_argument("--signs", type=int, default=2000)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    certificate = load_certificate(args.cert)
+    verify = verifier(certificate)
+    messages = [os.urandom(64) for _ in range(args.signs)]
+
+    for sessions in sorted({1, args.sessions}):
+        signer = PKCS11Signer(
+            args.module, args.token, args.pin, args.key_label, certificate, sessions
+        )
+        try:
+            verify(messages[0], signer.sign(messages[0]))
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                signatures = list(executor.map(signer.sign, messages))
+            elapsed = time.perf_counter() - start
+        finally:
+            signer.close()
+
+        for message, signature in zip(messages, signatures):
+            verify(message, signature)
+        print(f"{sessions:3d} session(s) {args.signs / elapsed:10.1f} signatures/s (verified)")
+
+
+if __name__ == "__main__":
+    main()